@@ -1,3 +1,5 @@
+import json
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -5,12 +7,17 @@ from fastapi import Depends, HTTPException, status, APIRouter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
+from .cache import TTLCache
 from .config import get_settings
 from .db import get_db_session
+from .executors import run_cpu
+from .metrics import password_hash_duration
 from .models import User
+from .redis_client import get_redis
 from .schemas import Token, UserCreate, UserRead # Added for router functions
 
 
@@ -18,6 +25,11 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
+def warm_up_password_hashing() -> None:
+    # passlib выбирает и проверяет backend bcrypt при первом хэше — делаем это при старте, а не в первом логине
+    pwd_context.handler().get_backend()
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -26,6 +38,19 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+# bcrypt намеренно медленный — считаем в пуле cpu, вне event loop. Время меряем здесь, в процессе воркера:
+# при CPU_PROCESSES > 0 хэш считается в дочернем процессе, и его метрики в /metrics не попали бы.
+# Включает ожидание места в пуле — это и есть задержка, которую видит запрос
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    with password_hash_duration.labels("verify").time():
+        return await run_cpu(verify_password, plain_password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    with password_hash_duration.labels("hash").time():
+        return await run_cpu(get_password_hash, password)
+
+
 def create_access_token(subject: int, expires_delta: Optional[timedelta] = None) -> str:
     settings = get_settings()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -43,37 +68,111 @@ def decode_token(token: str):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-async def get_current_user(session: AsyncSession = Depends(get_db_session), token: str = Depends(oauth2_scheme)) -> User:
+# Кэш проверенных токенов (token -> user_id) и активных пользователей (user_id -> колонки User).
+# Деактивация пользователя вступает в силу не позже AUTH_CACHE_TTL_SECONDS на всех воркерах,
+# а на текущем воркере — сразу (см. invalidate_user)
+_settings = get_settings()
+_token_cache: TTLCache[int] = TTLCache(_settings.AUTH_CACHE_MAX_ENTRIES, _settings.AUTH_CACHE_TTL_SECONDS)
+_user_cache: TTLCache[dict] = TTLCache(_settings.AUTH_CACHE_MAX_ENTRIES, _settings.AUTH_CACHE_TTL_SECONDS)
+# password_hash намеренно не кэшируем (и тем более не кладём в Redis)
+_USER_CACHE_COLUMNS = ("id", "email", "full_name", "is_active", "created_at")
+_SHARED_USER_KEY = "auth:user:{}"
+
+
+def _decode_user_id(token: str) -> int:
+    # Бросает JWTError/ValueError; успешный результат кэшируется не дольше срока жизни токена
+    user_id = _token_cache.get(token)
+    if user_id is not None:
+        return user_id
     settings = get_settings()
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    subject = payload.get("sub")
+    if subject is None:
+        raise ValueError("subject is missing")
+    user_id = int(subject)
+    ttl = min(settings.AUTH_CACHE_TTL_SECONDS, payload["exp"] - time.time()) if "exp" in payload else None
+    _token_cache.set(token, user_id, ttl)
+    return user_id
+
+
+def _user_from_snapshot(snapshot: dict) -> User:
+    # Отсоединённый от сессии объект с identity key: его можно читать и при необходимости session.merge()
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
+
+async def _load_shared_snapshot(user_id: int) -> Optional[dict]:
+    raw = await get_redis().get(_SHARED_USER_KEY.format(user_id))
+    if raw is None:
+        return None
+    snapshot = json.loads(raw)
+    snapshot["created_at"] = datetime.fromisoformat(snapshot["created_at"])
+    return snapshot
+
+
+async def _store_shared_snapshot(snapshot: dict) -> None:
+    raw = json.dumps({**snapshot, "created_at": snapshot["created_at"].isoformat()})
+    await get_redis().set(_SHARED_USER_KEY.format(snapshot["id"]), raw, ex=get_settings().AUTH_CACHE_TTL_SECONDS)
+
+
+async def get_active_user(session: AsyncSession, user_id: int) -> Optional[User]:
+    snapshot = _user_cache.get(user_id)
+    shared = get_settings().AUTH_CACHE_SHARED
+    if snapshot is None and shared:
+        snapshot = await _load_shared_snapshot(user_id)
+        if snapshot is not None:
+            _user_cache.set(user_id, snapshot)
+    if snapshot is None:
+        result = await session.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
+        if user is None or not user.is_active:
+            return None
+        snapshot = {column: getattr(user, column) for column in _USER_CACHE_COLUMNS}
+        _user_cache.set(user_id, snapshot)
+        if shared:
+            await _store_shared_snapshot(snapshot)
+        return user
+    return _user_from_snapshot(snapshot)
+
+
+def invalidate_token(token: str) -> None:
+    _token_cache.pop(token)
+
+
+async def invalidate_user(user_id: int) -> None:
+    """Вызывать при деактивации/изменении пользователя в обход ORM (например, bulk UPDATE)."""
+    _user_cache.pop(user_id)
+    if get_settings().AUTH_CACHE_SHARED:
+        await get_redis().delete(_SHARED_USER_KEY.format(user_id))
+
+
+@event.listens_for(User, "after_update")
+def _on_user_update(mapper, connection, target: User) -> None:
+    # Изменения через ORM сбрасывают локальный кэш сразу; общий уровень истечёт по TTL
+    _user_cache.pop(target.id)
+
+
+async def get_current_user(session: AsyncSession = Depends(get_db_session), token: str = Depends(oauth2_scheme)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        subject = payload.get("sub")
-        if subject is None:
-            raise credentials_exception
-        user_id = int(subject)
-    except JWTError:
+        user_id = _decode_user_id(token)
+    except (JWTError, ValueError):
         raise credentials_exception
 
-    result = await session.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
-    if user is None or not user.is_active:
+    user = await get_active_user(session, user_id)
+    if user is None:
         raise credentials_exception
     return user
 
 
 def decode_access_token_user_id(token: str) -> int:
-    settings = get_settings()
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        subject = payload.get("sub")
-        if subject is None:
-            raise ValueError("subject is missing")
-        return int(subject)
+        return _decode_user_id(token)
     except JWTError as exc:
         raise ValueError("invalid token") from exc
 
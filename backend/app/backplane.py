@@ -0,0 +1,297 @@
+# backplane.py
+# Доставка сообщений чата между воркерами/нодами.
+# Каждый воркер держит свои сокеты, а backplane знает, на каких воркерах у пользователя есть соединения
+# (реестр presence; устройств может быть несколько), и пересылает туда сообщения пачками через pub/sub.
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Collection, Dict, List, Optional, Set, Tuple
+
+from .config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+# (user_id, JSON события, kind). kind — метка для воркера получателя, чтобы обработать событие,
+# не разбирая JSON: "" — сообщение чата, остальные задают вызывающие (например, presence.TYPING_KIND)
+Deliver = Callable[[int, str, str], Awaitable[None]]
+Item = Tuple[int, str, str]
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Backplane:
+    def __init__(self, batch_size: int = 100, flush_interval: float = 0.005) -> None:
+        self.worker_id = make_worker_id()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._deliver: Optional[Deliver] = None
+        self._pending: Dict[str, List[Item]] = {}
+        self._pending_count = 0
+        self._has_pending: Optional[asyncio.Event] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        # Примитивы создаём здесь, чтобы они были привязаны к работающему event loop
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    # Реестр presence: user -> воркеры, где у него есть соединения.
+    # register/unregister вызываются на первом и последнем соединении пользователя на этом воркере
+    async def register(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    async def unregister(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    async def locate(self, user_id: int) -> List[str]:
+        raise NotImplementedError
+
+    async def _send_batch(self, worker_id: str, items: List[Item]) -> None:
+        raise NotImplementedError
+
+    async def locate_many(self, user_ids: List[int]) -> List[List[str]]:
+        return [await self.locate(user_id) for user_id in user_ids]
+
+    async def publish(self, user_id: int, message: str, delivered_locally: Collection[int] = (), kind: str = "") -> bool:
+        """Ставит сообщение в очередь на воркеры получателя. False — пользователь нигде не подключён."""
+        return await self.publish_many([user_id], message, delivered_locally, kind) > 0
+
+    async def publish_many(
+        self, user_ids: List[int], message: str, delivered_locally: Collection[int] = (), kind: str = "",
+    ) -> int:
+        """Рассылка одного сообщения нескольким пользователям на все их воркеры; возвращает, скольких удалось найти.
+
+        delivered_locally — пользователи, которым вызывающий уже отдал сообщение в сокеты этого воркера.
+        """
+        found = 0
+        for user_id, workers in zip(user_ids, await self.locate_many(user_ids)):
+            if workers or user_id in delivered_locally:
+                found += 1
+            for worker_id in workers:
+                if worker_id == self.worker_id:
+                    if user_id not in delivered_locally:
+                        # Сокет оказался у нас (например, переподключился между проверками)
+                        await self._deliver(user_id, message, kind)
+                    continue
+                self._pending.setdefault(worker_id, []).append((user_id, message, kind))
+                self._pending_count += 1
+        if self._pending:
+            self._has_pending.set()
+            if self._pending_count >= self.batch_size:
+                self._batch_full.set()
+        return found
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._pending_count = 0
+        for worker_id, items in pending.items():
+            await self._send_batch(worker_id, items)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            if self._pending_count < self.batch_size:
+                # Копим пачку, но не дольше flush_interval
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._has_pending.clear()
+            self._batch_full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("backplane flush failed")
+
+    async def _receive(self, items: List[Item]) -> None:
+        for item in items:
+            # Пачки от воркеров старой версии (при выкладке) — пары без kind
+            user_id, message = item[0], item[1]
+            kind = item[2] if len(item) > 2 else ""
+            try:
+                await self._deliver(user_id, message, kind)
+            except Exception:
+                logger.exception("backplane delivery to user %s failed", user_id)
+
+
+class LocalBus:
+    """In-process замена Redis: общий реестр для нескольких backplane в одном процессе (dev/тесты)."""
+
+    def __init__(self) -> None:
+        self.workers: Dict[str, "LocalBackplane"] = {}
+        self.presence: Dict[int, Set[str]] = {}
+
+
+default_bus = LocalBus()
+
+
+class LocalBackplane(Backplane):
+    def __init__(self, bus: Optional[LocalBus] = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.bus = bus or default_bus
+
+    async def start(self, deliver: Deliver) -> None:
+        self.bus.workers[self.worker_id] = self
+        await super().start(deliver)
+
+    async def stop(self) -> None:
+        await super().stop()
+        self.bus.workers.pop(self.worker_id, None)
+        for user_id in [u for u, workers in self.bus.presence.items() if self.worker_id in workers]:
+            await self.unregister(user_id)
+
+    async def register(self, user_id: int) -> None:
+        self.bus.presence.setdefault(user_id, set()).add(self.worker_id)
+
+    async def unregister(self, user_id: int) -> None:
+        workers = self.bus.presence.get(user_id)
+        if workers is not None:
+            workers.discard(self.worker_id)
+            if not workers:
+                del self.bus.presence[user_id]
+
+    async def locate(self, user_id: int) -> List[str]:
+        return list(self.bus.presence.get(user_id, ()))
+
+    async def _send_batch(self, worker_id: str, items: List[Item]) -> None:
+        target = self.bus.workers.get(worker_id)
+        if target is None:
+            return
+        await target._receive(items)
+
+
+class RedisBackplane(Backplane):
+    # Presence — sorted set на пользователя: воркер -> время истечения записи (unix time).
+    # Так у каждого воркера свой TTL, а запись упавшего воркера перестаёт учитываться сама
+    PRESENCE_KEY = "chat:presence:{}"
+    WORKER_CHANNEL = "chat:worker:{}"
+
+    def __init__(self, redis, presence_ttl: int = 60, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.redis = redis
+        self.presence_ttl = presence_ttl
+        self._local_users: Set[int] = set()
+        self._pubsub = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.WORKER_CHANNEL.format(self.worker_id))
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._refresh_presence()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await super().stop()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        for user_id in list(self._local_users):
+            await self.unregister(user_id)
+
+    async def register(self, user_id: int) -> None:
+        self._local_users.add(user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._touch(pipe, user_id, time.time())
+            await pipe.execute()
+
+    async def unregister(self, user_id: int) -> None:
+        self._local_users.discard(user_id)
+        await self.redis.zrem(self.PRESENCE_KEY.format(user_id), self.worker_id)
+
+    async def locate(self, user_id: int) -> List[str]:
+        return (await self.locate_many([user_id]))[0]
+
+    async def locate_many(self, user_ids: List[int]) -> List[List[str]]:
+        if not user_ids:
+            return []
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zrangebyscore(self.PRESENCE_KEY.format(user_id), now, "+inf")
+            results = await pipe.execute()
+        return [[worker.decode() for worker in workers] for workers in results]
+
+    def _touch(self, pipe, user_id: int, now: float) -> None:
+        key = self.PRESENCE_KEY.format(user_id)
+        pipe.zadd(key, {self.worker_id: now + self.presence_ttl})
+        pipe.zremrangebyscore(key, 0, now)
+        pipe.expire(key, self.presence_ttl)
+
+    async def _send_batch(self, worker_id: str, items: List[Item]) -> None:
+        receivers = await self.redis.publish(self.WORKER_CHANNEL.format(worker_id), json.dumps(items))
+        if receivers == 0:
+            # Воркер умер, не успев снять свои записи presence — чистим их
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id in {item[0] for item in items}:
+                    pipe.zrem(self.PRESENCE_KEY.format(user_id), worker_id)
+                await pipe.execute()
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for msg in self._pubsub.listen():
+                    if msg["type"] != "message":
+                        continue
+                    await self._receive(json.loads(msg["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("backplane listener failed, resubscribing")
+                await asyncio.sleep(1)
+
+    async def _refresh_presence(self) -> None:
+        # Продлеваем TTL своих записей, чтобы после падения воркера они истекли сами
+        while True:
+            await asyncio.sleep(max(self.presence_ttl / 3, 1))
+            if not self._local_users:
+                continue
+            try:
+                now = time.time()
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for user_id in self._local_users:
+                        self._touch(pipe, user_id, now)
+                    await pipe.execute()
+            except Exception:
+                logger.exception("presence refresh failed")
+
+
+def create_backplane() -> Backplane:
+    settings = get_settings()
+    options = dict(
+        batch_size=settings.CHAT_BACKPLANE_BATCH_SIZE,
+        flush_interval=settings.CHAT_BACKPLANE_FLUSH_MS / 1000,
+    )
+    if settings.CHAT_BACKPLANE == "redis":
+        from .redis_client import get_redis
+
+        return RedisBackplane(get_redis(), presence_ttl=settings.CHAT_PRESENCE_TTL_SECONDS, **options)
+    return LocalBackplane(**options)
@@ -1,32 +1,131 @@
 # db.py
-from typing import AsyncGenerator
+import time
+from typing import AsyncGenerator, Dict
 
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from .config import get_settings
+from .metrics import db_checkout_wait, instrument_engine
 
 
 class Base(DeclarativeBase):
     pass
 
 
-def create_engine() -> AsyncEngine:
+class PoolStats:
+    """Сколько запросы ждут свободное соединение из пула."""
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe(self, wait: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds_total += wait
+        if wait > self.wait_seconds_max:
+            self.wait_seconds_max = wait
+
+
+pool_stats: Dict[str, PoolStats] = {}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    stats: PoolStats
+    wait_histogram = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            self.stats.observe(wait)
+            self.wait_histogram.observe(wait)
+
+    def recreate(self):
+        # engine.dispose() пересоздаёт пул — статистику переносим
+        pool = super().recreate()
+        pool.stats = self.stats
+        pool.wait_histogram = self.wait_histogram
+        return pool
+
+
+def create_engine(url: str = "", name: str = "primary") -> AsyncEngine:
     settings = get_settings()
-    return create_async_engine(settings.DATABASE_URL, echo=settings.DEBUG, future=True)
+    url = url or settings.DATABASE_URL
+    options = {"echo": settings.DB_ECHO, "future": True}
+    if not url.startswith("sqlite"):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+    if "+asyncpg" in url:
+        # Кэш подготовленных выражений: на стороне asyncpg и на стороне диалекта SQLAlchemy
+        options["connect_args"] = {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+        parsed = make_url(url)
+        if "prepared_statement_cache_size" not in parsed.query:
+            parsed = parsed.update_query_dict({"prepared_statement_cache_size": str(settings.DB_PREPARED_STATEMENT_CACHE_SIZE)})
+        url = parsed.render_as_string(hide_password=False)
+
+    new_engine = create_async_engine(url, **options)
+    if isinstance(new_engine.pool, TimedQueuePool):
+        new_engine.pool.stats = pool_stats[name] = PoolStats()
+        new_engine.pool.wait_histogram = db_checkout_wait.labels(name)
+    instrument_engine(new_engine, name)
+    return new_engine
+
+
+def pool_metrics() -> Dict[str, dict]:
+    engines = {"primary": engine, "replica": read_engine}
+    result = {}
+    for name, stats in pool_stats.items():
+        pool = engines[name].pool
+        result[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": stats.checkouts,
+            "timeouts": stats.timeouts,
+            "wait_seconds_total": round(stats.wait_seconds_total, 6),
+            "wait_seconds_max": round(stats.wait_seconds_max, 6),
+        }
+    return result
 
 
 engine: AsyncEngine = create_engine()
 async_session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+# Read-only маршруты (список пользователей, история) можно увести на реплику.
+# Без DATABASE_READ_URL реплика — это основная БД
+read_engine: AsyncEngine = (
+    create_engine(get_settings().DATABASE_READ_URL, name="replica") if get_settings().DATABASE_READ_URL else engine
+)
+read_session_factory = sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False)
+
 
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_factory() as session:
         yield session
 
 
+async def get_read_db_session() -> AsyncGenerator[AsyncSession, None]:
+    async with read_session_factory() as session:
+        yield session
 
 
-
-
-
+async def dispose_engines() -> None:
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
@@ -0,0 +1,111 @@
+# executors.py
+# Ограниченные пулы для блокирующей работы, чтобы она не останавливала event loop (и все WebSocket воркера):
+#   io  — файловый ввод-вывод, шифрование и превью медиа (потоки);
+#   cpu — bcrypt (потоки, либо процессы при CPU_PROCESSES > 0).
+# Сверх max_pending задачи ждут на стороне asyncio и видны в метрике waiting.
+# Размер пула 0 — выполнять прямо в event loop (как было раньше; удобно для сравнения в бенчмарке).
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from .config import get_settings
+
+
+T = TypeVar("T")
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, executor: Optional[Executor], workers: int, max_pending: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = executor
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.wait_seconds_total = 0.0
+        self.run_seconds_total = 0.0
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._executor is None:
+            return fn(*args)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = time.perf_counter()
+        self.wait_seconds_total += started_at - queued_at
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.run_seconds_total += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            # Задачи, отправленные в пул, но ещё не взятые потоком/процессом
+            "queued": max(self.in_flight - self.workers, 0) if self._executor is not None else 0,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "run_seconds_total": round(self.run_seconds_total, 6),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=False)
+
+
+_executors: Dict[str, BoundedExecutor] = {}
+
+
+def _create(name: str) -> BoundedExecutor:
+    settings = get_settings()
+    if name == "io":
+        workers = settings.IO_THREADS
+        executor = ThreadPoolExecutor(workers, thread_name_prefix="io") if workers > 0 else None
+        return BoundedExecutor(name, executor, workers, settings.IO_MAX_PENDING)
+    if settings.CPU_PROCESSES > 0:
+        workers = settings.CPU_PROCESSES
+        executor = ProcessPoolExecutor(workers)
+    else:
+        workers = settings.CPU_THREADS
+        executor = ThreadPoolExecutor(workers, thread_name_prefix="cpu") if workers > 0 else None
+    return BoundedExecutor(name, executor, workers, settings.CPU_MAX_PENDING)
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    executor = _executors.get(name)
+    if executor is None:
+        executor = _executors[name] = _create(name)
+    return executor
+
+
+async def run_io(fn: Callable[..., T], *args: Any) -> T:
+    return await get_executor("io").run(fn, *args)
+
+
+async def run_cpu(fn: Callable[..., T], *args: Any) -> T:
+    return await get_executor("cpu").run(fn, *args)
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: get_executor(name).stats() for name in ("io", "cpu")}
+
+
+def shutdown_executors() -> None:
+    for executor in _executors.values():
+        executor.shutdown()
+    _executors.clear()
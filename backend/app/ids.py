@@ -0,0 +1,123 @@
+# ids.py
+# Идентификаторы сообщений генерируем в приложении (в стиле snowflake), чтобы id был известен
+# сразу при отправке — до того, как сообщение попадёт в БД.
+# Формат укладывается в 53 бита, чтобы id без потерь читались в JavaScript (Number.MAX_SAFE_INTEGER):
+# 41 бит — миллисекунды от EPOCH_MS, 6 бит — воркер, 6 бит — счётчик в пределах миллисекунды.
+import asyncio
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 6
+SEQUENCE_BITS = 6
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class IdGenerator:
+    def __init__(self, worker_id: int) -> None:
+        self.worker_id = worker_id & MAX_WORKER_ID
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            # Если часы ушли назад — продолжаем с последней использованной миллисекунды
+            now = max(int(time.time() * 1000), self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    while now <= self._last_ms:
+                        now = int(time.time() * 1000)
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+# Без Redis номер воркера случайный (в этом режиме процесс чата один)
+_generator = IdGenerator(random.getrandbits(WORKER_BITS))
+
+
+def next_message_id() -> int:
+    return _generator.next_id()
+
+
+def min_id_at(timestamp_ms: int) -> int:
+    # Наименьший id, который мог быть выдан в эту миллисекунду: позволяет отсекать сообщения по времени через индекс по id
+    return max(timestamp_ms - EPOCH_MS, 0) << (WORKER_BITS + SEQUENCE_BITS)
+
+
+def id_timestamp_ms(message_id: int) -> int:
+    # Миллисекунда выдачи id (по часам выдавшего воркера)
+    return (message_id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+
+
+class WorkerIdLease:
+    """Номер воркера, арендованный в Redis: ключ ids:worker:<n> с TTL, пока процесс жив — продлевается.
+
+    Счётчик с переполнением по модулю 64 выдал бы долгоживущему воркеру и воркеру, запущенному
+    на 64 выдачи позже, один номер — а с ним одинаковые id сообщений. Аренда гарантирует, что
+    номер занят не более чем одним живым процессом; если свободных нет, старт падает.
+    """
+
+    KEY = "ids:worker:{}"
+    # Продлеваем и удаляем только свою аренду: номер мог уже перейти другому процессу
+    _REFRESH = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end return 0"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, redis, ttl: int) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.worker_id: Optional[int] = None
+        self._token = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self) -> int:
+        # Начинаем со случайного номера, чтобы одновременно стартующие воркеры не спорили за один ключ
+        start = random.randrange(MAX_WORKER_ID + 1)
+        for i in range(MAX_WORKER_ID + 1):
+            worker_id = (start + i) & MAX_WORKER_ID
+            if await self.redis.set(self.KEY.format(worker_id), self._token, nx=True, ex=self.ttl):
+                self.worker_id = worker_id
+                _generator.worker_id = worker_id
+                return worker_id
+        raise RuntimeError(f"no free worker id: all {MAX_WORKER_ID + 1} are leased")
+
+    async def start(self) -> int:
+        worker_id = await self.acquire()
+        self._task = asyncio.create_task(self._refresh_loop())
+        return worker_id
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.worker_id is not None:
+            await self.redis.eval(self._RELEASE, 1, self.KEY.format(self.worker_id), self._token)
+            self.worker_id = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self.redis.eval(self._REFRESH, 1, self.KEY.format(self.worker_id), self._token, self.ttl):
+                    # Аренда истекла (например, Redis был недоступен дольше TTL) — номер мог занять другой воркер
+                    logger.error("worker id %d lease lost, acquiring a new one", self.worker_id)
+                    await self.acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("failed to refresh worker id lease")
@@ -0,0 +1,187 @@
+# inbox.py
+# Офлайн-входящие: сообщения, пропущенные пользователем, берутся из таблицы messages
+# по отметке доставки (InboxState.delivered_message_id) и отдаются пачками сразу после подключения.
+# Клиент подтверждает полученное кадром {"type": "ack", "up_to": <id>}; подтверждения копятся
+# в памяти и пишутся в БД одной пачкой раз в CHAT_ACK_FLUSH_MS.
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .config import get_settings
+from .db import async_session_factory
+from .ids import id_timestamp_ms, min_id_at
+from .message_store import message_writer
+from .models import Conversation, InboxState, Membership, Message
+
+
+logger = logging.getLogger(__name__)
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class DeliveryTracker:
+    # Сколько ждать запись сообщений из очереди writer'а перед чтением backlog, секунд
+    WRITER_FLUSH_TIMEOUT = 5.0
+
+    def __init__(
+        self,
+        session_factory,
+        batch_size: int = 200,
+        max_age_days: int = 30,
+        flush_interval: float = 1.0,
+        ack_holdback_ms: int = 10000,
+    ) -> None:
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_age_days = max_age_days
+        self.flush_interval = flush_interval
+        self.ack_holdback_ms = ack_holdback_ms
+        # user_id -> максимальный подтверждённый id, ещё не записанный в БД
+        self._pending: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def ack(self, user_id: int, message_id: int) -> None:
+        # Отметка одна на пользователя, а сообщения с меньшими id могут ещё лежать в очереди writer'а
+        # другого воркера: после записи они оказались бы ниже отметки и в backlog не попали бы никогда.
+        # Поэтому отметку держим на ack_holdback_ms раньше подтверждённого (и не позже текущего момента —
+        # id "из будущего" не принимаем). Уже полученное клиент может увидеть в backlog ещё раз и уберёт дубли по id
+        timestamp_ms = min(id_timestamp_ms(message_id), int(time.time() * 1000))
+        message_id = min(message_id, min_id_at(timestamp_ms - self.ack_holdback_ms))
+        if message_id > self._pending.get(user_id, 0):
+            self._pending[user_id] = message_id
+
+    async def watermark(self, user_id: int) -> int:
+        async with self._session_factory() as session:
+            stored = (await session.execute(
+                select(InboxState.delivered_message_id).where(InboxState.user_id == user_id)
+            )).scalar_one_or_none()
+        if stored is None:
+            # Отметки ещё нет (новый пользователь или первый запуск) — не отдаём всю историю
+            stored = min_id_at(int((time.time() - self.max_age_days * 86400) * 1000))
+        return max(stored, self._pending.get(user_id, 0))
+
+    async def backlog(self, user_id: int) -> AsyncIterator[dict]:
+        """События {"type": "backlog", "messages": [...], "more": bool}; последнее — с more=false."""
+        try:
+            try:
+                # Сообщения, принятые этим воркером, но ещё не записанные, тоже должны попасть в backlog
+                await asyncio.wait_for(message_writer.flush(), self.WRITER_FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("message writer flush timed out, backlog for user %s may be incomplete", user_id)
+
+            after = await self.watermark(user_id)
+            while True:
+                # Сессия на каждую пачку: не держим соединение из пула, пока медленный клиент читает
+                async with self._session_factory() as session:
+                    rows = (await session.execute(
+                        select(
+                            Message.id,
+                            Message.sender_id,
+                            Message.content,
+                            Message.image_url,
+                            Message.conversation_id,
+                            Message.created_at,
+                            Conversation.is_group,
+                        )
+                        .join(Membership, Membership.conversation_id == Message.conversation_id)
+                        .join(Conversation, Conversation.id == Message.conversation_id)
+                        .where(Membership.user_id == user_id, Message.id > after, Message.sender_id != user_id)
+                        .order_by(Message.id)
+                        .limit(self.batch_size)
+                    )).all()
+                more = len(rows) == self.batch_size
+                # Формат сообщений — как у живой доставки в routers/chat.py
+                messages = [
+                    {
+                        "id": row.id,
+                        "sender_id": row.sender_id,
+                        "text": row.content,
+                        "image_url": row.image_url,
+                        "to_user_id": None if row.is_group else user_id,
+                        "conversation_id": row.conversation_id if row.is_group else None,
+                        "created_at": row.created_at.isoformat(),
+                    }
+                    for row in rows
+                ]
+                yield {"type": "backlog", "messages": messages, "more": more}
+                if not more:
+                    return
+                after = rows[-1].id
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Живая доставка продолжает работать; пропущенное клиент получит при следующем подключении
+            logger.exception("failed to load backlog for user %s", user_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with self._session_factory() as session:
+                await self._upsert(session, pending)
+                await session.commit()
+        except Exception:
+            logger.exception("failed to store %d delivery acks, will retry", len(pending))
+            for user_id, message_id in pending.items():
+                self.ack(user_id, message_id)
+
+    async def _upsert(self, session, pending: Dict[int, int]) -> None:
+        rows = [{"user_id": user_id, "delivered_message_id": message_id} for user_id, message_id in pending.items()]
+        dialect_insert = _UPSERT_DIALECTS.get(session.bind.dialect.name)
+        if dialect_insert is not None:
+            # Один INSERT ... ON CONFLICT на всю пачку; отметка только растёт (подтверждения с разных воркеров)
+            stmt = dialect_insert(InboxState).values(rows)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=[InboxState.user_id],
+                set_={"delivered_message_id": stmt.excluded.delivered_message_id, "updated_at": stmt.excluded.updated_at},
+                where=InboxState.delivered_message_id < stmt.excluded.delivered_message_id,
+            ))
+            return
+        existing = {
+            state.user_id: state
+            for state in (await session.execute(select(InboxState).where(InboxState.user_id.in_(pending)))).scalars()
+        }
+        for user_id, message_id in pending.items():
+            state = existing.get(user_id)
+            if state is None:
+                session.add(InboxState(user_id=user_id, delivered_message_id=message_id))
+            elif state.delivered_message_id < message_id:
+                state.delivered_message_id = message_id
+
+
+def create_delivery_tracker() -> DeliveryTracker:
+    settings = get_settings()
+    return DeliveryTracker(
+        async_session_factory,
+        batch_size=settings.CHAT_BACKLOG_BATCH_SIZE,
+        max_age_days=settings.CHAT_BACKLOG_MAX_AGE_DAYS,
+        flush_interval=settings.CHAT_ACK_FLUSH_MS / 1000,
+        ack_holdback_ms=settings.CHAT_ACK_HOLDBACK_MS,
+    )
+
+
+delivery_tracker = create_delivery_tracker()
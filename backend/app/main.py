@@ -1,14 +1,31 @@
 # main.py
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response
+from pathlib import Path
+
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.ext.asyncio import AsyncEngine
 
+from .auth import warm_up_password_hashing
 from .config import get_settings
-from .db import engine, Base
+from .db import engine, Base, dispose_engines
+from .executors import shutdown_executors
+from .ids import WorkerIdLease
+from .inbox import delivery_tracker
+from .media_crypto import get_media_cipher
+from .message_store import message_writer
+from .metrics import PrometheusMiddleware, profiler
+from .redis_client import close_redis, get_redis
+from .search import search_index, use_postgres as search_uses_postgres
+from .uploads import upload_manager
 from .routers import auth as auth_router
 from .routers import users as users_router
 from .routers import chat as chat_router
+from .routers import conversations as conversations_router
+from .routers import media as media_router
+from .routers import search as search_router
+from .routers import stats as stats_router
+from .routers import metrics as metrics_router
 
 
 def create_app() -> FastAPI:
@@ -22,21 +39,58 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        # Иначе браузер не отдаст скрипту с другого origin курсор следующей страницы
+        expose_headers=["X-Next-Cursor", "ETag"],
     )
 
+    # Латентность HTTP по маршрутам для /metrics
+    app.add_middleware(PrometheusMiddleware)
+
     # Routers
     app.include_router(auth_router.router)
     app.include_router(users_router.router)
     app.include_router(chat_router.router)
+    app.include_router(conversations_router.router)
+    app.include_router(media_router.router)
+    app.include_router(search_router.router)
+    app.include_router(stats_router.router)
+    app.include_router(metrics_router.router)
 
     @app.on_event("startup")
     async def on_startup() -> None:
-        # Для простоты на старте создаём таблицы (в проде — миграции)
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+        if settings.DB_AUTO_CREATE:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
         # Гарантируем наличие директории для загрузок
-        from pathlib import Path
-        Path("uploads").mkdir(parents=True, exist_ok=True)
+        Path(settings.MEDIA_DIR).mkdir(parents=True, exist_ok=True)
+        # Ключи медиа (HKDF, Fernet/AES-GCM) и backend bcrypt готовим до первого запроса
+        get_media_cipher()
+        warm_up_password_hashing()
+        if settings.CHAT_BACKPLANE == "redis":
+            app.state.worker_id_lease = WorkerIdLease(get_redis(), settings.IDS_WORKER_LEASE_SECONDS)
+            await app.state.worker_id_lease.start()
+        await chat_router.manager.start()
+        await message_writer.start()
+        await delivery_tracker.start()
+        if not search_uses_postgres():
+            await search_index.start()
+        await upload_manager.start()
+
+    @app.on_event("shutdown")
+    async def on_shutdown() -> None:
+        profiler.stop()
+        await search_index.stop()
+        # Дожидаемся начатых финализаций загрузок, пока БД ещё доступна
+        await upload_manager.stop()
+        await chat_router.manager.stop()
+        # Дописываем в БД накопленные сообщения до закрытия соединений
+        await message_writer.stop()
+        await delivery_tracker.stop()
+        await dispose_engines()
+        if getattr(app.state, "worker_id_lease", None) is not None:
+            await app.state.worker_id_lease.stop()
+        await close_redis()
+        shutdown_executors()
 
     @app.get("/")
     async def read_root():
@@ -44,54 +98,7 @@ def create_app() -> FastAPI:
 
     # Раздача статики: простая UI-страница по адресу /ui
     app.mount("/ui", StaticFiles(directory="app/static", html=True), name="ui")
-    # Убрали прямую раздачу /uploads; используем защищённую выдачу через эндпоинт
-
-    @app.post("/media/upload")
-    async def upload_media(file: UploadFile = File(...)):
-        # Примитивная валидация изображений по content-type
-        if not file.content_type or not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="Only image uploads are allowed")
-        import uuid
-        from pathlib import Path
-        from base64 import urlsafe_b64decode
-        from cryptography.fernet import Fernet
-
-        uploads_dir = Path("uploads")
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        suffix = Path(file.filename or "").suffix or ""
-        name = f"{uuid.uuid4().hex}{suffix}"
-        dest = uploads_dir / name
-
-        # Читаем весь файл в память (для простоты MVP). Для больших файлов — потоковое шифрование/запись чанками
-        data = await file.read()
-        key = get_settings().MEDIA_ENC_KEY
-        if key:
-            try:
-                fernet = Fernet(key.encode())
-                data = fernet.encrypt(data)
-            except Exception:
-                raise HTTPException(status_code=500, detail="Encryption error")
-        with dest.open("wb") as out:
-            out.write(data)
-
-        return {"filename": name, "url": f"/media/{name}", "content_type": file.content_type}
-
-    @app.get("/media/{filename}")
-    async def get_media(filename: str):
-        from pathlib import Path
-        from cryptography.fernet import Fernet
-        file_path = Path("uploads") / filename
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="Not found")
-        data = file_path.read_bytes()
-        key = get_settings().MEDIA_ENC_KEY
-        if key:
-            try:
-                fernet = Fernet(key.encode())
-                data = fernet.decrypt(data)
-            except Exception:
-                raise HTTPException(status_code=500, detail="Decryption error")
-        return Response(content=data, media_type="application/octet-stream")
+    # Убрали прямую раздачу /uploads; используем защищённую выдачу через эндпоинт (routers/media.py)
 
     return app
 
@@ -0,0 +1,267 @@
+# media_crypto.py
+# Потоковое шифрование медиа: файл режется на чанки фиксированного размера, каждый чанк — AES-256-GCM.
+#
+# Формат файла (версия 1):
+#   header = MAGIC(4) | VERSION(1) | chunk_size uint32 BE (4) | nonce_prefix (7)   -> 16 байт
+#   chunk_i = AESGCM(nonce = nonce_prefix | i uint32 BE | last_flag(1), plaintext_i, aad = header)
+# Все чанки, кроме последнего, содержат ровно chunk_size байт открытого текста, поэтому смещение
+# любого байта вычисляется без чтения файла — на этом построены Range-запросы.
+# Флаг последнего чанка в nonce не даёт незаметно обрезать файл.
+# Старые файлы, зашифрованные Fernet целиком, по-прежнему читаются (см. is_chunked_format).
+import hashlib
+import hmac
+import io
+import os
+import struct
+import time
+import uuid
+from base64 import urlsafe_b64decode
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from .config import get_settings
+from .metrics import crypto_bytes, crypto_seconds
+
+
+_encrypt_seconds, _encrypt_bytes = crypto_seconds.labels("encrypt"), crypto_bytes.labels("encrypt")
+_decrypt_seconds, _decrypt_bytes = crypto_seconds.labels("decrypt"), crypto_bytes.labels("decrypt")
+
+MAGIC = b"MMKS"
+VERSION = 1
+HEADER_SIZE = 16
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+_HEADER = struct.Struct(">4sBI7s")
+
+
+class MediaFormatError(Exception):
+    pass
+
+
+def is_chunked_format(head: bytes) -> bool:
+    return head[:4] == MAGIC
+
+
+class ChunkEncryptor:
+    def __init__(self, aead: AESGCM, chunk_size: int, header: Optional[bytes] = None, index: int = 0) -> None:
+        self._aead = aead
+        self.chunk_size = chunk_size
+        # header и index — продолжение уже начатого файла (возобновляемые загрузки)
+        self.header = header or _HEADER.pack(MAGIC, VERSION, chunk_size, os.urandom(NONCE_PREFIX_SIZE))
+        self._prefix = self.header[-NONCE_PREFIX_SIZE:]
+        self._index = index
+
+    def encrypt_chunk(self, data: bytes, last: bool) -> bytes:
+        nonce = self._prefix + struct.pack(">IB", self._index, 1 if last else 0)
+        self._index += 1
+        started = time.perf_counter()
+        encrypted = self._aead.encrypt(nonce, data, self.header)
+        _encrypt_seconds.inc(time.perf_counter() - started)
+        _encrypt_bytes.inc(len(data))
+        return encrypted
+
+
+class ChunkDecryptor:
+    def __init__(self, aead: AESGCM, header: bytes) -> None:
+        if len(header) != HEADER_SIZE:
+            raise MediaFormatError("truncated header")
+        magic, version, chunk_size, prefix = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise MediaFormatError("unsupported media format")
+        self._aead = aead
+        self.header = header
+        self.chunk_size = chunk_size
+        self._prefix = prefix
+
+    @property
+    def encrypted_chunk_size(self) -> int:
+        return self.chunk_size + TAG_SIZE
+
+    def chunk_count(self, file_size: int) -> int:
+        body = file_size - HEADER_SIZE
+        if body < TAG_SIZE:
+            raise MediaFormatError("truncated body")
+        return -(-body // self.encrypted_chunk_size)
+
+    def plaintext_size(self, file_size: int) -> int:
+        chunks = self.chunk_count(file_size)
+        last_encrypted = file_size - HEADER_SIZE - (chunks - 1) * self.encrypted_chunk_size
+        return (chunks - 1) * self.chunk_size + last_encrypted - TAG_SIZE
+
+    def decrypt_chunk(self, index: int, data: bytes, last: bool) -> bytes:
+        nonce = self._prefix + struct.pack(">IB", index, 1 if last else 0)
+        started = time.perf_counter()
+        plain = self._aead.decrypt(nonce, data, self.header)
+        _decrypt_seconds.inc(time.perf_counter() - started)
+        _decrypt_bytes.inc(len(plain))
+        return plain
+
+
+class MediaCipher:
+    """Ключи медиа: создаётся один раз на процесс (см. get_media_cipher)."""
+
+    def __init__(self, key: str) -> None:
+        self.fernet = Fernet(key.encode())
+        stream_key = HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=b"mess_mik media stream v1",
+        ).derive(urlsafe_b64decode(key.encode()))
+        self.aead = AESGCM(stream_key)
+        # Ключ для адресации по содержимому: имя файла не позволяет проверить, загружен ли известный файл
+        self.content_key = HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=b"mess_mik media content id v1",
+        ).derive(urlsafe_b64decode(key.encode()))
+
+    def encryptor(self, chunk_size: int, header: Optional[bytes] = None, index: int = 0) -> ChunkEncryptor:
+        return ChunkEncryptor(self.aead, chunk_size, header, index)
+
+    def decryptor(self, header: bytes) -> ChunkDecryptor:
+        return ChunkDecryptor(self.aead, header)
+
+
+@lru_cache()
+def get_media_cipher() -> Optional[MediaCipher]:
+    key = get_settings().MEDIA_ENC_KEY
+    return MediaCipher(key) if key else None
+
+
+def content_hasher(cipher: Optional[MediaCipher]):
+    """HMAC-SHA256 открытого текста на ключе медиа; без шифрования — обычный SHA-256."""
+    if cipher is None:
+        return hashlib.sha256()
+    return hmac.new(cipher.content_key, digestmod=hashlib.sha256)
+
+
+class MediaFile:
+    """Открытый на чтение медиафайл любого формата: чанковый, legacy Fernet или открытый текст."""
+
+    def __init__(self, path: Path, cipher: Optional[MediaCipher]) -> None:
+        self.path = path
+        self._cipher = cipher
+        self._decryptor: Optional[ChunkDecryptor] = None
+        self._legacy: Optional[bytes] = None
+        self._chunks = 0
+        file_size = path.stat().st_size
+        if cipher is None:
+            self.size = file_size
+            return
+        with path.open("rb") as f:
+            head = f.read(HEADER_SIZE)
+            if is_chunked_format(head):
+                self._decryptor = cipher.decryptor(head)
+                self.size = self._decryptor.plaintext_size(file_size)
+                self._chunks = self._decryptor.chunk_count(file_size)
+            else:
+                # Legacy: весь файл — один токен Fernet
+                started = time.perf_counter()
+                self._legacy = cipher.fernet.decrypt(head + f.read())
+                _decrypt_seconds.inc(time.perf_counter() - started)
+                _decrypt_bytes.inc(len(self._legacy))
+                self.size = len(self._legacy)
+
+    def iter_range(self, start: int, end: int, read_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Отдаёт открытый текст байтов [start, end] включительно, не держа в памяти больше одного чанка."""
+        if self._legacy is not None:
+            yield self._legacy[start:end + 1]
+            return
+        with self.path.open("rb") as f:
+            if self._decryptor is None:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = f.read(min(read_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+                return
+
+            dec = self._decryptor
+            first, last = start // dec.chunk_size, end // dec.chunk_size
+            f.seek(HEADER_SIZE + first * dec.encrypted_chunk_size)
+            for index in range(first, last + 1):
+                plain = dec.decrypt_chunk(index, f.read(dec.encrypted_chunk_size), index == self._chunks - 1)
+                chunk_start = index * dec.chunk_size
+                lo = max(start - chunk_start, 0)
+                hi = min(end - chunk_start + 1, len(plain))
+                yield plain[lo:hi]
+
+
+class MediaReader(io.RawIOBase):
+    """Открытый текст MediaFile как файл с произвольным доступом (хэширование, Pillow) без расшифровки целиком.
+
+    Оборачивайте в io.BufferedReader с буфером в размер чанка: каждое чтение расшифровывает целые чанки.
+    """
+
+    def __init__(self, media: MediaFile) -> None:
+        self.media = media
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.media.size}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self.media.size) - 1
+        if end < self._position:
+            return 0
+        data = b"".join(self.media.iter_range(self._position, end))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class MediaWriter:
+    """Пишет медиафайл по мере поступления данных: в памяти не больше одного чанка.
+
+    Файл пишется во временный *.part и переименовывается только в close().
+    """
+
+    def __init__(self, path: Path, cipher: Optional[MediaCipher], chunk_size: int) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = 0
+        # Уникальное временное имя: одно и то же содержимое могут одновременно писать несколько запросов
+        self._tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.part")
+        self._out = self._tmp.open("wb")
+        self._buffer = bytearray()
+        self._encryptor = cipher.encryptor(chunk_size) if cipher is not None else None
+        if self._encryptor is not None:
+            self._out.write(self._encryptor.header)
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self._encryptor is None:
+            self._out.write(data)
+            return
+        self._buffer += data
+        # Чанк шифруем, только когда за ним точно есть данные: последний чанк помечается отдельно
+        while len(self._buffer) > self.chunk_size:
+            self._out.write(self._encryptor.encrypt_chunk(bytes(self._buffer[:self.chunk_size]), last=False))
+            del self._buffer[:self.chunk_size]
+
+    def close(self) -> None:
+        if self._encryptor is not None:
+            self._out.write(self._encryptor.encrypt_chunk(bytes(self._buffer), last=True))
+            self._buffer.clear()
+        self._out.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self) -> None:
+        self._out.close()
+        self._tmp.unlink(missing_ok=True)
@@ -0,0 +1,235 @@
+# media_store.py
+# Хранилище медиа с адресацией по содержимому и счётчиком ссылок (таблица media_objects).
+# Повторная загрузка того же файла (пересылка картинки в группу) не шифруется и не пишется заново —
+# только увеличивает ref_count. Для новых изображений строятся уменьшенные копии (thumb/preview),
+# чтобы списки чатов не тянули оригиналы.
+# Ссылку снимает release_media: отмена владельцем уже обработанной возобновляемой загрузки
+# (DELETE /media/uploads/{id}); на последней ссылке удаляются запись и файлы.
+import io
+import logging
+import os
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .executors import run_io
+from .media_crypto import MediaCipher, MediaFile, MediaReader, MediaWriter, content_hasher, get_media_cipher
+from .models import MediaObject
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow храним только оригиналы
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_CONTENT_TYPE = "image/jpeg"
+
+
+def media_dir() -> Path:
+    return Path(get_settings().MEDIA_DIR)
+
+
+def variant_filename(content_hash: str, variant: str) -> str:
+    return f"{content_hash}.{variant}"
+
+
+def hash_file(fileobj: BinaryIO, cipher: Optional[MediaCipher], read_size: int) -> str:
+    fileobj.seek(0)
+    hasher = content_hasher(cipher)
+    while chunk := fileobj.read(read_size):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def encrypt_file(fileobj: BinaryIO, path: Path, cipher: Optional[MediaCipher], chunk_size: int) -> int:
+    """Шифрует файл целиком в path (через *.part); возвращает размер открытого текста."""
+    fileobj.seek(0)
+    writer = MediaWriter(path, cipher, chunk_size)
+    try:
+        while chunk := fileobj.read(chunk_size):
+            writer.write(chunk)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.size
+
+
+def render_variants(fileobj: BinaryIO, sizes: Dict[str, int], quality: int, max_pixels: int) -> Dict[str, bytes]:
+    """JPEG-копии, вписанные в квадрат size x size; только для вариантов меньше оригинала."""
+    if Image is None or not sizes:
+        return {}
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as image:
+            if image.width * image.height > max_pixels:
+                return {}
+            largest = max(sizes.values())
+            # Для JPEG декодер сразу уменьшает в 2/4/8 раз — не распаковываем полное разрешение
+            image.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+
+            rendered = {}
+            for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+                if max(image.size) <= size:
+                    continue
+                copy = image.copy()
+                copy.thumbnail((size, size), Image.LANCZOS)
+                out = io.BytesIO()
+                copy.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+                rendered[name] = out.getvalue()
+            return rendered
+    except Exception as exc:
+        # Битое или неподдерживаемое изображение: оригинал всё равно сохраняем
+        logger.warning("failed to render media variants: %s", exc)
+        return {}
+
+
+def write_variants(content_hash: str, rendered: Dict[str, bytes], cipher: Optional[MediaCipher], chunk_size: int) -> None:
+    for name, data in rendered.items():
+        encrypt_file(io.BytesIO(data), media_dir() / variant_filename(content_hash, name), cipher, chunk_size)
+
+
+async def store_upload(session: AsyncSession, fileobj: BinaryIO, content_type: str) -> MediaObject:
+    """Сохраняет загрузку (или добавляет ссылку на уже сохранённую) и возвращает запись media_objects."""
+    settings = get_settings()
+    cipher = get_media_cipher()
+    content_hash = await run_io(hash_file, fileobj, cipher, settings.MEDIA_CHUNK_SIZE)
+
+    existing = await _add_reference(session, content_hash)
+    if existing is not None:
+        return existing
+
+    # Новое содержимое: файлы пишем до вставки строки, чтобы запись в БД никогда не указывала на недописанный файл
+    path = media_dir() / content_hash
+    size = await run_io(encrypt_file, fileobj, path, cipher, settings.MEDIA_CHUNK_SIZE)
+    rendered = await run_io(
+        render_variants, fileobj, settings.MEDIA_VARIANTS, settings.MEDIA_VARIANT_QUALITY, settings.MEDIA_MAX_IMAGE_PIXELS,
+    )
+    await run_io(write_variants, content_hash, rendered, cipher, settings.MEDIA_CHUNK_SIZE)
+    return await _insert(session, content_hash, content_type, size, rendered)
+
+
+def open_stored(path: Path, cipher: Optional[MediaCipher], buffer_size: int) -> io.BufferedReader:
+    return io.BufferedReader(MediaReader(MediaFile(path, cipher)), buffer_size)
+
+
+async def store_file(session: AsyncSession, path: Path, content_type: str) -> MediaObject:
+    """Как store_upload, но для файла, уже записанного в формате хранилища (возобновляемые загрузки):
+    новое содержимое не шифруется заново, а переименовывается в MEDIA_DIR; дубликат удаляется."""
+    settings = get_settings()
+    cipher = get_media_cipher()
+    fileobj = await run_io(open_stored, path, cipher, settings.MEDIA_CHUNK_SIZE)
+    try:
+        content_hash = await run_io(hash_file, fileobj, cipher, settings.MEDIA_CHUNK_SIZE)
+        existing = await _add_reference(session, content_hash)
+        if existing is not None:
+            await run_io(_unlink_all, [path])
+            return existing
+        rendered = {}
+        if content_type.startswith("image/"):
+            rendered = await run_io(
+                render_variants, fileobj, settings.MEDIA_VARIANTS, settings.MEDIA_VARIANT_QUALITY, settings.MEDIA_MAX_IMAGE_PIXELS,
+            )
+        size = fileobj.raw.media.size
+    finally:
+        fileobj.close()
+    await run_io(write_variants, content_hash, rendered, cipher, settings.MEDIA_CHUNK_SIZE)
+    await run_io(os.replace, path, media_dir() / content_hash)
+    return await _insert(session, content_hash, content_type, size, rendered)
+
+
+async def _insert(session: AsyncSession, content_hash: str, content_type: str, size: int, rendered: Dict[str, bytes]) -> MediaObject:
+    media = MediaObject(
+        content_hash=content_hash,
+        content_type=content_type,
+        size=size,
+        ref_count=1,
+        variants=",".join(sorted(rendered)),
+    )
+    session.add(media)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # Тот же файл параллельно загрузил другой запрос — его копия уже на месте, наша идентична
+        await session.rollback()
+        existing = await _add_reference(session, content_hash)
+        if existing is None:
+            raise
+        return existing
+    return media
+
+
+async def _add_reference(session: AsyncSession, content_hash: str) -> Optional[MediaObject]:
+    result = await session.execute(
+        update(MediaObject)
+        .where(MediaObject.content_hash == content_hash)
+        .values(ref_count=MediaObject.ref_count + 1)
+        .returning(MediaObject)
+    )
+    media = result.scalar_one_or_none()
+    if media is not None:
+        await session.commit()
+    return media
+
+
+async def get_media_object(session: AsyncSession, content_hash: str) -> Optional[MediaObject]:
+    return (await session.execute(select(MediaObject).where(MediaObject.content_hash == content_hash))).scalar_one_or_none()
+
+
+def variant_names(media: MediaObject) -> List[str]:
+    return [name for name in media.variants.split(",") if name]
+
+
+def media_info(media: MediaObject) -> dict:
+    """Ответ на загрузку: имя файла и адреса оригинала и уменьшенных копий."""
+    name = media.content_hash
+    return {
+        "filename": name,
+        "url": f"/media/{name}",
+        "content_type": media.content_type,
+        "variants": {variant: f"/media/{name}?variant={variant}" for variant in variant_names(media)},
+    }
+
+
+async def release_media(session: AsyncSession, content_hash: str) -> bool:
+    """Снимает одну ссылку; на последней удаляет запись и файлы. True — файл удалён."""
+    result = await session.execute(
+        update(MediaObject)
+        .where(MediaObject.content_hash == content_hash, MediaObject.ref_count > 0)
+        .values(ref_count=MediaObject.ref_count - 1)
+        .returning(MediaObject.ref_count, MediaObject.variants)
+    )
+    row = result.one_or_none()
+    if row is None or row.ref_count > 0:
+        await session.commit()
+        return False
+    # Удаляем строку, только если за это время никто не добавил ссылку. Файлы удаляем до COMMIT:
+    # пока строка заблокирована, параллельная загрузка того же содержимого ждёт и затем пишет файл заново
+    deleted = await session.execute(
+        MediaObject.__table__.delete().where(MediaObject.content_hash == content_hash, MediaObject.ref_count == 0)
+    )
+    if deleted.rowcount:
+        paths = [media_dir() / content_hash]
+        paths += [media_dir() / variant_filename(content_hash, name) for name in row.variants.split(",") if name]
+        await run_io(_unlink_all, paths)
+    await session.commit()
+    return bool(deleted.rowcount)
+
+
+def _unlink_all(paths: List[Path]) -> None:
+    for path in paths:
+        path.unlink(missing_ok=True)
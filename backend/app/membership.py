@@ -0,0 +1,101 @@
+# membership.py
+# Кэш участников диалогов для рассылки в группы: conversation_id -> frozenset(user_id).
+# Изменения участников через ORM сбрасывают запись сразу на этом воркере, на остальных — по TTL.
+import asyncio
+from typing import Dict, FrozenSet, Iterable, Set
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, aliased, object_session
+
+from .cache import TTLCache
+from .config import get_settings
+from .db import async_session_factory
+from .models import Membership
+
+
+class MembershipCache:
+    def __init__(self, session_factory, maxsize: int, ttl: float) -> None:
+        self._session_factory = session_factory
+        self._cache: TTLCache[FrozenSet[int]] = TTLCache(maxsize, ttl)
+        # Параллельные промахи по одному диалогу ждут один и тот же запрос
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    async def members(self, conversation_id: int) -> FrozenSet[int]:
+        members = self._cache.get(conversation_id)
+        if members is not None:
+            return members
+        pending = self._loading.get(conversation_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[conversation_id] = future
+        try:
+            async with self._session_factory() as session:
+                result = await session.execute(
+                    select(Membership.user_id).where(Membership.conversation_id == conversation_id)
+                )
+                members = frozenset(result.scalars().all())
+            self._cache.set(conversation_id, members)
+            future.set_result(members)
+            return members
+        except Exception as exc:
+            future.set_exception(exc)
+            # Исключение уже передано ожидающим; не даём asyncio ругаться на неполученный результат
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            self._loading.pop(conversation_id, None)
+
+    def invalidate(self, conversation_id: int) -> None:
+        self._cache.pop(conversation_id)
+
+
+async def shared_with(user_id: int, user_ids: Iterable[int]) -> Set[int]:
+    """Те из user_ids, с кем у user_id есть общий диалог (сам user_id — всегда). Для присутствия:
+    чужой онлайн-статус видят только собеседники."""
+    candidates = set(user_ids)
+    shared = candidates & {user_id}
+    candidates.discard(user_id)
+    if not candidates:
+        return shared
+    mine, theirs = aliased(Membership), aliased(Membership)
+    async with async_session_factory() as session:
+        result = await session.execute(
+            select(theirs.user_id)
+            .join(mine, mine.conversation_id == theirs.conversation_id)
+            .where(mine.user_id == user_id, theirs.user_id.in_(candidates))
+            .distinct()
+        )
+        shared.update(result.scalars().all())
+    return shared
+
+
+membership_cache = MembershipCache(
+    async_session_factory,
+    maxsize=get_settings().MEMBERSHIP_CACHE_MAX,
+    ttl=get_settings().MEMBERSHIP_CACHE_TTL_SECONDS,
+)
+
+
+# Сбрасываем кэш после COMMIT, а не при flush: иначе его успели бы заполнить ещё старым составом
+@event.listens_for(Membership, "after_insert")
+@event.listens_for(Membership, "after_update")
+@event.listens_for(Membership, "after_delete")
+def _on_membership_change(mapper, connection, target: Membership) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_conversations", set()).add(target.conversation_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session: Session) -> None:
+    for conversation_id in session.info.pop("changed_conversations", ()):
+        membership_cache.invalidate(conversation_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _on_rollback(session: Session) -> None:
+    session.info.pop("changed_conversations", None)
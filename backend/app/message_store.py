@@ -0,0 +1,313 @@
+# message_store.py
+# Write-behind запись сообщений чата: сокеты кладут сообщения в общую очередь,
+# фоновая задача пишет их в таблицу messages пачками (по размеру или по времени).
+# Доставка получателю не ждёт БД.
+# В той же транзакции обновляются денормализованные поля списка диалогов: последнее сообщение
+# и время активности диалога, счётчики непрочитанного у участников.
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, case, insert, or_, select, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .db import async_session_factory
+from .models import Conversation, Membership, Message, User
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class PendingMessage:
+    id: int
+    sender_id: int
+    content: str
+    created_at: datetime
+    image_url: Optional[str] = None
+    conversation_id: Optional[int] = None
+    # Для личных сообщений диалог определяем при записи, а не в горячем пути
+    recipient_id: Optional[int] = None
+
+
+def direct_key(user_a: int, user_b: int) -> str:
+    low, high = sorted((user_a, user_b))
+    return f"{low}:{high}"
+
+
+class MessageWriter:
+    WRITE_RETRIES = 3
+    DIRECT_CACHE_MAX = 100_000
+
+    def __init__(self, session_factory, batch_size: int = 500, flush_interval: float = 0.05, max_queue: int = 10000) -> None:
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue[PendingMessage]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._direct_conversations: Dict[str, int] = {}
+        # Счётчики для flush(): сколько сообщений принято и сколько уже обработано (записано или отброшено)
+        self._submitted = 0
+        self._processed = 0
+        self._progress: Optional[asyncio.Condition] = None
+        # Вызываются после COMMIT каждой пачки со строками messages (например, индекс поиска в памяти)
+        self.on_written: List[Callable[[List[dict]], None]] = []
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._progress = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Дописываем всё, что уже в очереди, и только потом останавливаем задачу
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, message: PendingMessage) -> None:
+        # Если очередь заполнена — отправитель ждёт, пока writer её разгребёт
+        await self._queue.put(message)
+        self._submitted += 1
+
+    async def flush(self) -> None:
+        """Ждёт записи всего, что было принято до вызова (новые сообщения не ждём)."""
+        if self._task is None:
+            return
+        target = self._submitted
+        async with self._progress:
+            await self._progress.wait_for(lambda: self._processed >= target)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write_with_retries(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                self._processed += len(batch)
+                async with self._progress:
+                    self._progress.notify_all()
+
+    async def _write_with_retries(self, batch: List[PendingMessage]) -> None:
+        for attempt in range(1, self.WRITE_RETRIES + 1):
+            try:
+                await self._write(batch)
+                return
+            except asyncio.CancelledError:
+                raise
+            except (IntegrityError, DataError):
+                # Ошибка в данных (дубль id, битая ссылка) от повтора не исчезнет: ищем виновную строку
+                logger.warning("chat messages batch of %d rejected, isolating bad rows", len(batch), exc_info=True)
+                await self._write_isolating(batch)
+                return
+            except Exception:
+                if attempt == self.WRITE_RETRIES:
+                    logger.exception("dropping %d chat messages after %d failed writes", len(batch), attempt)
+                    return
+                logger.warning("chat messages write failed (attempt %d), retrying", attempt, exc_info=True)
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+    async def _write_isolating(self, batch: List[PendingMessage]) -> None:
+        """Делит пачку пополам, пока ошибка не останется в одиночных сообщениях; остальные записываются."""
+        if len(batch) == 1:
+            message = batch[0]
+            logger.error("dropping chat message %d from user %d: rejected by the database", message.id, message.sender_id)
+            return
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            try:
+                await self._write(half)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await self._write_isolating(half)
+
+    async def _write(self, batch: List[PendingMessage]) -> None:
+        async with self._session_factory() as session:
+            pairs = {(m.sender_id, m.recipient_id) for m in batch if m.conversation_id is None}
+            direct = await self._resolve_direct_conversations(session, pairs) if pairs else {}
+            rows = []
+            for m in batch:
+                conversation_id = m.conversation_id or direct.get(direct_key(m.sender_id, m.recipient_id))
+                if conversation_id is None:
+                    logger.warning("dropping chat message %d: recipient %s does not exist", m.id, m.recipient_id)
+                    continue
+                rows.append({
+                    "id": m.id,
+                    "conversation_id": conversation_id,
+                    "sender_id": m.sender_id,
+                    "content": m.content,
+                    "image_url": m.image_url,
+                    "created_at": m.created_at,
+                })
+            if not rows:
+                return
+            await session.execute(insert(Message), rows)
+            await self._update_conversations(session, rows)
+            await session.commit()
+        # Только после COMMIT: при откате транзакции в кэше остался бы id несуществующего диалога
+        if len(self._direct_conversations) > self.DIRECT_CACHE_MAX:
+            self._direct_conversations.clear()
+        self._direct_conversations.update(direct)
+        for callback in self.on_written:
+            try:
+                callback(rows)
+            except Exception:
+                # Пачка уже записана — повторять запись из-за подписчика нельзя
+                logger.exception("chat messages write callback failed")
+
+    async def _update_conversations(self, session: AsyncSession, rows: List[dict]) -> None:
+        latest: Dict[int, dict] = {}
+        totals: Counter = Counter()
+        sent: Counter = Counter()
+        for row in rows:
+            conversation_id = row["conversation_id"]
+            if conversation_id not in latest or row["id"] > latest[conversation_id]["id"]:
+                latest[conversation_id] = row
+            totals[conversation_id] += 1
+            sent[conversation_id, row["sender_id"]] += 1
+        # Одинаковый порядок обновления строк у всех воркеров — меньше взаимных блокировок в Postgres
+        conversation_ids = sorted(latest)
+
+        conversations = Conversation.__table__
+        await session.execute(
+            update(conversations)
+            .where(
+                conversations.c.id == bindparam("conversation"),
+                # Пачки разных воркеров могут записаться не по порядку id
+                or_(conversations.c.last_message_id.is_(None), conversations.c.last_message_id < bindparam("message")),
+            )
+            .values(last_message_id=bindparam("message"), last_activity_at=bindparam("activity_at")),
+            [
+                {"conversation": cid, "message": latest[cid]["id"], "activity_at": latest[cid]["created_at"]}
+                for cid in conversation_ids
+            ],
+        )
+
+        # Активность диалога поднимается у всех участников. Непрочитанное: +все сообщения пачки каждому участнику,
+        # затем -свои каждому отправителю; кто уже отметил прочитанным последнее сообщение пачки
+        # (видел его вживую до записи), тому счётчик не трогаем
+        memberships = Membership.__table__
+        activity_at = bindparam("activity_at")
+        await session.execute(
+            update(memberships)
+            .where(memberships.c.conversation_id == bindparam("conversation"))
+            .values(
+                unread_count=memberships.c.unread_count + case(
+                    (memberships.c.last_read_message_id < bindparam("message"), bindparam("count")), else_=0
+                ),
+                last_activity_at=case(
+                    (memberships.c.last_activity_at < activity_at, activity_at), else_=memberships.c.last_activity_at
+                ),
+            ),
+            [
+                {"conversation": cid, "message": latest[cid]["id"], "count": totals[cid], "activity_at": latest[cid]["created_at"]}
+                for cid in conversation_ids
+            ],
+        )
+        await session.execute(
+            update(memberships)
+            .where(
+                memberships.c.conversation_id == bindparam("conversation"),
+                memberships.c.user_id == bindparam("sender"),
+                memberships.c.last_read_message_id < bindparam("message"),
+            )
+            .values(unread_count=memberships.c.unread_count - bindparam("count")),
+            [
+                {"conversation": cid, "sender": sender_id, "message": latest[cid]["id"], "count": count}
+                for (cid, sender_id), count in sorted(sent.items())
+            ],
+        )
+
+    async def _resolve_direct_conversations(self, session: AsyncSession, pairs: Iterable[Tuple[int, int]]) -> Dict[str, int]:
+        """direct_key -> id диалога для пар этой пачки; недостающие диалоги создаются в транзакции session.
+        Пары с несуществующим пользователем в результат не попадают."""
+        resolved: Dict[str, int] = {}
+        missing: Dict[str, Tuple[int, int]] = {}
+        for a, b in pairs:
+            key = direct_key(a, b)
+            if key in self._direct_conversations:
+                resolved[key] = self._direct_conversations[key]
+            else:
+                missing[key] = (a, b)
+        if not missing:
+            return resolved
+
+        result = await session.execute(
+            select(Conversation.direct_key, Conversation.id).where(Conversation.direct_key.in_(missing.keys()))
+        )
+        for key, conversation_id in result.all():
+            resolved[key] = conversation_id
+            missing.pop(key)
+        if not missing:
+            return resolved
+
+        user_ids = {user_id for pair in missing.values() for user_id in pair}
+        existing = set((await session.execute(select(User.id).where(User.id.in_(user_ids)))).scalars())
+        for key, (user_a, user_b) in missing.items():
+            if user_a not in existing or user_b not in existing:
+                continue
+            try:
+                async with session.begin_nested():
+                    conversation = Conversation(is_group=False, direct_key=key)
+                    session.add(conversation)
+                    await session.flush()
+                    session.add_all([
+                        Membership(user_id=user_a, conversation_id=conversation.id),
+                        Membership(user_id=user_b, conversation_id=conversation.id),
+                    ])
+                conversation_id = conversation.id
+            except IntegrityError:
+                # Диалог параллельно создал другой воркер
+                conversation_id = (
+                    await session.execute(select(Conversation.id).where(Conversation.direct_key == key))
+                ).scalar_one_or_none()
+                if conversation_id is None:
+                    continue
+            resolved[key] = conversation_id
+        return resolved
+
+
+def create_message_writer() -> MessageWriter:
+    settings = get_settings()
+    return MessageWriter(
+        async_session_factory,
+        batch_size=settings.CHAT_WRITE_BATCH_SIZE,
+        flush_interval=settings.CHAT_WRITE_FLUSH_MS / 1000,
+        max_queue=settings.CHAT_WRITE_QUEUE_MAX,
+    )
+
+
+message_writer = create_message_writer()
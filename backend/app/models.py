@@ -2,7 +2,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import String, Text, ForeignKey, Boolean, UniqueConstraint
+from sqlalchemy import BigInteger, String, Text, ForeignKey, Boolean, Index, UniqueConstraint, func, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -22,13 +22,32 @@ class User(Base):
     memberships: Mapped[list["Membership"]] = relationship(back_populates="user")
 
 
+# Префиксный поиск в каталоге пользователей: lower(column) LIKE 'q%'.
+# text_pattern_ops нужен Postgres, чтобы LIKE по префиксу использовал индекс при любой локали
+Index(
+    "ix_users_email_lower_prefix",
+    func.lower(User.email).label("email_lower"),
+    postgresql_ops={"email_lower": "text_pattern_ops"},
+)
+Index(
+    "ix_users_full_name_lower_prefix",
+    func.lower(User.full_name).label("full_name_lower"),
+    postgresql_ops={"full_name_lower": "text_pattern_ops"},
+)
+
+
 class Conversation(Base):
     __tablename__ = "conversations"
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     title: Mapped[Optional[str]] = mapped_column(String(255), default=None)
     is_group: Mapped[bool] = mapped_column(Boolean, default=False)
+    # Для личных диалогов — "min_user_id:max_user_id", чтобы диалог пары был единственным
+    direct_key: Mapped[Optional[str]] = mapped_column(String(64), unique=True, default=None)
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    # Денормализация для списка диалогов; обновляет writer сообщений (message_store.py) в той же транзакции
+    last_message_id: Mapped[Optional[int]] = mapped_column(BigInteger, default=None)
+    last_activity_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
 
     messages: Mapped[list["Message"]] = relationship(back_populates="conversation")
     members: Mapped[list["Membership"]] = relationship(back_populates="conversation")
@@ -38,6 +57,8 @@ class Membership(Base):
     __tablename__ = "memberships"
     __table_args__ = (
         UniqueConstraint("user_id", "conversation_id", name="uq_user_conversation"),
+        # Список диалогов пользователя: WHERE user_id = ? ORDER BY last_activity_at DESC, conversation_id DESC
+        Index("ix_memberships_user_activity", "user_id", "last_activity_at", "conversation_id"),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -45,6 +66,11 @@ class Membership(Base):
     conversation_id: Mapped[int] = mapped_column(ForeignKey("conversations.id", ondelete="CASCADE"), index=True)
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False)
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    # Копия Conversation.last_activity_at: сортировка списка диалогов по индексу без JOIN
+    last_activity_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    unread_count: Mapped[int] = mapped_column(default=0)
+    # Прочитано всё с id <= last_read_message_id (POST /conversations/{id}/read)
+    last_read_message_id: Mapped[int] = mapped_column(BigInteger, default=0)
 
     user: Mapped[User] = relationship(back_populates="memberships")
     conversation: Mapped[Conversation] = relationship(back_populates="members")
@@ -52,19 +78,54 @@ class Membership(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Keyset-пагинация истории: WHERE conversation_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC.
+        # Заменяет отдельный индекс по conversation_id (он его префикс)
+        Index("ix_messages_conversation_created_id", "conversation_id", "created_at", "id"),
+        # Офлайн-входящие: WHERE conversation_id IN (...) AND id > watermark ORDER BY id
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    conversation_id: Mapped[int] = mapped_column(ForeignKey("conversations.id", ondelete="CASCADE"), index=True)
+    # id генерируется приложением (см. ids.py), а не БД
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    conversation_id: Mapped[int] = mapped_column(ForeignKey("conversations.id", ondelete="CASCADE"))
     sender_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), index=True)
     content: Mapped[str] = mapped_column(Text)
+    image_url: Mapped[Optional[str]] = mapped_column(String(512), default=None)
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow, index=True)
 
     conversation: Mapped[Conversation] = relationship(back_populates="messages")
     sender: Mapped[User] = relationship(back_populates="messages")
 
 
+# Полнотекстовый поиск (Postgres): GIN-индекс по выражению. Конфигурация 'simple' — без стемминга и стоп-слов,
+# одинаково для русского и английского. Запросы в search.py используют это же выражение — иначе индекс не применится.
+# Смена конфигурации требует пересоздания индекса
+SEARCH_TEXT_CONFIG = "simple"
+message_search_document = func.to_tsvector(text(f"'{SEARCH_TEXT_CONFIG}'::regconfig"), Message.content)
+Index("ix_messages_content_search", message_search_document, postgresql_using="gin").ddl_if(dialect="postgresql")
+
+
+class InboxState(Base):
+    """Отметка доставки: все сообщения пользователю с id <= delivered_message_id клиент подтвердил."""
 
+    __tablename__ = "inbox_states"
 
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    delivered_message_id: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class MediaObject(Base):
+    """Загруженный файл, адресуемый по содержимому: одинаковые загрузки хранятся один раз."""
 
+    __tablename__ = "media_objects"
+
+    # HMAC-SHA256 открытого текста (см. media_crypto.content_hasher), он же имя файла в MEDIA_DIR
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    content_type: Mapped[str] = mapped_column(String(255))
+    size: Mapped[int] = mapped_column(BigInteger)
+    ref_count: Mapped[int] = mapped_column(default=1)
+    # Построенные уменьшенные копии через запятую ("thumb,preview"); файлы — <content_hash>.<вариант>
+    variants: Mapped[str] = mapped_column(String(255), default="")
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
@@ -0,0 +1,211 @@
+# presence.py
+# Эфемерные события чата: "печатает" и онлайн-статус. Не пишутся в БД и не попадают в backlog —
+# потерянное событие просто устаревает.
+# Сокет получает их, только если подписался кадром {"type": "subscribe", "users": [...], "conversations": [...]}
+# (видимые контакты и открытые диалоги; подписка заменяет предыдущую).
+#   typing   — клиент шлёт {"type": "typing", "conversation_id": ...} (или "to_user_id" для личного чата) хоть
+#              на каждое нажатие. Сервер склеивает их: по диалогу не больше одного события за интервал,
+#              первое — сразу, остальное — одним событием со списком печатающих в конце интервала.
+#              Пустой user_ids — все перестали печатать (или прошло expires_in_ms без нажатий).
+#   presence — при подписке сразу снимок {"type": "presence", "online": [...], "offline": [...]},
+#              дальше — только изменения, не чаще интервала опроса (кратковременные переподключения не видны).
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, FrozenSet, Hashable, Iterable, List, Optional, Set, Tuple
+
+from .metrics import chat_ephemeral_events
+from .protocol import Frame
+
+
+logger = logging.getLogger(__name__)
+
+# Метка typing в конверте backplane: по ней воркер получателя фильтрует событие по подпискам сокетов,
+# не разбирая JSON (сообщения чата фильтровать не нужно)
+TYPING_KIND = "typing"
+
+
+def wants_typing(connection, event: dict) -> bool:
+    conversation_id = event.get("conversation_id")
+    if conversation_id is not None:
+        return conversation_id in connection.conversations
+    return event.get("peer_id") in connection.users
+
+
+@dataclass(slots=True)
+class _Typing:
+    event: dict
+    recipients: FrozenSet[int]
+    # user_id -> время последнего нажатия (monotonic)
+    typers: Dict[int, float] = field(default_factory=dict)
+    emitted: Tuple[int, ...] = ()
+    emitted_at: float = float("-inf")
+
+
+class TypingCoalescer:
+    def __init__(self, emit: Callable[[FrozenSet[int], dict], Awaitable[None]], interval: float = 1.0, ttl: float = 5.0) -> None:
+        self._emit = emit
+        self.interval = interval
+        self.ttl = ttl
+        self._states: Dict[Hashable, _Typing] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def touch(self, key: Hashable, event: dict, recipients: FrozenSet[int], user_id: int) -> None:
+        """Нажатие user_id в диалоге key; event — поля события, кроме списка печатающих."""
+        chat_ephemeral_events.labels("typing_in").inc()
+        now = time.monotonic()
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _Typing(event, recipients)
+        state.recipients = recipients
+        state.typers[user_id] = now
+        await self._maybe_emit(key, state, now)
+
+    async def _maybe_emit(self, key: Hashable, state: _Typing, now: float) -> None:
+        expired = now - self.ttl
+        for user_id, pressed_at in list(state.typers.items()):
+            if pressed_at < expired:
+                del state.typers[user_id]
+        typers = tuple(sorted(state.typers))
+        if now - state.emitted_at < self.interval:
+            # Окно склейки: остальное уйдёт одним событием из _run
+            return
+        # Тот же состав повторяем раз в ttl/2 и только если с прошлого события были нажатия,
+        # чтобы индикатор у получателей не погас, пока печатают
+        if typers == state.emitted and (
+            not typers or now - state.emitted_at < self.ttl / 2 or max(state.typers.values()) <= state.emitted_at
+        ):
+            if not typers:
+                del self._states[key]
+            return
+        previous = state.emitted
+        state.emitted, state.emitted_at = typers, now
+        if not typers:
+            del self._states[key]
+        # Себя в списке печатающих получатель не видит (в том числе на своих других устройствах):
+        # одно событие на каждый вариант списка; кому нечего показывать и нечего гасить — ничего
+        views: Dict[Tuple[int, ...], Set[int]] = {}
+        for recipient in state.recipients:
+            view = tuple(user_id for user_id in typers if user_id != recipient)
+            if view or any(user_id != recipient for user_id in previous):
+                views.setdefault(view, set()).add(recipient)
+        for view, recipients in views.items():
+            chat_ephemeral_events.labels("typing_out").inc()
+            await self._emit(frozenset(recipients), {**state.event, "user_ids": list(view), "expires_in_ms": int(self.ttl * 1000)})
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval / 2)
+            now = time.monotonic()
+            for key, state in list(self._states.items()):
+                try:
+                    await self._maybe_emit(key, state, now)
+                except Exception:
+                    logger.exception("failed to emit typing event")
+
+
+class PresenceTracker:
+    """Подписки сокетов этого воркера на онлайн-статус пользователей и рассылка изменений."""
+
+    def __init__(
+        self,
+        lookup: Callable[[List[int]], Awaitable[Set[int]]],
+        send: Callable[[object, Frame], None],
+        interval: float = 2.0,
+    ) -> None:
+        self._lookup = lookup
+        self._send = send
+        self.interval = interval
+        # user_id -> сокеты, подписанные на его статус; последний разосланный статус
+        self._watchers: Dict[int, Set[object]] = {}
+        self._online: Dict[int, bool] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._watchers)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def subscribe(self, connection, user_ids: Iterable[int]) -> dict:
+        """Заменяет подписку сокета и возвращает снимок статусов."""
+        user_ids = set(user_ids)
+        for user_id in connection.users - user_ids:
+            self._unwatch(user_id, connection)
+        for user_id in user_ids - connection.users:
+            self._watchers.setdefault(user_id, set()).add(connection)
+        connection.users = user_ids
+        online = await self._lookup(sorted(user_ids))
+        for user_id in user_ids:
+            # Уже отслеживаемым статус не трогаем: изменение должны получить и остальные подписчики
+            if user_id in self._watchers:
+                self._online.setdefault(user_id, user_id in online)
+        return {"type": "presence", "online": sorted(online), "offline": sorted(user_ids - online)}
+
+    def unsubscribe(self, connection) -> None:
+        for user_id in connection.users:
+            self._unwatch(user_id, connection)
+        connection.users = set()
+
+    def _unwatch(self, user_id: int, connection) -> None:
+        watchers = self._watchers.get(user_id)
+        if watchers is None:
+            return
+        watchers.discard(connection)
+        if not watchers:
+            del self._watchers[user_id]
+            self._online.pop(user_id, None)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._watchers:
+                continue
+            try:
+                await self._poll()
+            except Exception:
+                logger.exception("presence poll failed")
+
+    async def _poll(self) -> None:
+        # Один запрос за всех отслеживаемых (для Redis — один pipeline), изменения — одним кадром на сокет
+        user_ids = list(self._watchers)
+        online = await self._lookup(user_ids)
+        changes: Dict[object, Tuple[List[int], List[int]]] = {}
+        for user_id in user_ids:
+            watchers = self._watchers.get(user_id)
+            is_online = user_id in online
+            if not watchers or self._online.get(user_id) == is_online:
+                continue
+            self._online[user_id] = is_online
+            for connection in watchers:
+                changes.setdefault(connection, ([], []))[0 if is_online else 1].append(user_id)
+        for connection, (came_online, went_offline) in changes.items():
+            chat_ephemeral_events.labels("presence_out").inc()
+            self._send(connection, Frame({"type": "presence", "online": came_online, "offline": went_offline}))
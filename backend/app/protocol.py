@@ -0,0 +1,110 @@
+# protocol.py
+# Кодирование кадров WebSocket чата. По умолчанию — JSON в текстовых кадрах (старые клиенты);
+# клиент может выбрать msgpack в бинарных кадрах через ?proto=msgpack или subprotocol "mess.msgpack.v1".
+# Событие кодируется один раз на каждый используемый формат, а не на каждого получателя (см. Frame).
+import json
+from typing import Any, Dict, Optional, Tuple, Union
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # без msgpack доступен только JSON
+    msgpack = None
+
+
+Data = Union[str, bytes]
+
+
+class JsonCodec:
+    name = "json"
+    binary = False
+
+    def encode(self, event: Any) -> str:
+        return json.dumps(event, separators=(",", ":"))
+
+    def decode(self, data: Data) -> Any:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    binary = True
+
+    def encode(self, event: Any) -> bytes:
+        return msgpack.packb(event, use_bin_type=True)
+
+    def decode(self, data: Data) -> Any:
+        if isinstance(data, str):
+            data = data.encode()
+        try:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except Exception as exc:
+            raise ValueError(str(exc)) from exc
+
+
+JSON = JsonCodec()
+CODECS: Dict[str, Any] = {"json": JSON}
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+SUBPROTOCOLS = {f"mess.{name}.v1": name for name in CODECS}
+
+
+def negotiate(websocket: WebSocket) -> Tuple[Any, Optional[str]]:
+    """Формат кадров для соединения и subprotocol, который нужно вернуть в accept()."""
+    # Subprotocol в порядке предпочтения клиента; неизвестные пропускаем
+    for offered in websocket.scope.get("subprotocols") or ():
+        if offered in SUBPROTOCOLS:
+            return CODECS[SUBPROTOCOLS[offered]], offered
+    return CODECS.get(websocket.query_params.get("proto", "json"), JSON), None
+
+
+class Frame:
+    """Исходящее событие с кэшем закодированных представлений по формату."""
+
+    __slots__ = ("_event", "_encoded")
+
+    def __init__(self, event: Any = None) -> None:
+        self._event = event
+        self._encoded: Dict[str, Data] = {}
+
+    @classmethod
+    def from_json(cls, text: str) -> "Frame":
+        # Сообщение, пришедшее через backplane, уже в JSON: JSON-клиентам уходит как есть
+        frame = cls()
+        frame._encoded[JSON.name] = text
+        return frame
+
+    @property
+    def event(self) -> Any:
+        if self._event is None:
+            self._event = JSON.decode(self._encoded[JSON.name])
+        return self._event
+
+    @property
+    def json(self) -> str:
+        return self.encode(JSON)
+
+    def encode(self, codec) -> Data:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.event)
+        return data
+
+
+async def receive_data(websocket: WebSocket) -> Data:
+    # receive_text() падает на бинарных кадрах, поэтому читаем сырое ASGI-сообщение
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        return message["bytes"]
+    return message.get("text") or ""
+
+
+async def send_data(websocket: WebSocket, codec, data: Data) -> None:
+    if codec.binary:
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
@@ -0,0 +1,173 @@
+# ratelimit.py
+# Ограничение частоты запросов: token bucket (ёмкость burst, пополнение rate токенов в секунду).
+# Лимиты задаются в Settings строками вида "20/minute" (20 запросов подряд, дальше — 20 в минуту);
+# пустая строка отключает лимит.
+# Бэкенды: memory — в процессе воркера; redis — общий для всех воркеров (Lua-скрипт, один round-trip).
+import logging
+import math
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional
+
+from fastapi import Depends, HTTPException, Request
+
+from .auth import get_current_user
+from .config import get_settings
+from .models import User
+
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@dataclass(frozen=True, slots=True)
+class Limit:
+    name: str
+    rate: float  # токенов в секунду
+    burst: float  # ёмкость ведра
+
+    @classmethod
+    def parse(cls, name: str, spec: str) -> "Limit":
+        count, _, period = spec.partition("/")
+        seconds = PERIODS.get(period.strip() or "second")
+        if seconds is None or not count.strip().isdigit() or int(count) <= 0:
+            raise ValueError(f"invalid rate limit {name}={spec!r}, expected e.g. '20/minute'")
+        return cls(name, int(count) / seconds, float(count))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float) -> None:
+        self.tokens = tokens
+        self.updated = now
+
+    def take(self, limit: Limit, now: float, cost: float = 1.0) -> float:
+        """0 — запрос разрешён; иначе сколько секунд ждать. Состояние меняется на месте, без аллокаций."""
+        tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+        if tokens >= cost:
+            self.tokens = tokens - cost
+            return 0.0
+        self.tokens = tokens
+        return (cost - tokens) / limit.rate
+
+
+class MemoryBackend:
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self.max_keys = max_keys
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def hit_nowait(self, limit: Limit, key: str, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                # Вытесняем самый давно созданный ключ (dict хранит порядок вставки)
+                del self._buckets[next(iter(self._buckets))]
+            bucket = self._buckets[key] = TokenBucket(limit.burst, now)
+        return bucket.take(limit, now, cost)
+
+    async def hit(self, limit: Limit, key: str, cost: float = 1.0) -> float:
+        return self.hit_nowait(limit, key, cost)
+
+
+# KEYS[1] — ведро; ARGV: rate, burst, cost. Время берём у Redis, чтобы часы воркеров не влияли на лимит.
+# Возвращаем строкой: Lua-числа при возврате из скрипта обрезаются до целого
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry)
+"""
+
+
+class RedisBackend:
+    KEY = "ratelimit:{}"
+
+    def __init__(self, redis) -> None:
+        self.redis = redis
+        self._script = redis.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    async def hit(self, limit: Limit, key: str, cost: float = 1.0) -> float:
+        try:
+            return float(await self._script(keys=[self.KEY.format(key)], args=[limit.rate, limit.burst, cost]))
+        except Exception:
+            # Недоступный Redis не должен ронять логин и загрузки: пропускаем запрос
+            logger.warning("rate limit backend unavailable, allowing request", exc_info=True)
+            return 0.0
+
+
+# Горячие проверки внутри WebSocket-цикла всегда в памяти воркера: Redis на каждый кадр — слишком дорого
+local_backend = MemoryBackend(get_settings().RATE_LIMIT_MAX_KEYS)
+
+
+@lru_cache()
+def get_backend():
+    if get_settings().RATE_LIMIT_BACKEND == "redis":
+        from .redis_client import get_redis
+
+        return RedisBackend(get_redis())
+    return local_backend
+
+
+@lru_cache()
+def get_limit(name: str) -> Optional[Limit]:
+    """Лимит из Settings.RATE_LIMIT_<NAME>; None — лимит выключен."""
+    settings = get_settings()
+    spec = getattr(settings, f"RATE_LIMIT_{name.upper()}")
+    if not settings.RATE_LIMIT_ENABLED or not spec:
+        return None
+    return Limit.parse(name, spec)
+
+
+async def enforce(name: str, key: str) -> None:
+    limit = get_limit(name)
+    if limit is None:
+        return
+    retry_after = await get_backend().hit(limit, f"{name}:{key}")
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    # За прокси адрес клиента подставляет uvicorn (--proxy-headers / --forwarded-allow-ips)
+    return request.client.host if request.client else "unknown"
+
+
+def limit_by_ip(name: str):
+    """Зависимость FastAPI: лимит RATE_LIMIT_<NAME> на IP клиента."""
+
+    async def dependency(request: Request) -> None:
+        await enforce(name, client_ip(request))
+
+    return dependency
+
+
+def limit_by_user(name: str):
+    """Зависимость FastAPI: лимит RATE_LIMIT_<NAME> на текущего пользователя."""
+
+    async def dependency(current_user: User = Depends(get_current_user)) -> None:
+        await enforce(name, str(current_user.id))
+
+    return dependency
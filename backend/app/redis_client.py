@@ -0,0 +1,30 @@
+# redis_client.py
+# redis.asyncio импортируется при первом обращении: в одном процессе (local backplane, лимиты в памяти)
+# Redis не нужен, а импорт клиента заметно удлиняет старт воркера
+from typing import TYPE_CHECKING, Optional
+
+from .config import get_settings
+
+if TYPE_CHECKING:
+    import redis.asyncio as aioredis
+
+
+_client: Optional["aioredis.Redis"] = None
+
+
+def get_redis() -> "aioredis.Redis":
+    global _client
+    if _client is None:
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:  # redis нужен только для многоворкерного режима
+            raise RuntimeError("redis package is not installed") from None
+        _client = aioredis.from_url(get_settings().REDIS_URL)
+    return _client
+
+
+async def close_redis() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
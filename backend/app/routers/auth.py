@@ -1,39 +1,49 @@
 from datetime import timedelta
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..auth import create_access_token, get_password_hash, verify_password, get_current_user
+from ..auth import check_password, create_access_token, get_current_user, hash_password
 from ..config import get_settings
 from ..db import get_db_session
 from ..models import User
+from ..ratelimit import client_ip, enforce, limit_by_ip
 from ..schemas import Token, UserCreate, UserRead
 
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-@router.post("/register", response_model=UserRead)
+@router.post("/register", response_model=UserRead, dependencies=[Depends(limit_by_ip("register_ip"))])
 async def register(payload: UserCreate, session: AsyncSession = Depends(get_db_session)):
     # Check existing
     existing = await session.execute(select(User).where(User.email == payload.email))
     if existing.scalar_one_or_none():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
 
-    user = User(email=payload.email, full_name=payload.full_name, password_hash=get_password_hash(payload.password))
+    password_hash = await hash_password(payload.password)
+    user = User(email=payload.email, full_name=payload.full_name, password_hash=password_hash)
     session.add(user)
     await session.commit()
     await session.refresh(user)
     return user
 
 
-@router.post("/login", response_model=Token)
+async def login_rate_limit(request: Request, form_data: OAuth2PasswordRequestForm = Depends()) -> None:
+    # До bcrypt: с одного IP и в один аккаунт с этого IP (форма разбирается один раз — FastAPI кэширует зависимость).
+    # Ведро аккаунта — вместе с IP: иначе любой мог бы держать чужой аккаунт заблокированным, просто отправляя его email
+    ip = client_ip(request)
+    await enforce("login_ip", ip)
+    await enforce("login_account", f"{form_data.username.lower()}|{ip}")
+
+
+@router.post("/login", response_model=Token, dependencies=[Depends(login_rate_limit)])
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_db_session)):
     result = await session.execute(select(User).where(User.email == form_data.username))
     user = result.scalar_one_or_none()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not await check_password(form_data.password, user.password_hash):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect email or password")
 
     access_token_expires = timedelta(minutes=get_settings().ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -1,37 +1,357 @@
 # chat.py
-from typing import Dict
-import json
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
-from ..auth import decode_access_token_user_id
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, FrozenSet, Iterable, List, Optional, Set
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect, status
+from ..auth import decode_access_token_user_id, get_active_user, get_current_user
+from ..backplane import Backplane, create_backplane
+from ..config import get_settings
+from ..db import async_session_factory
+from ..ids import next_message_id
+from ..inbox import delivery_tracker
+from ..membership import membership_cache, shared_with
+from ..message_store import PendingMessage, message_writer
+from ..metrics import chat_messages
+from ..models import User
+from ..presence import TYPING_KIND, PresenceTracker, TypingCoalescer, wants_typing
+from ..protocol import JSON, Frame, negotiate, receive_data, send_data
+from ..ratelimit import TokenBucket, get_limit, local_backend
 
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    """Сокет с собственной ограниченной очередью отправки: медленный клиент не тормозит остальных."""
+
+    __slots__ = ("user_id", "websocket", "codec", "queue", "sender", "last_seen", "frames", "users", "conversations")
+
+    def __init__(self, user_id: int, websocket: WebSocket, max_queue: int, codec=JSON) -> None:
+        self.user_id = user_id
+        self.websocket = websocket
+        self.codec = codec
+        self.queue: asyncio.Queue[Frame] = asyncio.Queue(maxsize=max_queue)
+        self.sender: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        # Лимит входящих кадров этого соединения (RATE_LIMIT_WS_FRAMES)
+        self.frames = TokenBucket(0.0, self.last_seen)
+        # Подписка на эфемерные события (presence.py): чей статус показывать и какие диалоги открыты
+        self.users: Set[int] = set()
+        self.conversations: Set[int] = set()
+
+    def start(self, preamble: Optional[AsyncIterator[Any]] = None) -> None:
+        self.sender = asyncio.create_task(self._send_loop(preamble))
+
+    def stop(self) -> None:
+        if self.sender is not None:
+            self.sender.cancel()
+
+    def touch(self) -> float:
+        # Любой входящий кадр (в том числе pong) — признак живого соединения
+        self.last_seen = time.monotonic()
+        return self.last_seen
+
+    def offer(self, message: Frame) -> bool:
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _send_loop(self, preamble: Optional[AsyncIterator[Any]]) -> None:
+        try:
+            # Сначала — события, которые должны уйти до живых сообщений (backlog); живые тем временем копятся в очереди
+            if preamble is not None:
+                async for event in preamble:
+                    await send_data(self.websocket, self.codec, self.codec.encode(event))
+            while True:
+                frame = await self.queue.get()
+                await send_data(self.websocket, self.codec, frame.encode(self.codec))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Сокет закрыт — приёмный цикл эндпоинта получит WebSocketDisconnect и уберёт соединение
+            pass
+
 
 class ConnectionManager:
-    def __init__(self) -> None:
-        self.active_connections: Dict[int, WebSocket] = {}
+    """Соединения этого воркера: у пользователя может быть несколько устройств (до max_per_user)."""
+
+    def __init__(
+        self,
+        backplane: Optional[Backplane] = None,
+        send_queue_max: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        max_per_user: Optional[int] = None,
+        heartbeat_interval: Optional[float] = None,
+        heartbeat_timeout: Optional[float] = None,
+    ) -> None:
+        settings = get_settings()
+        # user_id -> соединения в порядке подключения (первое — самое старое)
+        self.active_connections: Dict[int, List[Connection]] = {}
+        self.connection_count = 0
+        self.backplane = backplane or create_backplane()
+        # None — значение из настроек; явный 0 не подменяется настройкой
+        self.send_queue_max = settings.CHAT_SEND_QUEUE_MAX if send_queue_max is None else send_queue_max
+        self.max_connections = settings.CHAT_MAX_CONNECTIONS if max_connections is None else max_connections
+        self.max_per_user = settings.CHAT_MAX_CONNECTIONS_PER_USER if max_per_user is None else max_per_user
+        self.heartbeat_interval = (
+            settings.CHAT_HEARTBEAT_INTERVAL_SECONDS if heartbeat_interval is None else heartbeat_interval
+        )
+        self.heartbeat_timeout = settings.CHAT_HEARTBEAT_TIMEOUT_SECONDS if heartbeat_timeout is None else heartbeat_timeout
+        self.dropped_slow_consumers = 0
+        self.evicted_idle = 0
+        self.evicted_over_limit = 0
+        self.rejected_over_capacity = 0
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.max_subscriptions = settings.CHAT_MAX_SUBSCRIPTIONS
+        self.typing = TypingCoalescer(
+            self.send_ephemeral, interval=settings.CHAT_TYPING_INTERVAL_MS / 1000, ttl=settings.CHAT_TYPING_TTL_SECONDS,
+        )
+        self.presence = PresenceTracker(self.online_many, self.offer, interval=settings.CHAT_PRESENCE_INTERVAL_SECONDS)
+
+    async def start(self) -> None:
+        await self.backplane.start(self._deliver_local)
+        if self.heartbeat_interval > 0:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        await self.typing.start()
+        await self.presence.start()
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        await self.typing.stop()
+        await self.presence.stop()
+        await self.backplane.stop()
+
+    async def connect(self, user_id: int, websocket: WebSocket, preamble: Optional[AsyncIterator[Any]] = None) -> Optional[Connection]:
+        """Принимает сокет; None — воркер заполнен, сокет закрыт с 1013 (клиенту стоит переподключиться позже)."""
+        codec, subprotocol = negotiate(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        if self.connection_count >= self.max_connections:
+            self.rejected_over_capacity += 1
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="server is at capacity")
+            return None
+
+        connection = Connection(user_id, websocket, self.send_queue_max, codec)
+        # Лимит устройств: освобождаем место, отключая самые старые соединения пользователя.
+        # _remove удаляет из реестра опустевший список, поэтому список берём заново уже после вытеснения
+        if self.max_per_user > 0:
+            existing = self.active_connections.get(user_id, [])
+            for old in existing[:max(len(existing) - self.max_per_user + 1, 0)]:
+                self.evicted_over_limit += 1
+                self._drop(old, status.WS_1008_POLICY_VIOLATION, "too many connections")
+        connections = self.active_connections.setdefault(user_id, [])
+        # Первое соединение на воркере (в том числе после вытеснения всех прежних) регистрируем в backplane;
+        # _close вытесненного не снимет регистрацию, пока пользователь есть в реестре
+        first = not connections
+        connections.append(connection)
+        self.connection_count += 1
+        connection.start(preamble)
+        if first:
+            await self.backplane.register(user_id)
+        return connection
+
+    async def disconnect(self, user_id: int, websocket: WebSocket) -> None:
+        connections = self.active_connections.get(user_id, ())
+        connection = next((c for c in connections if c.websocket is websocket), None)
+        if connection is None:
+            # Уже убрано (вытеснено, медленный клиент, таймаут heartbeat)
+            return
+        connection.stop()
+        if self._remove(connection):
+            await self.backplane.unregister(user_id)
+
+    async def is_online(self, user_id: int) -> bool:
+        return user_id in self.active_connections or bool(await self.backplane.locate(user_id))
+
+    async def online_many(self, user_ids: List[int]) -> Set[int]:
+        # Свои сокеты — из памяти, остальное — одним запросом к реестру backplane
+        online = {user_id for user_id in user_ids if user_id in self.active_connections}
+        remote = [user_id for user_id in user_ids if user_id not in online]
+        if remote:
+            online.update(user_id for user_id, workers in zip(remote, await self.backplane.locate_many(remote)) if workers)
+        return online
+
+    async def subscribe(self, connection: Connection, users: Iterable[int], conversations: Iterable[int]) -> None:
+        # Подписка только на своё: диалоги, где пользователь участник, и собеседников по общим диалогам
+        requested = list(dict.fromkeys(conversations))[:self.max_subscriptions]
+        memberships = await asyncio.gather(*(membership_cache.members(cid) for cid in requested))
+        connection.conversations = {cid for cid, members in zip(requested, memberships) if connection.user_id in members}
+        rejected = [cid for cid in requested if cid not in connection.conversations]
+        if rejected:
+            self.offer(connection, Frame({"error": "not a member of the conversation", "conversation_ids": rejected}))
+        visible = await shared_with(connection.user_id, list(users)[:self.max_subscriptions])
+        if connection not in self.active_connections.get(connection.user_id, ()):
+            # Сокет закрылся, пока шли запросы: unsubscribe уже был, подписка осталась бы висеть в PresenceTracker
+            return
+        snapshot = await self.presence.subscribe(connection, sorted(visible))
+        self.offer(connection, Frame(snapshot))
+
+    async def send_ephemeral(self, user_ids: FrozenSet[int], event: dict) -> None:
+        # Как send_to_users, но сокетам — только по подписке; воркеры получателей фильтруют сами (_deliver_local)
+        message = Frame(event)
+        local = set()
+        for user_id in user_ids:
+            connections = self.active_connections.get(user_id)
+            if connections:
+                local.add(user_id)
+                for connection in list(connections):
+                    if wants_typing(connection, event):
+                        self.offer(connection, message)
+        await self.backplane.publish_many(list(user_ids), message.json, delivered_locally=local, kind=TYPING_KIND)
+
+    async def send_personal_message(self, user_id: int, message: Frame) -> bool:
+        return await self.send_to_users([user_id], message) > 0
+
+    async def send_to_users(self, user_ids: Iterable[int], message: Frame) -> int:
+        # Одно уже сериализованное сообщение всем получателям: сокетам на этом воркере — в их очереди,
+        # другим устройствам тех же пользователей и остальным получателям — пачками через backplane.
+        # Между воркерами событие всегда идёт в JSON; формат клиента выбирает воркер получателя
+        user_ids = list(user_ids)
+        local = set()
+        for user_id in user_ids:
+            connections = self.active_connections.get(user_id)
+            if connections:
+                local.add(user_id)
+                for connection in list(connections):
+                    self.offer(connection, message)
+        return await self.backplane.publish_many(user_ids, message.json, delivered_locally=local)
 
-    async def connect(self, user_id: int, websocket: WebSocket) -> None:
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+    async def broadcast(self, message: Frame) -> None:
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                self.offer(connection, message)
 
-    def disconnect(self, user_id: int) -> None:
-        self.active_connections.pop(user_id, None)
+    async def _deliver_local(self, user_id: int, message: str, kind: str = "") -> None:
+        connections = self.active_connections.get(user_id)
+        if connections:
+            frame = Frame.from_json(message)
+            typing = kind == TYPING_KIND
+            for connection in list(connections):
+                if typing and not wants_typing(connection, frame.event):
+                    continue
+                self.offer(connection, frame)
 
-    async def send_personal_message(self, user_id: int, message: str) -> None:
-        ws = self.active_connections.get(user_id)
-        if ws:
-            await ws.send_text(message)
+    def offer(self, connection: Connection, message: Frame) -> None:
+        if connection.offer(message):
+            return
+        # Клиент не успевает читать: отключаем его, а не копим сообщения и не ждём.
+        # Пропущенное он получит из backlog после переподключения
+        self.dropped_slow_consumers += 1
+        self._drop(connection, status.WS_1013_TRY_AGAIN_LATER, "send queue overflow")
 
-    async def broadcast(self, message: str) -> None:
-        for ws in self.active_connections.values():
-            await ws.send_text(message)
+    async def _heartbeat_loop(self) -> None:
+        # Клиент отвечает на ping кадром {"type": "pong"}; соединения, молчащие дольше heartbeat_timeout
+        # (полуоткрытые TCP, уснувшие мобильные клиенты), закрываются и освобождают память и дескрипторы
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                deadline = time.monotonic() - self.heartbeat_timeout
+                ping = Frame({"type": "ping"})
+                for connections in list(self.active_connections.values()):
+                    for connection in list(connections):
+                        if connection.last_seen < deadline:
+                            self.evicted_idle += 1
+                            self._drop(connection, status.WS_1001_GOING_AWAY, "heartbeat timeout")
+                        else:
+                            self.offer(connection, ping)
+            except Exception:
+                logger.exception("chat heartbeat sweep failed")
+
+    def _remove(self, connection: Connection) -> bool:
+        """Убирает соединение из реестра; True — это было последнее соединение пользователя на воркере."""
+        connections = self.active_connections.get(connection.user_id)
+        if connections is None or connection not in connections:
+            return False
+        connections.remove(connection)
+        self.connection_count -= 1
+        self.presence.unsubscribe(connection)
+        if connections:
+            return False
+        del self.active_connections[connection.user_id]
+        return True
+
+    def _drop(self, connection: Connection, code: int, reason: str) -> None:
+        connection.stop()
+        last = self._remove(connection)
+        asyncio.create_task(self._close(connection, code, reason, last))
+
+    async def _close(self, connection: Connection, code: int, reason: str, unregister: bool) -> None:
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code, reason=reason), timeout=5)
+        except Exception:
+            pass
+        if unregister and connection.user_id not in self.active_connections:
+            await self.backplane.unregister(connection.user_id)
 
 
 manager = ConnectionManager()
 
 
+async def user_exists(user_id: int) -> bool:
+    # Подключённый пользователь точно существует; остальных проверяем через кэш auth (в БД — только при промахе)
+    if user_id in manager.active_connections:
+        return True
+    async with async_session_factory() as session:
+        return await get_active_user(session, user_id) is not None
+
+
+def _int_list(value: Any) -> List[int]:
+    if not isinstance(value, list):
+        return []
+    result = []
+    for item in value:
+        try:
+            result.append(int(item))
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+async def handle_typing(connection: Connection, obj: dict) -> None:
+    user_id = connection.user_id
+    try:
+        conversation_id = int(obj["conversation_id"]) if obj.get("conversation_id") is not None else None
+        to_user_id = int(obj["to_user_id"]) if obj.get("to_user_id") is not None else None
+    except (TypeError, ValueError):
+        return
+    if conversation_id is not None:
+        members = await membership_cache.members(conversation_id)
+        if user_id not in members:
+            manager.offer(connection, Frame({"error": "not a member of the conversation", "conversation_id": conversation_id}))
+            return
+        await manager.typing.touch(("conversation", conversation_id), {
+            "type": "typing", "conversation_id": conversation_id,
+        }, members, user_id)
+    elif to_user_id is not None and to_user_id != user_id:
+        # Личный чат без id диалога: у каждого направления своё состояние, событие — только собеседнику
+        await manager.typing.touch(("direct", user_id, to_user_id), {
+            "type": "typing", "conversation_id": None, "peer_id": user_id,
+        }, frozenset((to_user_id,)), user_id)
+
+
+@router.get("/presence")
+async def presence_snapshot(
+    user_ids: List[int] = Query(..., alias="user_id", max_length=200),
+    current_user: User = Depends(get_current_user),
+):
+    # Тот же снимок, что получает сокет при подписке; для экранов без открытого WebSocket.
+    # Пользователи без общего диалога с вызывающим в ответ не попадают
+    visible = await shared_with(current_user.id, user_ids)
+    online = await manager.online_many(sorted(visible))
+    return {"online": sorted(online), "offline": sorted(visible - online)}
+
+
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     token = websocket.query_params.get("token")
@@ -44,31 +364,121 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await manager.connect(user_id, websocket)
+    # Пропущенное за время офлайна уходит первым, затем живые сообщения (клиент убирает дубли по id)
+    connection = await manager.connect(user_id, websocket, preamble=delivery_tracker.backlog(user_id))
+    if connection is None:
+        return
+    codec = connection.codec
+    frame_limit = get_limit("ws_frames")
+    if frame_limit is not None:
+        connection.frames.tokens = frame_limit.burst
+    message_limit = get_limit("ws_messages")
+    message_key = f"ws_messages:{user_id}"
     try:
         while True:
-            raw = await websocket.receive_text()
+            raw = await receive_data(websocket)
+            now = connection.touch()
+            # Лишние кадры отбрасываем, не разбирая; клиенту — ошибка с временем ожидания
+            if frame_limit is not None and (retry_after := connection.frames.take(frame_limit, now)):
+                manager.offer(connection, Frame({"error": "rate limited", "retry_after": round(retry_after, 3)}))
+                continue
+            try:
+                obj = codec.decode(raw)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict) and obj.get("type") == "pong":
+                continue
+            if isinstance(obj, dict) and obj.get("type") == "typing":
+                await handle_typing(connection, obj)
+                continue
+            if isinstance(obj, dict) and obj.get("type") == "subscribe":
+                await manager.subscribe(connection, _int_list(obj.get("users")), _int_list(obj.get("conversations")))
+                continue
+            if isinstance(obj, dict) and obj.get("type") == "ack":
+                # Подтверждение доставки всех сообщений с id <= up_to
+                try:
+                    delivery_tracker.ack(user_id, int(obj.get("up_to")))
+                except (TypeError, ValueError):
+                    pass
+                continue
             try:
-                obj = json.loads(raw)
+                if not isinstance(obj, dict):
+                    raise ValueError("plain text frame")
                 to_user_id = int(obj.get("to_user_id")) if obj.get("to_user_id") is not None else None
+                conversation_id = int(obj.get("conversation_id")) if obj.get("conversation_id") is not None else None
                 text = str(obj.get("text", ""))
                 image_url = obj.get("image_url")
             except Exception:
                 to_user_id = None
-                text = raw
+                conversation_id = None
+                text = raw if isinstance(raw, str) else raw.decode("utf-8", "replace")
                 image_url = None
 
-            payload = json.dumps({"sender_id": user_id, "text": text, "image_url": image_url, "to_user_id": to_user_id})
+            if message_limit is not None and (retry_after := local_backend.hit_nowait(message_limit, message_key)):
+                manager.offer(connection, Frame({"error": "rate limited", "retry_after": round(retry_after, 3)}))
+                continue
+
+            members = None
+            if conversation_id is not None:
+                members = await membership_cache.members(conversation_id)
+                if user_id not in members:
+                    # Ошибка — только в тот сокет, откуда пришло сообщение
+                    manager.offer(connection, Frame({
+                        "error": "not a member of the conversation",
+                        "conversation_id": conversation_id,
+                    }))
+                    continue
+                to_user_id = None
+            elif to_user_id is not None and to_user_id != user_id and not await user_exists(to_user_id):
+                # Иначе writer создал бы личный диалог с несуществующим пользователем
+                manager.offer(connection, Frame({"error": "unknown recipient", "to_user_id": to_user_id}))
+                continue
+
+            message_id = next_message_id()
+            created_at = datetime.utcnow()
+            # Кодируется лениво: по разу на каждый формат, которым пользуются получатели
+            payload = Frame({
+                "id": message_id,
+                "sender_id": user_id,
+                "text": text,
+                "image_url": image_url,
+                "to_user_id": to_user_id,
+                "conversation_id": conversation_id,
+                "created_at": created_at.isoformat(),
+            })
+
+            if members is not None:
+                # Группа: всем участникам (включая отправителя — это и есть эхо), конкурентно через очереди сокетов
+                await manager.send_to_users(members, payload)
+                chat_messages.labels("group").inc()
+                await message_writer.submit(PendingMessage(
+                    id=message_id,
+                    sender_id=user_id,
+                    content=text,
+                    created_at=created_at,
+                    image_url=image_url,
+                    conversation_id=conversation_id,
+                ))
+                continue
+
+            # Адресная доставка на все устройства получателя (они могут быть на других воркерах)
+            # + эхо на все устройства отправителя. Без указания получателя — только эхо (никакого broadcast)
+            await manager.send_to_users({user_id, to_user_id} if to_user_id else [user_id], payload)
+            chat_messages.labels("direct" if to_user_id else "echo").inc()
 
-            if to_user_id and to_user_id in manager.active_connections:
-                # Адресная доставка + эхо отправителю
-                await manager.send_personal_message(to_user_id, payload)
-                if to_user_id != user_id:
-                    await manager.send_personal_message(user_id, payload)
-            else:
-                # Без указания получателя — эхо только отправителю (никакого broadcast)
-                await manager.send_personal_message(user_id, payload)
+            # Сохраняем историю уже после доставки: запись идёт пачками в фоне
+            if to_user_id and to_user_id != user_id:
+                await message_writer.submit(PendingMessage(
+                    id=message_id,
+                    sender_id=user_id,
+                    content=text,
+                    created_at=created_at,
+                    image_url=image_url,
+                    recipient_id=to_user_id,
+                ))
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
+    finally:
+        await manager.disconnect(user_id, websocket)
 
 
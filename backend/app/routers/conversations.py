@@ -0,0 +1,182 @@
+import base64
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth import get_current_user
+from ..db import get_db_session, get_read_db_session
+from ..ids import min_id_at
+from ..message_store import message_writer
+from ..models import Conversation, Membership, Message, User
+from ..ratelimit import limit_by_user
+from ..schemas import (
+    ConversationPage,
+    ConversationSummary,
+    MessagePage,
+    MessageRead,
+    MessageSearchPage,
+    ReadMarker,
+    ReadState,
+)
+from ..search import search_messages
+
+
+router = APIRouter(prefix="/conversations", tags=["conversations"])
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{message_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+async def ensure_member(session: AsyncSession, conversation_id: int, user_id: int) -> None:
+    result = await session.execute(
+        select(Membership.id).where(Membership.conversation_id == conversation_id, Membership.user_id == user_id)
+    )
+    if result.scalar_one_or_none() is None:
+        # Не раскрываем, существует ли чужой диалог
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found")
+
+
+def peer_id(direct_key: Optional[str], user_id: int) -> Optional[int]:
+    if not direct_key:
+        return None
+    low, high = (int(part) for part in direct_key.split(":"))
+    return high if low == user_id else low
+
+
+@router.get("", response_model=ConversationPage)
+async def list_conversations(
+    limit: int = Query(30, ge=1, le=100),
+    before: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_db_session),
+):
+    # Один запрос: диапазон индекса (user_id, last_activity_at, conversation_id) и по строке на страницу
+    # из conversations и messages по первичному ключу — без подзапросов "последнее сообщение"
+    query = (
+        select(Membership.unread_count, Membership.last_activity_at, Conversation, Message)
+        .join(Conversation, Conversation.id == Membership.conversation_id)
+        .outerjoin(Message, Message.id == Conversation.last_message_id)
+        .where(Membership.user_id == current_user.id)
+    )
+    if before:
+        activity_at, conversation_id = decode_cursor(before)
+        query = query.where(tuple_(Membership.last_activity_at, Membership.conversation_id) < (activity_at, conversation_id))
+    query = query.order_by(Membership.last_activity_at.desc(), Membership.conversation_id.desc()).limit(limit + 1)
+
+    rows = (await session.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].last_activity_at, rows[-1].Conversation.id)
+    items = [
+        ConversationSummary(
+            id=row.Conversation.id,
+            title=row.Conversation.title,
+            is_group=row.Conversation.is_group,
+            peer_id=peer_id(row.Conversation.direct_key, current_user.id),
+            unread_count=max(row.unread_count, 0),
+            last_activity_at=row.last_activity_at,
+            last_message=MessageRead.model_validate(row.Message) if row.Message is not None else None,
+        )
+        for row in rows
+    ]
+    return ConversationPage(items=items, next_cursor=next_cursor)
+
+
+@router.post("/{conversation_id}/read", response_model=ReadState)
+async def mark_read(
+    conversation_id: int,
+    marker: Optional[ReadMarker] = None,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    await ensure_member(session, conversation_id, current_user.id)
+    # Сообщения, принятые этим воркером, но ещё не записанные, иначе writer посчитал бы их непрочитанными позже
+    await message_writer.flush()
+
+    up_to = marker.up_to if marker is not None else None
+    if up_to is None:
+        up_to = (await session.execute(
+            select(Conversation.last_message_id).where(Conversation.id == conversation_id)
+        )).scalar_one() or 0
+    # Как с подтверждениями доставки: id "из будущего" скрыл бы ещё не пришедшие сообщения
+    up_to = min(up_to, min_id_at(int(time.time() * 1000) + 1000))
+    # Непрочитанным остаётся то, что пришло после up_to (по индексу (conversation_id, id))
+    remaining = (
+        select(func.count())
+        .select_from(Message)
+        .where(Message.conversation_id == conversation_id, Message.id > up_to, Message.sender_id != current_user.id)
+        .scalar_subquery()
+    )
+    # Отметка только растёт: запоздавший запрос с другого устройства её не откатит
+    await session.execute(
+        update(Membership)
+        .where(
+            Membership.conversation_id == conversation_id,
+            Membership.user_id == current_user.id,
+            Membership.last_read_message_id < up_to,
+        )
+        .values(last_read_message_id=up_to, unread_count=remaining)
+    )
+    await session.commit()
+    state = (await session.execute(
+        select(Membership.unread_count, Membership.last_read_message_id)
+        .where(Membership.conversation_id == conversation_id, Membership.user_id == current_user.id)
+    )).one()
+    return ReadState(
+        conversation_id=conversation_id,
+        unread_count=max(state.unread_count, 0),
+        last_read_message_id=state.last_read_message_id,
+    )
+
+
+@router.get("/{conversation_id}/messages", response_model=MessagePage)
+async def list_messages(
+    conversation_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_db_session),
+):
+    await ensure_member(session, conversation_id, current_user.id)
+
+    # Keyset-пагинация по индексу (conversation_id, created_at, id): стоимость страницы не зависит от глубины истории
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if before:
+        created_at, message_id = decode_cursor(before)
+        query = query.where(tuple_(Message.created_at, Message.id) < (created_at, message_id))
+    query = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
+
+    messages = (await session.execute(query)).scalars().all()
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        last = messages[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return MessagePage(items=[MessageRead.model_validate(m) for m in messages], next_cursor=next_cursor)
+
+
+@router.get("/{conversation_id}/search", response_model=MessageSearchPage, dependencies=[Depends(limit_by_user("search_user"))])
+async def search_conversation(
+    conversation_id: int,
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_db_session),
+):
+    await ensure_member(session, conversation_id, current_user.id)
+    return await search_messages(session, current_user.id, q, conversation_id=conversation_id, limit=limit, cursor=cursor)
@@ -0,0 +1,301 @@
+import asyncio
+import mimetypes
+from pathlib import Path
+from typing import AsyncIterator, Generator, Optional, Tuple
+
+from cryptography.fernet import InvalidToken
+from cryptography.exceptions import InvalidTag
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
+from starlette.types import Receive, Scope, Send
+
+from ..auth import get_current_user
+from ..config import get_settings
+from ..cache import ByteLRU, TTLCache
+from ..db import get_db_session, read_session_factory
+from ..executors import run_io
+from ..media_crypto import MediaFile, MediaFormatError, get_media_cipher
+from ..media_store import VARIANT_CONTENT_TYPE, get_media_object, media_info, release_media, store_upload, variant_filename
+from ..models import User
+from ..ratelimit import limit_by_ip, limit_by_user
+from ..schemas import UploadCreate, UploadRead
+from ..uploads import create_session, load_owned, open_writer, remove_session, state_view, upload_manager
+
+
+router = APIRouter(prefix="/media", tags=["media"])
+
+# Содержимое по имени не меняется, поэтому кэши не нужно инвалидировать — только ограничивать по размеру
+_blobs = ByteLRU(get_settings().MEDIA_BLOB_CACHE_BYTES, get_settings().MEDIA_BLOB_CACHE_MAX_ITEM_BYTES)
+_content_types: TTLCache[str] = TTLCache(maxsize=100_000, ttl=24 * 3600)
+
+
+def media_path(filename: str) -> Path:
+    # Имя приходит из URL: не даём выйти за пределы каталога загрузок
+    if not filename or "/" in filename or "\\" in filename or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = Path(get_settings().MEDIA_DIR) / filename
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Not found")
+    return path
+
+
+async def iterate_in_io_pool(chunks: Generator[bytes, None, None]) -> AsyncIterator[bytes]:
+    # Чтение и расшифровка каждого чанка — в пуле io
+    step: Optional[asyncio.Future] = None
+    try:
+        while True:
+            step = asyncio.ensure_future(run_io(next, chunks, None))
+            chunk = await asyncio.shield(step)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Закрываем и при обрыве клиента: генератор держит открытый файл. Если next ещё выполняется
+        # в пуле, закрыть генератор сейчас нельзя (он "уже выполняется") — закроем, когда шаг завершится
+        if step is None or step.done():
+            chunks.close()
+        else:
+            step.add_done_callback(lambda _: chunks.close())
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse, который закрывает итератор тела и при обрыве клиента. Starlette сам этого не делает,
+    и файл оставался бы открытым до сборки мусора."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Разбирает "bytes=a-b", "bytes=a-", "bytes=-n". Несколько диапазонов не поддерживаем — отдаём файл целиком."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+        else:
+            start, end = max(size - int(end_s), 0), size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+@router.post("/upload", dependencies=[Depends(limit_by_ip("media_upload_ip"))])
+async def upload_media(file: UploadFile = File(...), session: AsyncSession = Depends(get_db_session)):
+    # Примитивная валидация изображений по content-type
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Only image uploads are allowed")
+
+    Path(get_settings().MEDIA_DIR).mkdir(parents=True, exist_ok=True)
+    # Хэширование, шифрование и построение превью — в пуле io; в памяти не больше одного чанка на запрос
+    try:
+        media = await store_upload(session, file.file, file.content_type)
+    except OSError:
+        raise HTTPException(status_code=500, detail="Encryption error")
+    return media_info(media)
+
+
+# --- Возобновляемые загрузки (протокол — в uploads.py) ---
+
+@router.post("/uploads", response_model=UploadRead, status_code=201, dependencies=[Depends(limit_by_user("media_upload_session_user"))])
+async def create_upload(payload: UploadCreate, current_user: User = Depends(get_current_user)):
+    settings = get_settings()
+    if not any(payload.content_type.startswith(prefix) for prefix in settings.MEDIA_UPLOAD_CONTENT_TYPES):
+        raise HTTPException(status_code=400, detail="Content type is not allowed")
+    if payload.length > settings.MEDIA_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="File is too large")
+    state = await run_io(create_session, current_user.id, payload.length, payload.content_type, get_media_cipher())
+    return state_view(state)
+
+
+@router.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str, current_user: User = Depends(get_current_user)):
+    state = await run_io(load_owned, upload_id, current_user.id)
+    return Response(headers={
+        "Upload-Offset": str(state.offset), "Upload-Length": str(state.length), "Cache-Control": "no-store",
+    })
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadRead)
+async def upload_status(upload_id: str, current_user: User = Depends(get_current_user)):
+    return state_view(await run_io(load_owned, upload_id, current_user.id))
+
+
+@router.put("/uploads/{upload_id}", status_code=204)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Header(..., alias="Upload-Offset", ge=0),
+    current_user: User = Depends(get_current_user),
+):
+    # Тело читаем потоком и сразу пишем на диск: в памяти запроса — не больше одного чанка шифрования
+    state = await run_io(load_owned, upload_id, current_user.id)
+    lock = await upload_manager.lock(state.id)
+    try:
+        state = await run_io(load_owned, upload_id, current_user.id)
+        if state.status != "uploading":
+            raise HTTPException(status_code=409, detail=f"Upload is {state.status}")
+        writer = await run_io(open_writer, state, get_media_cipher())
+        try:
+            if offset != writer.offset:
+                raise HTTPException(status_code=409, detail="Offset mismatch", headers={"Upload-Offset": str(writer.offset)})
+            try:
+                async for data in request.stream():
+                    if writer.offset + len(data) > state.length:
+                        raise HTTPException(status_code=413, detail="Upload exceeds declared length")
+                    if data:
+                        await run_io(writer.write, data)
+            except ClientDisconnect:
+                # Принятое до обрыва сохраняем — клиент продолжит с Upload-Offset
+                pass
+        finally:
+            await run_io(writer.close)
+    finally:
+        await run_io(lock.release)
+    return Response(status_code=204, headers={"Upload-Offset": str(state.offset)})
+
+
+@router.post("/uploads/{upload_id}/finalize", response_model=UploadRead, status_code=202)
+async def finalize_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    state = await run_io(load_owned, upload_id, current_user.id)
+    lock = await upload_manager.lock(state.id)
+    try:
+        state = await run_io(load_owned, upload_id, current_user.id)
+        if state.status != "uploading":
+            # Повторный вызов (например, после обрыва ответа) — просто текущее состояние
+            await run_io(lock.release)
+            return state_view(state)
+        if state.offset != state.length:
+            raise HTTPException(
+                status_code=409, detail="Upload is incomplete", headers={"Upload-Offset": str(state.offset)},
+            )
+        state.status = "finalizing"
+        await run_io(state.save)
+    except BaseException:
+        await run_io(lock.release)
+        raise
+    # Хэш, дедупликация и превью — в фоне; блокировку сессии отпустит задача
+    upload_manager.finalize(state, lock)
+    return state_view(state)
+
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+async def cancel_upload(
+    upload_id: str, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_db_session),
+):
+    # Отмена уже обработанной загрузки (файл так и не отправили) снимает ссылку, добавленную финализацией;
+    # на последней ссылке файл и его копии удаляются. Ссылка принадлежит сессии владельца — чужие файлы так не удалить
+    state = await run_io(load_owned, upload_id, current_user.id)
+    lock = await upload_manager.lock(state.id)
+    try:
+        state = await run_io(load_owned, upload_id, current_user.id)
+        # Сначала удаляем сессию: при сбое между шагами ссылка останется лишней, но не будет снята дважды
+        await run_io(remove_session, state.id)
+    finally:
+        await run_io(lock.release)
+    if state.status == "done":
+        await release_media(session, state.result["filename"])
+    return Response(status_code=204)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match сравнивается слабо: W/"x" совпадает с "x"
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+async def content_type_for(filename: str) -> str:
+    content_type = _content_types.get(filename)
+    if content_type is None:
+        async with read_session_factory() as session:
+            media = await get_media_object(session, filename)
+        # Файлы, загруженные до media_objects, — по расширению имени
+        content_type = media.content_type if media is not None else mimetypes.guess_type(filename)[0]
+        content_type = content_type or "application/octet-stream"
+        _content_types.set(filename, content_type)
+    return content_type
+
+
+def read_all(media: MediaFile) -> bytes:
+    return b"".join(media.iter_range(0, media.size - 1)) if media.size else b""
+
+
+@router.get("/{filename}")
+async def get_media(
+    filename: str,
+    variant: Optional[str] = Query(None, description="уменьшенная копия: thumb, preview"),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+):
+    settings = get_settings()
+    path = media_path(filename)
+    if variant is not None:
+        if variant not in settings.MEDIA_VARIANTS:
+            raise HTTPException(status_code=404, detail="Not found")
+        # Копий нет у маленьких и не-растровых изображений — тогда отдаём оригинал
+        variant_path = path.with_name(variant_filename(path.name, variant))
+        if variant_path.is_file():
+            path = variant_path
+
+    # Файл под данным именем никогда не меняется (имя — хэш содержимого или uuid),
+    # поэтому имя и есть сильный ETag, а проверка If-None-Match не требует чтения и расшифровки
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{path.name}"',
+        "Cache-Control": settings.MEDIA_CACHE_CONTROL,
+        # Тип задаёт загрузивший клиент: не даём браузеру исполнять содержимое (например, SVG со скриптом)
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'; sandbox",
+    }
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    media_type = VARIANT_CONTENT_TYPE if path.name != filename else await content_type_for(filename)
+
+    blob = _blobs.get(path.name)
+    if blob is None:
+        try:
+            media = await run_io(MediaFile, path, get_media_cipher())
+            if media.size <= _blobs.max_item_bytes:
+                blob = await run_io(read_all, media)
+                _blobs.set(path.name, blob)
+        except (InvalidToken, InvalidTag, MediaFormatError):
+            raise HTTPException(status_code=500, detail="Decryption error")
+    size = len(blob) if blob is not None else media.size
+
+    if size == 0:
+        return Response(content=b"", media_type=media_type, headers=headers)
+
+    byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, status.HTTP_200_OK
+    else:
+        (start, end), status_code = byte_range, status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    if blob is not None:
+        body = blob if byte_range is None else blob[start:end + 1]
+        return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
+
+    headers["Content-Length"] = str(end - start + 1)
+    return ClosingStreamingResponse(
+        iterate_in_io_pool(media.iter_range(start, end)),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,88 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from ..config import get_settings
+from ..db import pool_metrics
+from ..executors import executor_stats
+from ..message_store import message_writer
+from ..metrics import CallbackMetric, profiler, render_metrics
+from ..uploads import upload_manager
+from .chat import manager
+from .media import _blobs
+
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+# Состояние, которое и так хранится в объектах, читаем только в момент запроса /metrics
+CallbackMetric("chat_connections", "Open chat WebSocket connections on this worker", lambda: {(): manager.connection_count})
+CallbackMetric("chat_connected_users", "Users with at least one connection on this worker", lambda: {(): len(manager.active_connections)})
+CallbackMetric(
+    "chat_disconnects_total", "Connections closed by the server", lambda: {
+        ("slow_consumer",): manager.dropped_slow_consumers,
+        ("idle",): manager.evicted_idle,
+        ("over_user_limit",): manager.evicted_over_limit,
+        ("over_capacity",): manager.rejected_over_capacity,
+    }, labelnames=("reason",), type="counter",
+)
+CallbackMetric("chat_write_queue_size", "Chat messages waiting to be written to the DB", lambda: {(): message_writer.queue_size})
+CallbackMetric(
+    "db_pool_checked_out", "DB connections in use",
+    lambda: {(name,): stats["checked_out"] for name, stats in pool_metrics().items()}, labelnames=("engine",),
+)
+CallbackMetric(
+    "executor_in_flight", "Blocking tasks running in executor pools",
+    lambda: {(name,): stats["in_flight"] for name, stats in executor_stats().items()}, labelnames=("pool",),
+)
+CallbackMetric(
+    "executor_waiting", "Blocking tasks waiting for a pool slot",
+    lambda: {(name,): stats["waiting"] for name, stats in executor_stats().items()}, labelnames=("pool",),
+)
+CallbackMetric("media_blob_cache_bytes", "Decrypted media cached in memory", lambda: {(): _blobs.size})
+CallbackMetric("media_uploads_finalizing", "Resumable uploads being processed in background", lambda: {(): len(upload_manager.finalizing)})
+
+
+def check_token(authorization: Optional[str] = Header(None)) -> None:
+    settings = get_settings()
+    token = settings.METRICS_TOKEN
+    if not token:
+        # Без токена внутренности (пулы, очереди, кэши) открыты только в dev
+        if settings.ENV != "dev":
+            raise HTTPException(status_code=403, detail="Metrics are disabled (METRICS_TOKEN is not set)")
+        return
+    if not hmac.compare_digest(authorization or "", f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+
+def require_token(authorization: Optional[str] = Header(None)) -> None:
+    # Профайлер влияет на производительность — без настроенного токена он недоступен
+    if not get_settings().METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiler is disabled (METRICS_TOKEN is not set)")
+    check_token(authorization)
+
+
+@router.get("", response_class=PlainTextResponse, dependencies=[Depends(check_token)])
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.post("/profiler/start", dependencies=[Depends(require_token)])
+async def start_profiler(interval_ms: float = Query(10, ge=1, le=1000)):
+    # Стек снимается с потока event loop (запрос обрабатывается в нём)
+    profiler.start(interval_ms / 1000)
+    return {"running": True, "interval_ms": interval_ms}
+
+
+@router.post("/profiler/stop", dependencies=[Depends(require_token)])
+async def stop_profiler():
+    profiler.stop()
+    return {"running": False, "samples": sum(profiler.samples.values())}
+
+
+@router.get("/profiler", response_class=PlainTextResponse, dependencies=[Depends(require_token)])
+async def profiler_samples():
+    # Свёрнутые стеки: flamegraph.pl / speedscope / inferno
+    return PlainTextResponse(profiler.collapsed())
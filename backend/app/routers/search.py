@@ -0,0 +1,26 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..auth import get_current_user
+from ..db import get_read_db_session
+from ..models import User
+from ..ratelimit import limit_by_user
+from ..schemas import MessageSearchPage
+from ..search import search_messages
+
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+@router.get("/messages", response_model=MessageSearchPage, dependencies=[Depends(limit_by_user("search_user"))])
+async def search_all_messages(
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_db_session),
+):
+    # Во всех диалогах пользователя
+    return await search_messages(session, current_user.id, q, limit=limit, cursor=cursor)
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends
+
+from ..db import pool_metrics
+from ..executors import executor_stats
+from ..search import search_index, use_postgres
+from ..uploads import upload_manager
+from .chat import manager
+from .media import _blobs
+from .metrics import check_token
+
+
+# Внутреннее состояние воркера — под тем же токеном, что и /metrics
+router = APIRouter(prefix="/stats", tags=["stats"], dependencies=[Depends(check_token)])
+
+
+@router.get("/executors")
+async def executors():
+    # Глубина очередей пулов блокирующих операций
+    return executor_stats()
+
+
+@router.get("/db")
+async def db_pools():
+    # Ожидание соединений из пула по каждому движку (primary/replica)
+    return pool_metrics()
+
+
+@router.get("/chat")
+async def chat_connections():
+    # Соединения этого воркера и причины отключений
+    return {
+        "connections": manager.connection_count,
+        "users": len(manager.active_connections),
+        "max_connections": manager.max_connections,
+        "dropped_slow_consumers": manager.dropped_slow_consumers,
+        "evicted_idle": manager.evicted_idle,
+        "evicted_over_limit": manager.evicted_over_limit,
+        "rejected_over_capacity": manager.rejected_over_capacity,
+        "typing_conversations": len(manager.typing),
+        "presence_watched_users": len(manager.presence),
+    }
+
+
+@router.get("/media")
+async def media_cache():
+    # Кэш расшифрованных медиа этого воркера
+    return {
+        "blob_cache_bytes": _blobs.size,
+        "blob_cache_max_bytes": _blobs.max_bytes,
+        "blob_cache_items": len(_blobs),
+        "blob_cache_hits": _blobs.hits,
+        "blob_cache_misses": _blobs.misses,
+        "uploads_finalizing": len(upload_manager.finalizing),
+        "uploads_collected": upload_manager.collected,
+    }
+
+
+@router.get("/search")
+async def search():
+    # Индекс поиска в памяти этого воркера (для Postgres — только имя бэкенда)
+    if use_postgres():
+        return {"backend": "postgres"}
+    return {
+        "backend": "memory",
+        "loaded": search_index.loaded,
+        "messages": len(search_index),
+        "terms": search_index.terms,
+    }
@@ -1,25 +1,84 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy import select
+import hashlib
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, Response
+from pydantic import TypeAdapter
+from sqlalchemy import event, func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..auth import get_current_user
-from ..db import get_db_session
+from ..cache import TTLCache
+from ..config import get_settings
+from ..db import get_read_db_session
 from ..models import User
+from ..ratelimit import limit_by_user
 from ..schemas import UserRead
 
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+_users_adapter = TypeAdapter(list[UserRead])
+# (q, cursor, limit) -> (directory_version, etag, body, next_cursor)
+_page_cache: TTLCache[tuple] = TTLCache(get_settings().USERS_PAGE_CACHE_MAX, get_settings().USERS_PAGE_CACHE_TTL_SECONDS)
+_directory_version = 0
+
 
-@router.get("/", response_model=list[UserRead])
-async def list_users(_: User = Depends(get_current_user), session: AsyncSession = Depends(get_db_session)):
-    result = await session.execute(select(User))
-    users = result.scalars().all()
-    return users
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _bump_directory_version(mapper, connection, target) -> None:
+    # Любое изменение пользователей через ORM делает закэшированные страницы устаревшими
+    global _directory_version
+    _directory_version += 1
 
 
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
 
+async def _load_page(session: AsyncSession, q: Optional[str], cursor: Optional[int], limit: int):
+    # Только нужные колонки (без password_hash), keyset по id
+    query = select(User.id, User.email, User.full_name, User.is_active, User.created_at)
+    if q:
+        pattern = _escape_like(q) + "%"
+        query = query.where(or_(
+            func.lower(User.email).like(pattern, escape="\\"),
+            func.lower(User.full_name).like(pattern, escape="\\"),
+        ))
+    if cursor is not None:
+        query = query.where(User.id > cursor)
+    rows = (await session.execute(query.order_by(User.id).limit(limit + 1))).mappings().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["id"]
+    body = _users_adapter.dump_json(_users_adapter.validate_python(rows, from_attributes=True))
+    return body, next_cursor
 
 
+@router.get("/", response_model=list[UserRead], dependencies=[Depends(limit_by_user("users_list_user"))])
+async def list_users(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = Query(None, description="X-Next-Cursor из предыдущей страницы"),
+    q: Optional[str] = Query(None, min_length=1, max_length=255, description="Префикс email или имени"),
+    if_none_match: Optional[str] = Header(None),
+    _: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_db_session),
+):
+    key = (q.lower() if q else None, cursor, limit)
+    cached = _page_cache.get(key)
+    if cached is None or cached[0] != _directory_version:
+        version = _directory_version
+        body, next_cursor = await _load_page(session, key[0], cursor, limit)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        cached = (version, etag, body, next_cursor)
+        _page_cache.set(key, cached)
 
+    _, etag, body, next_cursor = cached
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        # Страница не изменилась: ни запроса в БД, ни тела ответа
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
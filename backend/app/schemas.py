@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 
 
 class UserBase(BaseModel):
@@ -57,14 +57,71 @@ class MessageRead(BaseModel):
     conversation_id: int
     sender_id: Optional[int]
     content: str
+    image_url: Optional[str] = None
     created_at: datetime
 
     class Config:
         from_attributes = True
 
 
+class MessagePage(BaseModel):
+    items: List[MessageRead]
+    # Курсор для следующей (более старой) страницы; None — история закончилась
+    next_cursor: Optional[str] = None
 
 
+class ConversationSummary(BaseModel):
+    id: int
+    title: Optional[str] = None
+    is_group: bool
+    # Собеседник в личном диалоге
+    peer_id: Optional[int] = None
+    unread_count: int
+    last_activity_at: datetime
+    last_message: Optional[MessageRead] = None
+
+
+class ConversationPage(BaseModel):
+    items: List[ConversationSummary]
+    # Курсор следующей страницы (менее активные диалоги); None — диалогов больше нет
+    next_cursor: Optional[str] = None
+
+
+class ReadMarker(BaseModel):
+    # id последнего просмотренного сообщения; по умолчанию — последнее сообщение диалога
+    up_to: Optional[int] = None
+
+
+class ReadState(BaseModel):
+    conversation_id: int
+    unread_count: int
+    last_read_message_id: int
+
+
+class UploadCreate(BaseModel):
+    # Полный размер файла в байтах: сессия завершается, когда принято ровно столько
+    length: int = Field(..., ge=1)
+    content_type: str
+
+
+class UploadRead(BaseModel):
+    id: str
+    content_type: str
+    length: int
+    offset: int
+    # uploading -> finalizing -> done | failed
+    status: str
+    # Ответ как у POST /media/upload, когда status == "done"
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
 
+class MessageSearchHit(BaseModel):
+    message: MessageRead
+    rank: float
 
 
+class MessageSearchPage(BaseModel):
+    items: List[MessageSearchHit]
+    # Курсор следующей страницы (менее релевантные результаты); None — результатов больше нет
+    next_cursor: Optional[str] = None
@@ -0,0 +1,235 @@
+# search.py
+# Полнотекстовый поиск по сообщениям: ранжированная выдача с keyset-пагинацией по (rank, id),
+# только в диалогах, где пользователь состоит.
+# Postgres: GIN-индекс по to_tsvector (models.message_search_document), ранжирование ts_rank_cd.
+# Остальные БД (SQLite в разработке и тестах): инвертированный индекс в памяти процесса с BM25.
+# Его пополняет writer после записи каждой пачки, а при старте — фоновая загрузка сохранённых сообщений.
+# Индексация в обоих случаях не на пути отправки: сокет только кладёт сообщение в очередь writer'а.
+# Индекс в памяти — свой у каждого процесса и видит только сообщения, записанные этим процессом
+# (и загруженные при старте), поэтому с несколькими воркерами нужен Postgres.
+import asyncio
+import base64
+import heapq
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .db import async_session_factory, engine
+from .message_store import message_writer
+from .models import SEARCH_TEXT_CONFIG, Membership, Message, message_search_document
+from .schemas import MessageRead, MessageSearchHit, MessageSearchPage
+
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(content: str) -> List[str]:
+    return _TOKEN_RE.findall(content.lower())
+
+
+def use_postgres() -> bool:
+    backend = get_settings().SEARCH_BACKEND
+    return backend == "postgres" or (backend == "auto" and engine.dialect.name == "postgresql")
+
+
+def encode_cursor(rank: float, message_id: int) -> str:
+    # repr(float) восстанавливается float() без потерь — сравнение по курсору точное
+    return base64.urlsafe_b64encode(f"{rank!r}|{message_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return float(rank), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+class MemorySearchIndex:
+    """Инвертированный индекс: токен -> {message_id: частота в сообщении}."""
+
+    # Параметры BM25
+    K1 = 1.2
+    B = 0.75
+    LOAD_BATCH_SIZE = 1000
+
+    def __init__(self, session_factory) -> None:
+        self._session_factory = session_factory
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: Dict[int, int] = {}
+        self._conversations: Dict[int, int] = {}
+        self._total_length = 0
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @property
+    def terms(self) -> int:
+        return len(self._postings)
+
+    async def start(self) -> None:
+        # Подписываемся до загрузки: сообщения, записанные во время неё, не потеряются (дубли отсекает add)
+        message_writer.on_written.append(self.add_rows)
+        self._task = asyncio.create_task(self._load())
+
+    async def stop(self) -> None:
+        if self.add_rows in message_writer.on_written:
+            message_writer.on_written.remove(self.add_rows)
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def add(self, message_id: int, conversation_id: int, content: str) -> None:
+        if message_id in self._lengths:
+            return
+        counts = Counter(tokenize(content))
+        for token, count in counts.items():
+            self._postings.setdefault(token, {})[message_id] = count
+        length = sum(counts.values())
+        self._lengths[message_id] = length
+        self._conversations[message_id] = conversation_id
+        self._total_length += length
+
+    def add_rows(self, rows: Iterable[dict]) -> None:
+        for row in rows:
+            self.add(row["id"], row["conversation_id"], row["content"])
+
+    def search(
+        self,
+        terms: Iterable[str],
+        conversation_ids: Set[int],
+        limit: int,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> List[Tuple[float, int]]:
+        """(score, message_id) по убыванию; все термы обязательны, как в websearch_to_tsquery."""
+        postings = [self._postings.get(term) for term in set(terms)]
+        if not postings or not all(postings):
+            return []
+        # Кандидаты берём из самого редкого терма, остальные только проверяем
+        postings.sort(key=len)
+        total = len(self._lengths)
+        average_length = self._total_length / total
+        weights = [math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5)) for posting in postings]
+
+        def scored():
+            for message_id in postings[0]:
+                if self._conversations[message_id] not in conversation_ids:
+                    continue
+                norm = self.K1 * (1 - self.B + self.B * self._lengths[message_id] / average_length)
+                score = 0.0
+                for posting, weight in zip(postings, weights):
+                    frequency = posting.get(message_id)
+                    if frequency is None:
+                        break
+                    score += weight * frequency * (self.K1 + 1) / (frequency + norm)
+                else:
+                    if after is None or (score, message_id) < after:
+                        yield score, message_id
+
+        return heapq.nlargest(limit, scored())
+
+    async def _load(self) -> None:
+        after = 0
+        try:
+            while True:
+                async with self._session_factory() as session:
+                    rows = (await session.execute(
+                        select(Message.id, Message.conversation_id, Message.content)
+                        .where(Message.id > after)
+                        .order_by(Message.id)
+                        .limit(self.LOAD_BATCH_SIZE)
+                    )).all()
+                for row in rows:
+                    self.add(row.id, row.conversation_id, row.content)
+                if len(rows) < self.LOAD_BATCH_SIZE:
+                    break
+                after = rows[-1].id
+            self.loaded = True
+            logger.info("in-memory search index loaded: %d messages, %d terms", len(self), self.terms)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("failed to load in-memory search index, only new messages will be searchable")
+
+
+search_index = MemorySearchIndex(async_session_factory)
+
+
+async def search_messages(
+    session: AsyncSession,
+    user_id: int,
+    query: str,
+    conversation_id: Optional[int] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+) -> MessageSearchPage:
+    """Поиск в одном диалоге (членство проверяет вызывающий) или во всех диалогах пользователя."""
+    after = decode_cursor(cursor) if cursor else None
+    if not tokenize(query):
+        # Одна пунктуация: tsquery был бы пустым
+        return MessageSearchPage(items=[])
+    search = _search_postgres if use_postgres() else _search_memory
+    hits = await search(session, user_id, query, conversation_id, limit + 1, after)
+
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        rank, last = hits[-1]
+        next_cursor = encode_cursor(rank, last.id)
+    return MessageSearchPage(
+        items=[MessageSearchHit(message=MessageRead.model_validate(message), rank=rank) for rank, message in hits],
+        next_cursor=next_cursor,
+    )
+
+
+async def _search_postgres(
+    session: AsyncSession, user_id: int, query: str, conversation_id: Optional[int], limit: int, after: Optional[Tuple[float, int]],
+) -> List[Tuple[float, Message]]:
+    tsquery = func.websearch_to_tsquery(text(f"'{SEARCH_TEXT_CONFIG}'::regconfig"), query)
+    rank = func.ts_rank_cd(message_search_document, tsquery)
+    stmt = select(Message, rank.label("rank")).where(message_search_document.op("@@")(tsquery))
+    if conversation_id is not None:
+        stmt = stmt.where(Message.conversation_id == conversation_id)
+    else:
+        stmt = stmt.where(
+            Message.conversation_id.in_(select(Membership.conversation_id).where(Membership.user_id == user_id))
+        )
+    if after is not None:
+        stmt = stmt.where(or_(rank < after[0], and_(rank == after[0], Message.id < after[1])))
+    stmt = stmt.order_by(rank.desc(), Message.id.desc()).limit(limit)
+    return [(row.rank, row.Message) for row in await session.execute(stmt)]
+
+
+async def _search_memory(
+    session: AsyncSession, user_id: int, query: str, conversation_id: Optional[int], limit: int, after: Optional[Tuple[float, int]],
+) -> List[Tuple[float, Message]]:
+    if conversation_id is not None:
+        conversation_ids = {conversation_id}
+    else:
+        conversation_ids = set((await session.execute(
+            select(Membership.conversation_id).where(Membership.user_id == user_id)
+        )).scalars())
+    hits = search_index.search(tokenize(query), conversation_ids, limit, after)
+    if not hits:
+        return []
+    messages = {
+        message.id: message
+        for message in (await session.execute(select(Message).where(Message.id.in_([i for _, i in hits])))).scalars()
+    }
+    return [(score, messages[message_id]) for score, message_id in hits if message_id in messages]
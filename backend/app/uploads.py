@@ -0,0 +1,348 @@
+# uploads.py
+# Возобновляемые загрузки больших файлов (по мотивам протокола tus):
+#   POST   /media/uploads {length, content_type}  -> сессия
+#   PUT    /media/uploads/{id}, Upload-Offset: n  -> тело дописывается с позиции n (она должна совпадать с принятым)
+#   HEAD   /media/uploads/{id}                    -> Upload-Offset: сколько байт уже принято
+#   POST   /media/uploads/{id}/finalize           -> 202; обработка в фоне, результат — GET /media/uploads/{id}
+# Принятые байты сразу шифруются чанками формата media_crypto в файл данных сессии — после финализации
+# он становится файлом хранилища без повторного шифрования. Неполный последний чанк ("хвост") между
+# запросами лежит отдельным файлом, зашифрованный Fernet. Обрыв соединения посреди PUT не теряет
+# принятое: клиент спрашивает смещение и продолжает с него.
+# Состояние сессии — JSON рядом с данными в MEDIA_DIR/.uploads, поэтому продолжать можно на любом воркере;
+# одновременную запись в одну сессию исключает flock на файле .lock (его же держит фоновая финализация).
+# Брошенные сессии удаляет периодическая сборка мусора.
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import struct
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Set
+
+from cryptography.fernet import InvalidToken
+from fastapi import HTTPException, status
+
+from .config import get_settings
+from .db import async_session_factory
+from .executors import run_io
+from .media_crypto import HEADER_SIZE, TAG_SIZE, MediaCipher, get_media_cipher
+from .media_store import media_dir, media_info, store_file
+from .metrics import Counter
+
+
+logger = logging.getLogger(__name__)
+
+upload_bytes = Counter("media_upload_bytes_total", "Bytes received by resumable uploads")
+upload_sessions = Counter("media_upload_sessions_total", "Resumable upload sessions by outcome", ("status",))
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_TAIL_INDEX = struct.Struct(">I")
+
+
+def uploads_dir() -> Path:
+    # Имена с точкой в начале не отдаёт GET /media/{filename}
+    return media_dir() / ".uploads"
+
+
+def session_path(upload_id: str, suffix: str) -> Path:
+    return uploads_dir() / f"{upload_id}.{suffix}"
+
+
+@dataclass
+class UploadState:
+    id: str
+    user_id: int
+    content_type: str
+    length: int
+    chunk_size: int
+    created_at: float
+    updated_at: float
+    offset: int = 0
+    # uploading -> finalizing -> done | failed
+    status: str = "uploading"
+    # Последний чанк дописан — файл данных в формате хранилища (финализацию можно повторить после падения)
+    sealed: bool = False
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+    def save(self) -> None:
+        self.updated_at = time.time()
+        path = session_path(self.id, "json")
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(asdict(self)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, upload_id: str) -> Optional["UploadState"]:
+        try:
+            return cls(**json.loads(session_path(upload_id, "json").read_text()))
+        except FileNotFoundError:
+            return None
+
+
+class SessionLock:
+    """flock на файле сессии: исключает одновременную запись из разных запросов и воркеров."""
+
+    def __init__(self, upload_id: str) -> None:
+        self.upload_id = upload_id
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        path = session_path(self.upload_id, "lock")
+        while True:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            # remove_session удаляет .lock под блокировкой. Открывший файл до удаления захватил бы уже
+            # отвязанный inode, а следующий запрос создал бы новый — и писателей стало бы двое.
+            # Поэтому блокировка действительна, только если путь всё ещё ведёт на захваченный inode
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            locked = os.fstat(fd)
+            if current is not None and (current.st_dev, current.st_ino) == (locked.st_dev, locked.st_ino):
+                self._fd = fd
+                return True
+            os.close(fd)
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class UploadWriter:
+    """Дописывает данные в файл сессии; в памяти не больше одного чанка.
+
+    Смещение восстанавливается по файлам, а не по JSON: после падения посреди записи
+    учитываются только целые зашифрованные чанки и хвост, записанный после них.
+    """
+
+    def __init__(self, state: UploadState, cipher: Optional[MediaCipher]) -> None:
+        self.state = state
+        self._cipher = cipher
+        self._tail_path = session_path(state.id, "tail")
+        self._out = session_path(state.id, "data").open("r+b")
+        self._buffer = bytearray()
+        self._encryptor = None
+        self.chunks = 0
+        if cipher is None:
+            self._out.seek(0, os.SEEK_END)
+            self.offset = self._out.tell()
+            return
+        header = self._out.read(HEADER_SIZE)
+        self.chunks = (self._out.seek(0, os.SEEK_END) - HEADER_SIZE) // (state.chunk_size + TAG_SIZE)
+        self._out.truncate(HEADER_SIZE + self.chunks * (state.chunk_size + TAG_SIZE))
+        self._out.seek(0, os.SEEK_END)
+        self._encryptor = cipher.encryptor(state.chunk_size, header, self.chunks)
+        self._buffer += self._read_tail(self.chunks)
+        self.offset = self.chunks * state.chunk_size + len(self._buffer)
+
+    def _read_tail(self, chunks: int) -> bytes:
+        try:
+            plain = self._cipher.fernet.decrypt(self._tail_path.read_bytes())
+        except (FileNotFoundError, InvalidToken):
+            return b""
+        # Хвост от другого числа чанков остался от прерванной записи — те байты клиент пришлёт заново
+        (index,) = _TAIL_INDEX.unpack_from(plain)
+        return plain[_TAIL_INDEX.size:] if index == chunks else b""
+
+    def write(self, data: bytes) -> None:
+        self.offset += len(data)
+        upload_bytes.inc(len(data))
+        if self._encryptor is None:
+            self._out.write(data)
+            return
+        self._buffer += data
+        # Как в MediaWriter: чанк шифруем, только когда за ним точно есть данные — последний помечается отдельно
+        size = self.state.chunk_size
+        while len(self._buffer) > size:
+            self._out.write(self._encryptor.encrypt_chunk(bytes(self._buffer[:size]), last=False))
+            del self._buffer[:size]
+            self.chunks += 1
+
+    def close(self) -> None:
+        """Сохраняет принятое: данные на диск, затем хвост, затем смещение в JSON."""
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        self._out.close()
+        if self._encryptor is not None:
+            tail = self._cipher.fernet.encrypt(_TAIL_INDEX.pack(self.chunks) + bytes(self._buffer))
+            tmp = self._tail_path.with_suffix(".tail.tmp")
+            tmp.write_bytes(tail)
+            os.replace(tmp, self._tail_path)
+        self.state.offset = self.offset
+        self.state.save()
+
+    def seal(self) -> None:
+        """Дописывает последний чанк: файл данных становится файлом хранилища."""
+        if self._encryptor is not None:
+            self._out.write(self._encryptor.encrypt_chunk(bytes(self._buffer), last=True))
+            self._buffer.clear()
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        self._out.close()
+        self._tail_path.unlink(missing_ok=True)
+        self.state.sealed = True
+        self.state.save()
+
+    def abort(self) -> None:
+        self._out.close()
+
+
+def create_session(user_id: int, length: int, content_type: str, cipher: Optional[MediaCipher]) -> UploadState:
+    settings = get_settings()
+    uploads_dir().mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    state = UploadState(uuid.uuid4().hex, user_id, content_type, length, settings.MEDIA_CHUNK_SIZE, now, now)
+    # JSON — первым: сессию без него сборка мусора считает остатком удалённой
+    state.save()
+    with session_path(state.id, "data").open("wb") as f:
+        if cipher is not None:
+            f.write(cipher.encryptor(state.chunk_size).header)
+    return state
+
+
+def open_writer(state: UploadState, cipher: Optional[MediaCipher]) -> UploadWriter:
+    return UploadWriter(state, cipher)
+
+
+def remove_session(upload_id: str) -> None:
+    # Вызывается под SessionLock. .lock — последним: захватившие его после этого увидят, что файл
+    # отвязан (SessionLock.acquire), а в новом .lock не найдут JSON сессии
+    for suffix in ("data", "tail", "json", "lock"):
+        session_path(upload_id, suffix).unlink(missing_ok=True)
+
+
+def load_owned(upload_id: str, user_id: int) -> UploadState:
+    state = UploadState.load(upload_id) if _ID_RE.match(upload_id) else None
+    if state is None or state.user_id != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return state
+
+
+def state_view(state: UploadState) -> dict:
+    return {
+        "id": state.id,
+        "content_type": state.content_type,
+        "length": state.length,
+        "offset": state.offset,
+        "status": state.status,
+        "result": state.result,
+        "error": state.error,
+    }
+
+
+class UploadManager:
+    """Фоновая работа загрузок: финализация (хэш, дедупликация, превью, запись в media_objects) и сборка мусора."""
+
+    def __init__(self) -> None:
+        self.finalizing: Set[asyncio.Task] = set()
+        self._gc_task: Optional[asyncio.Task] = None
+        self.collected = 0
+
+    async def start(self) -> None:
+        self._gc_task = asyncio.create_task(self._gc_loop())
+
+    async def stop(self) -> None:
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+            try:
+                await self._gc_task
+            except asyncio.CancelledError:
+                pass
+            self._gc_task = None
+        # Начатые финализации доводим до конца: иначе сессия останется "finalizing" до следующей сборки мусора
+        if self.finalizing:
+            await asyncio.gather(*self.finalizing, return_exceptions=True)
+
+    async def lock(self, upload_id: str) -> SessionLock:
+        lock = SessionLock(upload_id)
+        if not await run_io(lock.acquire):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is busy")
+        return lock
+
+    def finalize(self, state: UploadState, lock: SessionLock) -> None:
+        """Запускает финализацию в фоне; блокировка сессии переходит задаче и снимается по её окончании."""
+        task = asyncio.create_task(self._finalize(state, lock))
+        self.finalizing.add(task)
+        task.add_done_callback(self.finalizing.discard)
+
+    async def _finalize(self, state: UploadState, lock: SessionLock) -> None:
+        cipher = get_media_cipher()
+        try:
+            if not state.sealed:
+                writer = await run_io(open_writer, state, cipher)
+                if writer.offset != state.length:
+                    await run_io(writer.abort)
+                    raise ValueError(f"received {writer.offset} of {state.length} bytes")
+                await run_io(writer.seal)
+            async with async_session_factory() as session:
+                media = await store_file(session, session_path(state.id, "data"), state.content_type)
+            state.status, state.result = "done", media_info(media)
+            upload_sessions.labels("done").inc()
+        except Exception as exc:
+            logger.exception("failed to finalize upload %s", state.id)
+            state.status, state.error = "failed", str(exc) or type(exc).__name__
+            upload_sessions.labels("failed").inc()
+        finally:
+            try:
+                await run_io(state.save)
+            finally:
+                await run_io(lock.release)
+
+    async def _gc_loop(self) -> None:
+        while True:
+            await asyncio.sleep(get_settings().MEDIA_UPLOAD_GC_INTERVAL_SECONDS)
+            try:
+                await self.collect()
+            except Exception:
+                logger.exception("upload garbage collection failed")
+
+    async def collect(self) -> int:
+        """Удаляет сессии без активности дольше MEDIA_UPLOAD_SESSION_TTL_SECONDS и перезапускает
+        финализации, прерванные падением воркера. Возвращает число удалённых сессий."""
+        expired_before = time.time() - get_settings().MEDIA_UPLOAD_SESSION_TTL_SECONDS
+        ids = await run_io(_list_sessions)
+        removed = 0
+        for upload_id in ids:
+            lock = SessionLock(upload_id)
+            # Занятые сессии (идёт PUT или финализация) не трогаем
+            if not await run_io(lock.acquire):
+                continue
+            state = await run_io(UploadState.load, upload_id)
+            if state is not None and state.status == "finalizing":
+                # Блокировку держала бы задача финализации — значит, воркер упал посреди неё
+                self.finalize(state, lock)
+                continue
+            try:
+                if state is None or state.updated_at < expired_before:
+                    await run_io(remove_session, upload_id)
+                    if state is not None and state.status == "uploading":
+                        upload_sessions.labels("expired").inc()
+                    removed += 1
+            finally:
+                await run_io(lock.release)
+        self.collected += removed
+        return removed
+
+
+def _list_sessions() -> Set[str]:
+    try:
+        names = os.listdir(uploads_dir())
+    except FileNotFoundError:
+        return set()
+    # .tmp — недописанные JSON/хвосты; сессия без JSON (упали при создании) тоже попадёт сюда и будет удалена
+    return {name.split(".", 1)[0] for name in names if _ID_RE.match(name.split(".", 1)[0])}
+
+
+upload_manager = UploadManager()
@@ -0,0 +1,61 @@
+"""Сравнение двух отчётов benchmarks.run: печатает изменения метрик и завершается с кодом 1 при регрессии.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.15
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Optional
+
+
+def flatten(data, prefix: str = "") -> Dict[str, float]:
+    result = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            result.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[path] = float(value)
+    return result
+
+
+def direction(metric: str) -> Optional[int]:
+    """+1 — чем больше, тем лучше; -1 — чем меньше, тем лучше; None — метрика не оценивается."""
+    name = metric.rsplit(".", 1)[-1]
+    if name.endswith("_per_second") or name == "messages_delivered":
+        return 1
+    if name.endswith("_ms") or name in ("errors", "connect_errors") or ".rss_kb_peak." in metric:
+        return -1
+    return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.15, help="допустимое ухудшение, доля (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = flatten(json.load(f)["results"])
+    with open(args.current) as f:
+        current = flatten(json.load(f)["results"])
+
+    regressions = 0
+    for metric in sorted(baseline.keys() & current.keys()):
+        better = direction(metric)
+        if better is None:
+            continue
+        before, after = baseline[metric], current[metric]
+        change = (after - before) / before if before else 0.0
+        regressed = change * better < -args.threshold
+        regressions += regressed
+        marker = "REGRESSION" if regressed else ""
+        print(f"{metric:70} {before:14.3f} -> {after:14.3f} {change:+8.1%} {marker}")
+
+    print(f"\n{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""Общая обвязка бенчмарков: запуск сервера, подготовка пользователей, статистика и RSS."""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+BENCH_SECRET = "benchmark-secret-key"
+BENCH_PASSWORD = "bench-password"
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)], 3)
+
+
+def latency_summary(samples_ms: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "count": len(samples_ms),
+        "p50_ms": percentile(samples_ms, 0.50),
+        "p95_ms": percentile(samples_ms, 0.95),
+        "p99_ms": percentile(samples_ms, 0.99),
+        "max_ms": round(max(samples_ms), 3) if samples_ms else None,
+    }
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def process_tree(pid: int) -> List[int]:
+    # Сервер с --workers: мастер-процесс и дочерние воркеры
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+class RssSampler:
+    """RSS сервера (сумма по всем его процессам) и клиента бенчмарка за время сценария, включая пик."""
+
+    def __init__(self, server_pid: int, interval: float = 0.2) -> None:
+        self.server_pid = server_pid
+        self.interval = interval
+        self.peak: Dict[str, int] = {}
+        self.per_process_peak: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> Dict[str, int]:
+        processes = {f"server:{pid}": rss_kb(pid) for pid in process_tree(self.server_pid)}
+        processes["client"] = rss_kb(os.getpid())
+        processes = {name: value for name, value in processes.items() if value is not None}
+        for name, value in processes.items():
+            self.per_process_peak[name] = max(self.per_process_peak.get(name, 0), value)
+        current = {
+            "server": sum(value for name, value in processes.items() if name.startswith("server:")),
+            "client": processes.get("client", 0),
+        }
+        for name, value in current.items():
+            self.peak[name] = max(self.peak.get(name, 0), value)
+        return current
+
+    async def _run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> "RssSampler":
+        self.before = self.sample()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.after = self.sample()
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "rss_kb_before": self.before,
+            "rss_kb_after": self.after,
+            "rss_kb_peak": dict(self.peak),
+            "rss_kb_peak_per_process": dict(self.per_process_peak),
+        }
+
+
+class Server:
+    """uvicorn с create_app() во временном каталоге; по умолчанию SQLite вместо Postgres."""
+
+    def __init__(self, port: int = 8765, database_url: str = "", workers: int = 1, env: Optional[Dict[str, str]] = None) -> None:
+        self.port = port
+        self.workers = workers
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.ws_url = f"ws://127.0.0.1:{port}"
+        self._tmp = tempfile.TemporaryDirectory()
+        self.workdir = self._tmp.name
+        self.database_url = database_url or f"sqlite+aiosqlite:///{self.workdir}/bench.db"
+        self.env = dict(os.environ)
+        self.env.update({
+            "DATABASE_URL": self.database_url,
+            "MEDIA_DIR": f"{self.workdir}/uploads",
+            "SECRET_KEY": BENCH_SECRET,
+            "DEBUG": "false",
+            "DB_AUTO_CREATE": "true",
+            "CHAT_BACKPLANE": "redis" if workers > 1 else "local",
+            # Все клиенты бенчмарка идут с одного IP — лимиты частоты исказили бы замеры
+            "RATE_LIMIT_ENABLED": "false",
+        })
+        self.env.update(env or {})
+        self.process: Optional[subprocess.Popen] = None
+        self.ready_seconds: Optional[float] = None
+
+    async def __aenter__(self) -> "Server":
+        # Модули app, импортируемые в процессе бенчмарка (seed_users/token_for), должны видеть ту же БД и ключ
+        os.environ.update({"DATABASE_URL": self.database_url, "SECRET_KEY": BENCH_SECRET})
+        command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(self.port), "--log-level", "warning"]
+        if self.workers > 1:
+            command += ["--workers", str(self.workers)]
+        started = time.perf_counter()
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=self.env)
+        await self.wait_ready()
+        # От запуска процесса до первого успешного ответа
+        self.ready_seconds = time.perf_counter() - started
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._tmp.cleanup()
+
+    async def wait_ready(self, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError("server exited during startup")
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.02)
+        raise RuntimeError("server did not start")
+
+    def client(self, **kwargs) -> httpx.AsyncClient:
+        kwargs.setdefault("timeout", 120)
+        return httpx.AsyncClient(base_url=self.base_url, **kwargs)
+
+    async def seed_users(self, count: int, prefix: str = "bench") -> List[int]:
+        """Создаёт пользователей напрямую в БД (bcrypt считаем один раз), чтобы не мерить регистрацию там, где она не нужна."""
+        from sqlalchemy import insert, select
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from app.auth import get_password_hash
+        from app.models import User
+
+        password_hash = get_password_hash(BENCH_PASSWORD)
+        engine = create_async_engine(self.database_url)
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(insert(User), [
+                    {"email": f"{prefix}{i}@example.com", "password_hash": password_hash, "full_name": f"{prefix} {i}"}
+                    for i in range(count)
+                ])
+                result = await conn.execute(select(User.id).where(User.email.like(f"{prefix}%@example.com")).order_by(User.id))
+                return list(result.scalars())
+        finally:
+            await engine.dispose()
+
+    def token_for(self, user_id: int) -> str:
+        from app.auth import create_access_token
+
+        return create_access_token(subject=user_id)
+
+
+async def register_and_login(client: httpx.AsyncClient, email: str, password: str = BENCH_PASSWORD) -> str:
+    await client.post("/auth/register", json={"email": email, "password": password})
+    r = await client.post("/auth/login", data={"username": email, "password": password})
+    r.raise_for_status()
+    return r.json()["access_token"]
@@ -0,0 +1,98 @@
+"""Задержка WebSocket во время "шторма" логинов: bcrypt в event loop против пула потоков/процессов.
+
+Запускает сервер дважды (uvicorn + SQLite во временном каталоге):
+  inline  — IO_THREADS=0, CPU_THREADS=0: всё блокирующее выполняется прямо в event loop (старое поведение);
+  offload — настройки пулов по умолчанию.
+В каждом режиме один клиент гоняет ping через /chat/ws, пока N клиентов логинятся параллельно,
+и печатает p50/p95/p99 RTT в JSON.
+
+    cd backend && python -m benchmarks.login_storm --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+from .harness import BENCH_PASSWORD, Server, latency_summary, percentile, register_and_login
+
+
+MODES = {
+    "inline": {"IO_THREADS": "0", "CPU_THREADS": "0", "CPU_PROCESSES": "0"},
+    "offload": {},
+}
+
+
+async def ws_probe(ws_url, stop, samples):
+    async with websockets.connect(ws_url) as ws:
+        while not stop.is_set():
+            started = time.perf_counter()
+            await ws.send(json.dumps({"text": "ping"}))
+            await ws.recv()
+            samples.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(0.01)
+
+
+async def login_storm(client, emails, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            r = await client.post("/auth/login", data={"username": emails[i % len(emails)], "password": BENCH_PASSWORD})
+            r.raise_for_status()
+
+    await asyncio.gather(*(one(i) for i in range(total)))
+
+
+async def run_mode(name, env_overrides, args):
+    async with Server(port=args.port, env=env_overrides) as server:
+        async with server.client() as client:
+            token = await register_and_login(client, "probe@example.com")
+            emails = [f"storm{i}@example.com" for i in range(args.users)]
+            for email in emails:
+                await register_and_login(client, email)
+
+            samples = []
+            stop = asyncio.Event()
+            probe = asyncio.create_task(ws_probe(f"{server.ws_url}/chat/ws?token={token}", stop, samples))
+            await asyncio.sleep(0.5)
+            baseline = list(samples)
+            del samples[:]
+
+            started = time.perf_counter()
+            await login_storm(client, emails, args.logins, args.concurrency)
+            storm_seconds = time.perf_counter() - started
+            stop.set()
+            await probe
+
+    summary = latency_summary(samples)
+    return {
+        "mode": name,
+        "logins": args.logins,
+        "storm_seconds": round(storm_seconds, 3),
+        "logins_per_second": round(args.logins / storm_seconds, 1),
+        "ws_idle_p50_ms": percentile(baseline, 0.5),
+        "ws_samples": summary["count"],
+        "ws_p50_ms": summary["p50_ms"],
+        "ws_p95_ms": summary["p95_ms"],
+        "ws_p99_ms": summary["p99_ms"],
+        "ws_max_ms": summary["max_ms"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=sorted(MODES), action="append")
+    args = parser.parse_args()
+
+    results = [await run_mode(name, MODES[name], args) for name in (args.mode or ["inline", "offload"])]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,233 @@
+"""Нагрузочный прогон REST, WebSocket и медиа с машиночитаемым отчётом.
+
+Сценарии:
+  ws     — N клиентов в /chat/ws, каждый шлёт M сообщений случайному собеседнику;
+           задержка доставки считается по метке времени отправителя в тексте сообщения;
+  auth   — всплески регистраций и логинов через /auth;
+  media  — загрузка и скачивание файлов разного размера через /media.
+Для каждого сценария — пропускная способность, p50/p95/p99 и RSS процессов сервера и клиента.
+
+    cd backend && python -m benchmarks.run --output bench.json
+    python -m benchmarks.compare baseline.json bench.json
+
+По умолчанию сервер работает на SQLite во временном каталоге; --database-url указывает на локальный Postgres
+(БД должна быть пустой). --workers > 1 требует Redis (REDIS_URL) для backplane чата.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import websockets
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .harness import BACKEND_DIR, BENCH_PASSWORD, RssSampler, Server, latency_summary
+
+
+async def bench_ws(server: Server, args) -> dict:
+    user_ids = await server.seed_users(args.ws_clients, prefix="ws")
+    tokens = {user_id: server.token_for(user_id) for user_id in user_ids}
+    connect_ms, delivery_ms = [], []
+    # Не подключившиеся клиенты (отказ, таймаут) не шлют и не получают; собеседников выбираем среди подключённых
+    connected, connect_errors = [], []
+    expected = args.ws_clients * args.ws_messages
+    received = 0
+    all_received = asyncio.Event()
+    connect_limit = asyncio.Semaphore(args.ws_connect_concurrency)
+    start_sending = asyncio.Event()
+    if args.ws_proto == "msgpack":
+        encode, decode = msgpack.packb, msgpack.unpackb
+    else:
+        encode, decode = json.dumps, json.loads
+
+    async def client(user_id: int) -> None:
+        nonlocal received
+        async with connect_limit:
+            started = time.perf_counter()
+            try:
+                ws = await asyncio.wait_for(
+                    websockets.connect(f"{server.ws_url}/chat/ws?proto={args.ws_proto}&token={tokens[user_id]}", max_queue=None),
+                    timeout=args.ws_timeout,
+                )
+            except Exception as exc:
+                connect_errors.append(type(exc).__name__)
+                return
+            connect_ms.append((time.perf_counter() - started) * 1000)
+            connected.append(user_id)
+
+        async def reader() -> None:
+            nonlocal received
+            async for raw in ws:
+                message = decode(raw)
+                if message.get("sender_id") == user_id or "text" not in message:
+                    continue
+                delivery_ms.append((time.time() - float(message["text"])) * 1000)
+                received += 1
+                if received >= expected:
+                    all_received.set()
+
+        reader_task = asyncio.create_task(reader())
+        await start_sending.wait()
+        for _ in range(args.ws_messages):
+            peer = random.choice(connected)
+            while peer == user_id and len(connected) > 1:
+                peer = random.choice(connected)
+            await ws.send(encode({"to_user_id": peer, "text": repr(time.time())}))
+            await asyncio.sleep(args.ws_interval)
+        await all_received.wait()
+        reader_task.cancel()
+        await ws.close()
+
+    async with RssSampler(server.process.pid) as rss:
+        tasks = [asyncio.create_task(client(user_id)) for user_id in user_ids]
+        while len(connected) + len(connect_errors) < len(user_ids):
+            await asyncio.sleep(0.05)
+        expected = len(connected) * args.ws_messages
+        if not expected:
+            all_received.set()
+        started = time.perf_counter()
+        start_sending.set()
+        try:
+            await asyncio.wait_for(all_received.wait(), timeout=args.ws_timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        all_received.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        "clients": args.ws_clients,
+        "connect_errors": len(connect_errors),
+        "connect_error_types": sorted(set(connect_errors)),
+        "messages_sent": expected,
+        "messages_delivered": received,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(received / elapsed, 1) if elapsed else None,
+        "connect": latency_summary(connect_ms),
+        "delivery": latency_summary(delivery_ms),
+        **rss.report(),
+    }
+
+
+async def timed_burst(total: int, concurrency: int, request) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    samples, errors = [], 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await request(i)
+            samples.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1),
+        "latency": latency_summary(samples),
+    }
+
+
+async def bench_auth(server: Server, args) -> dict:
+    async with server.client() as http, RssSampler(server.process.pid) as rss:
+        register = await timed_burst(args.auth_requests, args.auth_concurrency, lambda i: http.post(
+            "/auth/register", json={"email": f"auth{i}@example.com", "password": BENCH_PASSWORD},
+        ))
+        login = await timed_burst(args.auth_requests, args.auth_concurrency, lambda i: http.post(
+            "/auth/login", data={"username": f"auth{i}@example.com", "password": BENCH_PASSWORD},
+        ))
+    return {"register": register, "login": login, **rss.report()}
+
+
+async def bench_media(server: Server, args) -> dict:
+    results = {}
+    async with server.client() as http, RssSampler(server.process.pid) as rss:
+        for size in args.media_sizes:
+            payload = os.urandom(size)
+            names = []
+
+            async def upload(i: int):
+                # Каждый файл уникален: одинаковые загрузки сервер дедуплицирует и не шифрует повторно
+                unique = payload[:-8] + i.to_bytes(8, "big")
+                response = await http.post("/media/upload", files={"file": (f"bench{i}.jpg", unique, "image/jpeg")})
+                if response.status_code == 200:
+                    names.append(response.json()["filename"])
+                return response
+
+            uploads = await timed_burst(args.media_files, args.media_concurrency, upload)
+            downloads = await timed_burst(len(names), args.media_concurrency, lambda i: http.get(f"/media/{names[i]}"))
+            for stats in (uploads, downloads):
+                stats["megabytes_per_second"] = round(stats["requests"] * size / stats["seconds"] / 2 ** 20, 2)
+            results[str(size)] = {"upload": uploads, "download": downloads}
+    return {"by_size_bytes": results, **rss.report()}
+
+
+SCENARIOS = {"ws": bench_ws, "auth": bench_auth, "media": bench_media}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return ""
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append", help="по умолчанию — все")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database-url", default="")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--ws-clients", type=int, default=1000)
+    parser.add_argument("--ws-messages", type=int, default=10, help="сообщений на клиента")
+    parser.add_argument("--ws-interval", type=float, default=0.05, help="пауза между сообщениями клиента, с")
+    parser.add_argument("--ws-connect-concurrency", type=int, default=100)
+    parser.add_argument("--ws-timeout", type=float, default=120)
+    parser.add_argument("--ws-proto", choices=["json", "msgpack"], default="json", help="формат кадров WebSocket")
+    parser.add_argument("--auth-requests", type=int, default=200)
+    parser.add_argument("--auth-concurrency", type=int, default=50)
+    parser.add_argument("--media-sizes", type=int, nargs="+", default=[16 * 1024, 256 * 1024, 2 * 2 ** 20, 8 * 2 ** 20])
+    parser.add_argument("--media-files", type=int, default=20, help="файлов каждого размера")
+    parser.add_argument("--media-concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "port")},
+        "results": {},
+    }
+    # Каждый сценарий — на свежем сервере и пустой БД, чтобы они не влияли друг на друга
+    for name in args.scenario or list(SCENARIOS):
+        async with Server(port=args.port, database_url=args.database_url, workers=args.workers) as server:
+            report["results"][name] = await SCENARIOS[name](server, args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
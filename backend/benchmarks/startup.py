@@ -0,0 +1,117 @@
+"""Бюджет старта воркера: время импорта приложения и время до первого ответа.
+
+  import        — python -X importtime -c "import app.main" в отдельном процессе: полное время импорта
+                  и самые тяжёлые модули, которые тянет app.main;
+  first_request — от запуска uvicorn (SQLite во временном каталоге) до первого ответа 200 на GET /.
+
+Печатает JSON. С --max-import-ms / --max-ready-ms завершается с кодом 1, если медиана больше бюджета
+(для CI и проверки перед выкладкой).
+
+    cd backend && python -m benchmarks.startup --runs 5 --max-ready-ms 3000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .harness import BACKEND_DIR, Server
+
+
+def parse_importtime(stderr: str):
+    """Строки "import time: self | cumulative | name" -> [(глубина, модуль, self_us, cumulative_us)]."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        stripped = name.lstrip()
+        # Вложенность -X importtime — по два пробела на уровень
+        depth = (len(name) - len(stripped) - 1) // 2
+        entries.append((depth, stripped, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure_import(database_url: str, top: int):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    # Что app.main импортирует напрямую (каждая запись включает свои вложенные импорты).
+    # -X importtime печатает модуль после всех его импортов, поэтому дети app.main идут прямо перед ним
+    children, app_main = [], None
+    for depth, name, _, cumulative in parse_importtime(result.stderr):
+        if depth == 1:
+            children.append((name, cumulative))
+        elif depth == 0:
+            if name == "app.main":
+                app_main = cumulative
+                break
+            children = []
+    direct = sorted(children, key=lambda child: -child[1])[:top]
+    return {
+        "process_wall_ms": round(wall_ms, 1),
+        "app_main_ms": round(app_main / 1000, 1),
+        "top_imports": [{"module": name, "cumulative_ms": round(cumulative / 1000, 1)} for name, cumulative in direct],
+    }
+
+
+async def measure_ready(port: int, database_url: str) -> float:
+    async with Server(port=port, database_url=database_url) as server:
+        return server.ready_seconds * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="сколько самых тяжёлых импортов показать")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database-url", default="", help="по умолчанию — новая SQLite на каждый запуск")
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-ready-ms", type=float)
+    args = parser.parse_args()
+
+    imports, ready = [], []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = args.database_url or f"sqlite+aiosqlite:///{tmp}/startup.db"
+            imports.append(measure_import(database_url, args.top))
+            ready.append(await measure_ready(args.port, database_url))
+
+    import_ms = [run["app_main_ms"] for run in imports]
+    report = {
+        "runs": args.runs,
+        "import": {
+            "app_main_ms_median": round(statistics.median(import_ms), 1),
+            "app_main_ms_min": min(import_ms),
+            "process_wall_ms_median": round(statistics.median(run["process_wall_ms"] for run in imports), 1),
+            # Последний прогон: после первого импорты берутся из прогретого кэша байткода
+            "top_imports": imports[-1]["top_imports"],
+        },
+        "first_request": {
+            "ready_ms_median": round(statistics.median(ready), 1),
+            "ready_ms_min": round(min(ready), 1),
+            "ready_ms_max": round(max(ready), 1),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+    over_budget = []
+    if args.max_import_ms is not None and report["import"]["app_main_ms_median"] > args.max_import_ms:
+        over_budget.append(f"import {report['import']['app_main_ms_median']} ms > {args.max_import_ms} ms")
+    if args.max_ready_ms is not None and report["first_request"]["ready_ms_median"] > args.max_ready_ms:
+        over_budget.append(f"first request {report['first_request']['ready_ms_median']} ms > {args.max_ready_ms} ms")
+    if over_budget:
+        print("startup budget exceeded: " + "; ".join(over_budget), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+# gunicorn.conf.py
+# Продакшен-запуск нескольких воркеров: gunicorn -c gunicorn.conf.py app.main:app
+# Схему БД перед выкладкой обновляет alembic upgrade head.
+#
+# Несколько воркеров — только с CHAT_BACKPLANE=redis: с локальным backplane сообщения не доходят до сокетов
+# других процессов, номера воркеров для id сообщений не согласованы, а поиск в памяти у каждого свой.
+# Поэтому по умолчанию с local запускается один воркер, а WEB_CONCURRENCY > 1 с ним — ошибка старта.
+#
+# preload_app: приложение импортируется один раз в мастере, воркеры получают его через fork — старт
+# и перезапуск воркера не платят за импорт, а код и данные модулей делятся между процессами (copy-on-write).
+# Это безопасно, потому что при импорте ничего не подключается: соединения с БД и Redis, пулы потоков
+# и фоновые задачи создаются лениво или в startup каждого воркера.
+import multiprocessing
+import os
+
+from uvicorn_worker import UvicornWorker
+
+from app.config import get_settings
+
+
+class Worker(UvicornWorker):
+    # Как в CMD Dockerfile для одиночного uvicorn: permessage-deflate (реализация websockets)
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "ws": "websockets", "ws_per_message_deflate": True}
+
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+_multi_worker = get_settings().CHAT_BACKPLANE == "redis"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() if _multi_worker else 1))
+if workers > 1 and not _multi_worker:
+    raise RuntimeError(f"WEB_CONCURRENCY={workers} requires CHAT_BACKPLANE=redis; the local backplane serves a single process")
+worker_class = Worker
+preload_app = True
+# Воркер, не ответивший мастеру дольше timeout, перезапускается; при остановке даём время
+# дописать очередь сообщений и закрыть сокеты (shutdown в main.py)
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
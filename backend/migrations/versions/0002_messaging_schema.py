@@ -0,0 +1,95 @@
+"""messaging schema: application-generated message ids, direct conversations, inbox, media, search indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:15:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    is_postgres = op.get_context().dialect.name == "postgresql"
+    # Префиксный LIKE по индексу при любой локали (см. models.py)
+    pattern_ops = " text_pattern_ops" if is_postgres else ""
+
+    op.create_index('ix_users_email_lower_prefix', 'users', [sa.text(f'lower(email){pattern_ops}')])
+    op.create_index('ix_users_full_name_lower_prefix', 'users', [sa.text(f'lower(full_name){pattern_ops}')])
+
+    # Старые диалоги остаются без direct_key: личный диалог пары писатель создаст при первом сообщении
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('direct_key', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('conversations_direct_key_key', ['direct_key'])
+
+    # id сообщений теперь выдаёт приложение (ids.py): BIGINT без последовательности.
+    # Snowflake-id больше любого id из SERIAL, старые сообщения остаются на своих местах
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.alter_column(
+            'id', existing_type=sa.Integer(), type_=sa.BigInteger(),
+            existing_nullable=False, autoincrement=False, server_default=None,
+        )
+        batch_op.add_column(sa.Column('image_url', sa.String(length=512), nullable=True))
+        batch_op.drop_index('ix_messages_conversation_id')
+        batch_op.create_index('ix_messages_conversation_created_id', ['conversation_id', 'created_at', 'id'])
+        batch_op.create_index('ix_messages_conversation_id_id', ['conversation_id', 'id'])
+    if is_postgres:
+        op.execute("DROP SEQUENCE IF EXISTS messages_id_seq")
+        # Полнотекстовый поиск; выражение должно совпадать с models.message_search_document
+        op.create_index(
+            'ix_messages_content_search', 'messages', [sa.text("to_tsvector('simple'::regconfig, content)")],
+            postgresql_using='gin',
+        )
+
+    op.create_table(
+        'inbox_states',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('delivered_message_id', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+    op.create_table(
+        'media_objects',
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('content_type', sa.String(length=255), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('variants', sa.String(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('content_hash'),
+    )
+
+
+def downgrade() -> None:
+    is_postgres = op.get_context().dialect.name == "postgresql"
+
+    op.drop_table('media_objects')
+    op.drop_table('inbox_states')
+
+    if is_postgres:
+        op.drop_index('ix_messages_content_search', table_name='messages')
+    # Snowflake-id не помещаются в INTEGER: откат возможен, только пока таких сообщений нет
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_index('ix_messages_conversation_id_id')
+        batch_op.drop_index('ix_messages_conversation_created_id')
+        batch_op.create_index('ix_messages_conversation_id', ['conversation_id'])
+        batch_op.drop_column('image_url')
+        batch_op.alter_column('id', existing_type=sa.BigInteger(), type_=sa.Integer(), existing_nullable=False)
+    if is_postgres:
+        op.execute("CREATE SEQUENCE messages_id_seq OWNED BY messages.id")
+        op.execute("SELECT setval('messages_id_seq', coalesce((SELECT max(id) FROM messages), 0) + 1, false)")
+        op.execute("ALTER TABLE messages ALTER COLUMN id SET DEFAULT nextval('messages_id_seq')")
+
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_constraint('conversations_direct_key_key', type_='unique')
+        batch_op.drop_column('direct_key')
+
+    op.drop_index('ix_users_full_name_lower_prefix', table_name='users')
+    op.drop_index('ix_users_email_lower_prefix', table_name='users')
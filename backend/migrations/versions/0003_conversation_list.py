@@ -0,0 +1,59 @@
+"""conversation list: last message, activity and unread counters
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('last_message_id', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('last_activity_at', sa.DateTime(), nullable=True))
+    with op.batch_alter_table('memberships') as batch_op:
+        batch_op.add_column(sa.Column('last_activity_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('unread_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('last_read_message_id', sa.BigInteger(), nullable=False, server_default='0'))
+
+    # Заполняем по существующей истории. Старые сообщения считаем прочитанными: до этой ревизии
+    # отметок прочтения не было, а счётчик "всё непрочитано" был бы хуже нуля
+    op.execute(
+        "UPDATE conversations SET last_message_id = "
+        "(SELECT max(messages.id) FROM messages WHERE messages.conversation_id = conversations.id)"
+    )
+    op.execute(
+        "UPDATE conversations SET last_activity_at = coalesce("
+        "(SELECT messages.created_at FROM messages WHERE messages.id = conversations.last_message_id), created_at)"
+    )
+    op.execute(
+        "UPDATE memberships SET "
+        "last_activity_at = (SELECT conversations.last_activity_at FROM conversations "
+        "WHERE conversations.id = memberships.conversation_id), "
+        "last_read_message_id = coalesce((SELECT conversations.last_message_id FROM conversations "
+        "WHERE conversations.id = memberships.conversation_id), 0)"
+    )
+
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.alter_column('last_activity_at', existing_type=sa.DateTime(), nullable=False)
+    with op.batch_alter_table('memberships') as batch_op:
+        batch_op.alter_column('last_activity_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index('ix_memberships_user_activity', ['user_id', 'last_activity_at', 'conversation_id'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('memberships') as batch_op:
+        batch_op.drop_index('ix_memberships_user_activity')
+        batch_op.drop_column('last_read_message_id')
+        batch_op.drop_column('unread_count')
+        batch_op.drop_column('last_activity_at')
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_column('last_activity_at')
+        batch_op.drop_column('last_message_id')
@@ -0,0 +1,95 @@
+# Настройки читаются при импорте app.*, поэтому окружение задаём до первого импорта приложения
+import itertools
+import os
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+_tmp = tempfile.mkdtemp(prefix="messenger-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{_tmp}/test.db",
+    "MEDIA_DIR": f"{_tmp}/media",
+    "MEDIA_ENC_KEY": "Vkfi2wn9qhDOvLJMxUQaMGz74OmslEHazOb74DspFwc=",
+    "DB_AUTO_CREATE": "true",
+    "RATE_LIMIT_ENABLED": "false",
+    "DEBUG": "false",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+_emails = itertools.count()
+
+
+@pytest.fixture
+def client():
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def register(client):
+    """Создаёт пользователя и входит: id, token и заголовки для HTTP."""
+
+    def register() -> SimpleNamespace:
+        email = f"user{next(_emails)}@example.com"
+        user_id = client.post("/auth/register", json={"email": email, "password": "pw"}).json()["id"]
+        token = client.post("/auth/login", data={"username": email, "password": "pw"}).json()["access_token"]
+        return SimpleNamespace(id=user_id, token=token, headers={"Authorization": f"Bearer {token}"})
+
+    return register
+
+
+@pytest.fixture
+def direct_chat(client):
+    """Личное сообщение через writer (как из WebSocket); возвращает (id диалога, id сообщения)."""
+    from datetime import datetime
+
+    from sqlalchemy import select
+
+    from app.db import async_session_factory
+    from app.ids import next_message_id
+    from app.message_store import PendingMessage, direct_key, message_writer
+    from app.models import Conversation
+
+    async def send(sender_id: int, recipient_id: int, text: str):
+        message = PendingMessage(
+            id=next_message_id(), sender_id=sender_id, content=text, created_at=datetime.utcnow(), recipient_id=recipient_id,
+        )
+        await message_writer.submit(message)
+        await message_writer.flush()
+        async with async_session_factory() as session:
+            conversation_id = (await session.execute(
+                select(Conversation.id).where(Conversation.direct_key == direct_key(sender_id, recipient_id))
+            )).scalar_one()
+        return conversation_id, message.id
+
+    def direct_chat(sender, recipient, text: str = "hi"):
+        return client.portal.call(send, sender.id, recipient.id, text)
+
+    return direct_chat
+
+
+@pytest.fixture
+def group_chat(client):
+    """Групповой диалог из участников (API создания групп нет — пишем в БД); возвращает id диалога."""
+    from app.db import async_session_factory
+    from app.models import Conversation, Membership
+
+    async def create(user_ids):
+        async with async_session_factory() as session:
+            conversation = Conversation(title="group", is_group=True)
+            session.add(conversation)
+            await session.flush()
+            session.add_all([Membership(user_id=user_id, conversation_id=conversation.id) for user_id in user_ids])
+            await session.commit()
+            return conversation.id
+
+    def group_chat(*members) -> int:
+        return client.portal.call(create, [member.id for member in members])
+
+    return group_chat
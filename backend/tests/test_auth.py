@@ -0,0 +1,23 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from app import executors
+from app.metrics import password_hash_duration
+
+
+def observed(op: str) -> int:
+    return sum(password_hash_duration.labels(op).counts)
+
+
+def test_password_hashing_in_worker_processes_is_measured(client, monkeypatch):
+    # Как при CPU_PROCESSES > 0: bcrypt считается в дочернем процессе
+    monkeypatch.setitem(executors._executors, "cpu", executors.BoundedExecutor("cpu", ProcessPoolExecutor(1), 1, 8))
+    hashes, verifies = observed("hash"), observed("verify")
+    try:
+        client.post("/auth/register", json={"email": "metrics@example.com", "password": "pw"})
+        assert client.post("/auth/login", data={"username": "metrics@example.com", "password": "pw"}).status_code == 200
+        assert client.post("/auth/login", data={"username": "metrics@example.com", "password": "no"}).status_code == 400
+    finally:
+        executors._executors["cpu"].shutdown()
+
+    assert observed("hash") == hashes + 1
+    assert observed("verify") == verifies + 2
@@ -0,0 +1,161 @@
+import asyncio
+
+from app.backplane import LocalBackplane, LocalBus
+
+
+def test_items_carry_kind_and_accept_legacy_pairs():
+    async def scenario():
+        bus = LocalBus()
+        sender, receiver = LocalBackplane(bus, flush_interval=0.001), LocalBackplane(bus, flush_interval=0.001)
+        received = []
+
+        async def deliver(user_id, message, kind):
+            received.append((user_id, message, kind))
+
+        await sender.start(deliver)
+        await receiver.start(deliver)
+        try:
+            await receiver.register(7)
+            await sender.publish(7, '{"a":1}', kind="typing")
+            await sender.publish(7, '{"b":2}')
+            await sender.flush()
+            # Пара без kind — пачка от воркера предыдущей версии
+            await receiver._receive([[7, '{"c":3}']])
+        finally:
+            await sender.stop()
+            await receiver.stop()
+        return received
+
+    assert asyncio.run(scenario()) == [(7, '{"a":1}', "typing"), (7, '{"b":2}', ""), (7, '{"c":3}', "")]
+
+
+def test_redis_dead_worker_cleanup_handles_kinds():
+    from app.backplane import RedisBackplane
+
+    class Pipeline:
+        def __init__(self, calls):
+            self.calls = calls
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def zrem(self, key, member):
+            self.calls.append((key, member))
+
+        async def execute(self):
+            return []
+
+    class DeadWorkerRedis:
+        def __init__(self):
+            self.calls = []
+
+        async def publish(self, channel, data):
+            return 0
+
+        def pipeline(self, transaction=True):
+            return Pipeline(self.calls)
+
+    async def scenario():
+        redis = DeadWorkerRedis()
+        backplane = RedisBackplane(redis)
+        await backplane._send_batch("dead", [(7, "{}", ""), (7, "{}", "typing"), (8, "{}", "")])
+        return redis.calls
+
+    assert sorted(asyncio.run(scenario())) == [("chat:presence:7", "dead"), ("chat:presence:8", "dead")]
+
+
+def test_publish_routes_to_every_worker_of_the_user_once():
+    async def scenario():
+        bus = LocalBus()
+        workers = [LocalBackplane(bus, flush_interval=0.001) for _ in range(3)]
+        received = {backplane.worker_id: [] for backplane in workers}
+
+        for backplane in workers:
+            async def deliver(user_id, message, kind, worker_id=backplane.worker_id):
+                received[worker_id].append((user_id, message))
+
+            await backplane.start(deliver)
+        sender, phone, laptop = workers
+        try:
+            # Два устройства на разных воркерах и одно на воркере отправителя
+            await phone.register(1)
+            await laptop.register(1)
+            await sender.register(1)
+            found = await sender.publish_many([1, 2], "m", delivered_locally={1})
+            await sender.flush()
+        finally:
+            for backplane in workers:
+                await backplane.stop()
+        return found, [received[backplane.worker_id] for backplane in workers]
+
+    found, (on_sender, on_phone, on_laptop) = asyncio.run(scenario())
+    assert found == 1  # пользователь 2 нигде не подключён
+    # Локально уже доставлено вызывающим — повторно не отдаём
+    assert on_sender == []
+    assert on_phone == on_laptop == [(1, "m")]
+
+
+def test_publish_delivers_directly_when_the_socket_is_local():
+    async def scenario():
+        backplane = LocalBackplane(LocalBus(), flush_interval=0.001)
+        received = []
+
+        async def deliver(user_id, message, kind):
+            received.append((user_id, message))
+
+        await backplane.start(deliver)
+        try:
+            await backplane.register(5)
+            assert await backplane.publish(5, "m")
+            assert not await backplane.publish(6, "lost")
+            pending = dict(backplane._pending)
+        finally:
+            await backplane.stop()
+        return received, pending
+
+    received, pending = asyncio.run(scenario())
+    assert received == [(5, "m")]
+    assert pending == {}
+
+
+def test_flush_loop_batches_until_size_or_interval():
+    async def scenario():
+        bus = LocalBus()
+        sender = LocalBackplane(bus, batch_size=3, flush_interval=60)
+        receiver = LocalBackplane(bus)
+        batches = []
+        original = receiver._receive
+
+        async def receive(items):
+            batches.append(len(items))
+            await original(items)
+
+        async def deliver(user_id, message, kind):
+            pass
+
+        receiver._receive = receive
+        await sender.start(deliver)
+        await receiver.start(deliver)
+        try:
+            await receiver.register(1)
+            await sender.publish(1, "a")
+            await sender.publish(1, "b")
+            await asyncio.sleep(0.01)
+            # Пачка не полная, а интервал не истёк — ничего не отправлено
+            before = list(batches)
+            await sender.publish(1, "c")
+            for _ in range(100):
+                if batches:
+                    break
+                await asyncio.sleep(0.001)
+        finally:
+            await sender.stop()
+            await receiver.stop()
+        return before, batches
+
+    before, batches = asyncio.run(scenario())
+    assert before == []
+    assert batches == [3]
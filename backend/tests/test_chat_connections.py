@@ -0,0 +1,73 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.routers.chat import manager
+
+
+def receive_until(ws, predicate, limit=20):
+    # Пропускаем служебные кадры (backlog, ping) до нужного события
+    for _ in range(limit):
+        event = ws.receive_json()
+        if predicate(event):
+            return event
+    raise AssertionError("event not received")
+
+
+def test_device_over_the_limit_evicts_the_oldest_and_stays_registered(client, register, monkeypatch):
+    monkeypatch.setattr(manager, "max_per_user", 1)
+    alice, bob = register(), register()
+
+    with client.websocket_connect(f"/chat/ws?token={alice.token}") as old:
+        old.receive_json()
+        with client.websocket_connect(f"/chat/ws?token={alice.token}") as new:
+            new.receive_json()
+            with pytest.raises(WebSocketDisconnect) as closed:
+                old.receive_json()
+            assert closed.value.code == 1008
+
+            assert len(manager.active_connections[alice.id]) == 1
+            assert client.portal.call(manager.backplane.locate, alice.id)
+
+            with client.websocket_connect(f"/chat/ws?token={bob.token}") as sender:
+                sender.receive_json()
+                sender.send_json({"to_user_id": alice.id, "text": "hi"})
+                event = receive_until(new, lambda e: e.get("text") == "hi")
+                assert event["sender_id"] == bob.id
+
+    assert alice.id not in manager.active_connections
+    assert not client.portal.call(manager.backplane.locate, alice.id)
+
+
+def test_worker_at_capacity_rejects_new_sockets(client, register, monkeypatch):
+    monkeypatch.setattr(manager, "max_connections", 0)
+    alice = register()
+    rejected = manager.rejected_over_capacity
+
+    with client.websocket_connect(f"/chat/ws?token={alice.token}") as ws:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 1013
+    assert manager.rejected_over_capacity == rejected + 1
+    assert alice.id not in manager.active_connections
+
+
+@pytest.fixture
+def fast_heartbeat(monkeypatch):
+    # До фикстуры client: цикл heartbeat запускается в lifespan с текущим интервалом
+    monkeypatch.setattr(manager, "heartbeat_interval", 0.05)
+    monkeypatch.setattr(manager, "heartbeat_timeout", 0.3)
+
+
+def test_heartbeat_pings_and_closes_silent_sockets(fast_heartbeat, client, register):
+    user = register()
+    evicted = manager.evicted_idle
+
+    with client.websocket_connect(f"/chat/ws?token={user.token}") as ws:
+        receive_until(ws, lambda e: e.get("type") == "ping")
+        ws.send_json({"type": "pong"})
+        receive_until(ws, lambda e: e.get("type") == "ping")
+        # Дальше молчим: соединение закрывается по таймауту
+        with pytest.raises(WebSocketDisconnect) as closed:
+            receive_until(ws, lambda e: False, limit=100)
+        assert closed.value.code == 1001
+    assert manager.evicted_idle == evicted + 1
@@ -0,0 +1,82 @@
+import asyncio
+
+from app.backplane import LocalBackplane, LocalBus
+from app.protocol import Frame
+from app.routers.chat import Connection, ConnectionManager
+
+
+def receive_until(ws, predicate, limit=20):
+    for _ in range(limit):
+        event = ws.receive_json()
+        if predicate(event):
+            return event
+    raise AssertionError("event not received")
+
+
+def test_group_message_reaches_every_member_once(client, register, group_chat):
+    alice, bob, carol, mallory = register(), register(), register(), register()
+    conversation_id = group_chat(alice, bob, carol)
+
+    with client.websocket_connect(f"/chat/ws?token={alice.token}") as a, \
+            client.websocket_connect(f"/chat/ws?token={bob.token}") as b, \
+            client.websocket_connect(f"/chat/ws?token={carol.token}") as c, \
+            client.websocket_connect(f"/chat/ws?token={mallory.token}") as m:
+        for ws in (a, b, c, m):
+            ws.receive_json()
+        a.send_json({"conversation_id": conversation_id, "text": "hello"})
+        # Отправитель получает эхо, как и остальные участники
+        events = [receive_until(ws, lambda e: "text" in e) for ws in (a, b, c)]
+        assert {event["id"] for event in events} == {events[0]["id"]}
+        assert all(event["conversation_id"] == conversation_id and event["sender_id"] == alice.id for event in events)
+
+        m.send_json({"conversation_id": conversation_id, "text": "intrusion"})
+        assert receive_until(m, lambda e: "error" in e)["conversation_id"] == conversation_id
+        b.send_json({"conversation_id": conversation_id, "text": "next"})
+        # До bob и carol дошло следующее сообщение группы, а не сообщение постороннего
+        assert receive_until(c, lambda e: "text" in e)["text"] == "next"
+
+
+class StuckWebSocket:
+    """Клиент, который перестал читать: отправка не завершается."""
+
+    def __init__(self):
+        self.closed = None
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(data)
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+
+
+class ReadingWebSocket(StuckWebSocket):
+    async def send_text(self, data):
+        self.sent.append(data)
+
+
+def test_slow_consumer_is_dropped_without_holding_up_others():
+    async def scenario():
+        manager = ConnectionManager(backplane=LocalBackplane(LocalBus()), send_queue_max=2, heartbeat_interval=0)
+        await manager.start()
+        stuck, reading = StuckWebSocket(), ReadingWebSocket()
+        slow, fast = Connection(1, stuck, max_queue=2), Connection(2, reading, max_queue=2)
+        for connection in (slow, fast):
+            manager.active_connections[connection.user_id] = [connection]
+            manager.connection_count += 1
+            connection.start()
+        try:
+            for i in range(5):
+                await manager.send_to_users([1, 2], Frame({"n": i}))
+                await asyncio.sleep(0.01)
+        finally:
+            await manager.stop()
+            fast.stop()
+        return manager, stuck, reading
+
+    manager, stuck, reading = asyncio.run(scenario())
+    assert stuck.closed == 1013
+    assert manager.dropped_slow_consumers == 1
+    assert 1 not in manager.active_connections
+    assert len(reading.sent) == 5
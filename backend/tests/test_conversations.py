@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from app.ids import next_message_id
+from app.message_store import PendingMessage, message_writer
+
+
+def submit_all(client, messages):
+    async def write():
+        for message in messages:
+            await message_writer.submit(message)
+        await message_writer.flush()
+
+    client.portal.call(write)
+
+
+def read_pages(client, user, path, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"before": cursor} if cursor else {})}
+        response = client.get(path, params=params, headers=user.headers)
+        assert response.status_code == 200
+        body = response.json()
+        pages.append(body["items"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_history_pages_are_newest_first_without_gaps_on_equal_timestamps(client, register, direct_chat):
+    alice, bob = register(), register()
+    conversation_id, first_id = direct_chat(alice, bob, "m0")
+    # Несколько сообщений с одинаковым created_at: порядок и курсор держатся на id
+    created_at = datetime.utcnow()
+    later = [
+        PendingMessage(id=next_message_id(), sender_id=bob.id, content=f"m{i}", created_at=created_at, conversation_id=conversation_id)
+        for i in range(1, 6)
+    ]
+    submit_all(client, later)
+
+    pages = read_pages(client, alice, f"/conversations/{conversation_id}/messages", limit=2)
+    assert [len(page) for page in pages] == [2, 2, 2]
+    ids = [message["id"] for page in pages for message in page]
+    assert ids == [m.id for m in reversed(later)] + [first_id]
+
+
+def test_history_is_hidden_from_non_members_and_rejects_bad_cursors(client, register, direct_chat):
+    alice, bob, mallory = register(), register(), register()
+    conversation_id, _ = direct_chat(alice, bob)
+
+    assert client.get(f"/conversations/{conversation_id}/messages", headers=mallory.headers).status_code == 404
+    response = client.get(f"/conversations/{conversation_id}/messages", params={"before": "garbage"}, headers=alice.headers)
+    assert response.status_code == 400
+
+
+def test_conversation_list_orders_by_activity_with_unread_counts(client, register, direct_chat, group_chat):
+    alice, bob, carol = register(), register(), register()
+    with_bob, _ = direct_chat(bob, alice, "one")
+    direct_chat(bob, alice, "two")
+    group_id = group_chat(alice, bob, carol)
+    submit_all(client, [PendingMessage(
+        id=next_message_id(), sender_id=carol.id, content="group", created_at=datetime.utcnow(), conversation_id=group_id,
+    )])
+    with_carol, _ = direct_chat(alice, carol, "mine")
+
+    pages = read_pages(client, alice, "/conversations", limit=2)
+    items = [item for page in pages for item in page]
+    assert [len(page) for page in pages] == [2, 1]
+    assert [item["id"] for item in items] == [with_carol, group_id, with_bob]
+    # Свои сообщения непрочитанными не считаются
+    assert [item["unread_count"] for item in items] == [0, 1, 2]
+    assert [item["last_message"]["content"] for item in items] == ["mine", "group", "two"]
+    assert [item["peer_id"] for item in items] == [carol.id, None, bob.id]
+
+
+def test_read_marker_moves_forward_only(client, register, direct_chat):
+    alice, bob = register(), register()
+    conversation_id, first = direct_chat(bob, alice, "one")
+    _, second = direct_chat(bob, alice, "two")
+    path = f"/conversations/{conversation_id}/read"
+
+    assert client.post(path, json={"up_to": first}, headers=alice.headers).json()["unread_count"] == 1
+    state = client.post(path, headers=alice.headers).json()
+    assert state == {"conversation_id": conversation_id, "unread_count": 0, "last_read_message_id": second}
+    # Запоздавшая отметка с другого устройства не возвращает непрочитанное
+    assert client.post(path, json={"up_to": first}, headers=alice.headers).json()["unread_count"] == 0
+    direct_chat(bob, alice, "three")
+    assert client.get("/conversations", headers=alice.headers).json()["items"][0]["unread_count"] == 1
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+
+from app import ids
+from app.ids import (
+    MAX_WORKER_ID, SEQUENCE_BITS, IdGenerator, WorkerIdLease, id_timestamp_ms, min_id_at,
+)
+
+
+def test_ids_are_increasing_js_safe_and_carry_the_worker():
+    generator = IdGenerator(worker_id=37)
+    before = int(time.time() * 1000)
+    # Больше 64 id — с переходом счётчика на следующую миллисекунду
+    issued = [generator.next_id() for _ in range(1000)]
+    after = int(time.time() * 1000)
+
+    assert issued == sorted(set(issued))
+    assert all(message_id < 2 ** 53 for message_id in issued)
+    assert {(message_id >> SEQUENCE_BITS) & MAX_WORKER_ID for message_id in issued} == {37}
+    assert before <= id_timestamp_ms(issued[0]) <= id_timestamp_ms(issued[-1]) <= after
+    assert min_id_at(id_timestamp_ms(issued[0])) <= issued[0]
+
+
+def test_clock_going_back_does_not_repeat_ids(monkeypatch):
+    generator = IdGenerator(worker_id=1)
+    now = [2_000_000_000_000.0]
+    monkeypatch.setattr(ids.time, "time", lambda: now[0] / 1000)
+    first = generator.next_id()
+    now[0] -= 5000
+    assert generator.next_id() > first
+
+
+class FakeRedis:
+    """SET NX EX и два скрипта аренды из ids.py."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token, *args):
+        if self.data.get(key) != token:
+            return 0
+        if script == WorkerIdLease._RELEASE:
+            del self.data[key]
+        return 1
+
+
+def test_worker_id_lease_hands_out_distinct_numbers_and_releases(monkeypatch):
+    monkeypatch.setattr(ids, "_generator", IdGenerator(0))
+
+    async def scenario():
+        redis = FakeRedis()
+        leases = [WorkerIdLease(redis, ttl=60) for _ in range(MAX_WORKER_ID + 1)]
+        taken = [await lease.acquire() for lease in leases]
+        with pytest.raises(RuntimeError):
+            await WorkerIdLease(redis, ttl=60).acquire()
+
+        # Освободившийся номер достаётся следующему, а чужую аренду stop не трогает
+        await leases[0].stop()
+        late = WorkerIdLease(redis, ttl=60)
+        reused = await late.acquire()
+        stale = WorkerIdLease(redis, ttl=60)
+        stale.worker_id = reused
+        await stale.stop()
+        return taken, reused, redis.data.get(WorkerIdLease.KEY.format(reused)) == late._token
+
+    taken, reused, still_leased = asyncio.run(scenario())
+    assert sorted(taken) == list(range(MAX_WORKER_ID + 1))
+    assert reused == taken[0]
+    assert still_leased
+    assert ids._generator.worker_id == reused
@@ -0,0 +1,75 @@
+import time
+from datetime import datetime
+
+from app.db import async_session_factory
+from app.ids import id_timestamp_ms, min_id_at, next_message_id
+from app.inbox import DeliveryTracker
+from app.message_store import PendingMessage, message_writer
+
+
+def direct(message_id: int, sender: int, recipient: int) -> PendingMessage:
+    return PendingMessage(
+        id=message_id, sender_id=sender, content=f"m{message_id}", created_at=datetime.utcnow(), recipient_id=recipient,
+    )
+
+
+async def collect(tracker: DeliveryTracker, user_id: int) -> list:
+    return [message["id"] async for event in tracker.backlog(user_id) for message in event["messages"]]
+
+
+def test_ack_holds_the_watermark_back_and_ignores_future_ids():
+    tracker = DeliveryTracker(async_session_factory, ack_holdback_ms=10000)
+    message_id = next_message_id()
+    tracker.ack(1, message_id)
+    assert tracker._pending[1] == min_id_at(id_timestamp_ms(message_id) - 10000)
+
+    # id "из будущего" не сдвигает отметку дальше текущего момента
+    tracker.ack(2, min_id_at(int(time.time() * 1000) + 3600_000))
+    assert tracker._pending[2] <= min_id_at(int(time.time() * 1000) - 10000)
+
+    # Отметка не уменьшается
+    tracker.ack(1, message_id - 1000)
+    assert tracker._pending[1] == min_id_at(id_timestamp_ms(message_id) - 10000)
+
+
+def test_backlog_includes_a_lower_id_written_after_the_ack(client, register):
+    alice, bob = register(), register()
+    tracker = DeliveryTracker(async_session_factory, batch_size=2, ack_holdback_ms=10000)
+
+    async def scenario():
+        old = direct(min_id_at(int(time.time() * 1000) - 60000), bob.id, alice.id)
+        late = direct(next_message_id(), bob.id, alice.id)  # ещё в очереди writer'а другого воркера
+        acked = [direct(next_message_id(), bob.id, alice.id) for _ in range(3)]
+        for message in [old, *acked]:
+            await message_writer.submit(message)
+        await message_writer.flush()
+
+        # Клиент получил живьём и подтвердил самое новое; отметка записана в БД
+        tracker.ack(alice.id, acked[-1].id)
+        await tracker.flush()
+        await message_writer.submit(late)
+        await message_writer.flush()
+        return old, late, acked, await collect(tracker, alice.id)
+
+    old, late, acked, backlog = client.portal.call(scenario)
+    assert late.id in backlog
+    assert backlog == sorted(backlog)
+    # Подтверждённое приходит повторно (клиент уберёт дубли), а давнее — нет
+    assert all(message.id in backlog for message in acked)
+    assert old.id not in backlog
+
+
+def test_backlog_skips_own_messages_and_other_conversations(client, register):
+    alice, bob, carol = register(), register(), register()
+    tracker = DeliveryTracker(async_session_factory)
+
+    async def scenario():
+        to_alice = direct(next_message_id(), bob.id, alice.id)
+        from_alice = direct(next_message_id(), alice.id, bob.id)
+        elsewhere = direct(next_message_id(), bob.id, carol.id)
+        for message in (to_alice, from_alice, elsewhere):
+            await message_writer.submit(message)
+        return to_alice, await collect(tracker, alice.id)
+
+    to_alice, backlog = client.portal.call(scenario)
+    assert backlog == [to_alice.id]
@@ -0,0 +1,73 @@
+import io
+import itertools
+
+import pytest
+from PIL import Image
+
+from app.cache import ByteLRU
+from app.routers import media as media_router
+
+_colors = itertools.count()
+
+
+def upload(client, content_type="image/png") -> tuple:
+    # Своё содержимое на каждый вызов: одинаковые файлы хранятся (и кэшируются) под одним именем
+    out = io.BytesIO()
+    Image.new("RGB", (32, 32), (next(_colors) % 256, 20, 30)).save(out, "PNG")
+    data = out.getvalue()
+    filename = client.post("/media/upload", files={"file": ("a.png", data, content_type)}).json()["filename"]
+    return filename, data
+
+
+def test_strong_etag_and_conditional_requests(client):
+    filename, data = upload(client)
+
+    response = client.get(f"/media/{filename}")
+    assert response.status_code == 200 and response.content == data
+    assert response.headers["etag"] == f'"{filename}"'
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["x-content-type-options"] == "nosniff"
+
+    for header in (f'"{filename}"', f'W/"{filename}"', f'"other", "{filename}"', "*"):
+        cached = client.get(f"/media/{filename}", headers={"If-None-Match": header})
+        assert cached.status_code == 304 and cached.content == b""
+        assert cached.headers["etag"] == f'"{filename}"'
+    assert client.get(f"/media/{filename}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_ranges_from_the_blob_cache_and_from_the_stream(client, monkeypatch, cached):
+    if not cached:
+        monkeypatch.setattr(media_router._blobs, "max_item_bytes", 0)
+    filename, data = upload(client)
+    client.get(f"/media/{filename}")
+    assert (media_router._blobs.get(filename) is not None) == cached
+
+    for header, expected in (("bytes=0-9", data[:10]), ("bytes=10-", data[10:]), ("bytes=-5", data[-5:])):
+        response = client.get(f"/media/{filename}", headers={"Range": header})
+        assert response.status_code == 206 and response.content == expected
+    beyond = client.get(f"/media/{filename}", headers={"Range": f"bytes={len(data)}-"})
+    assert beyond.status_code == 416
+    assert beyond.headers["content-range"] == f"bytes */{len(data)}"
+
+
+def test_repeated_reads_are_served_from_the_decrypted_cache(client):
+    filename, data = upload(client)
+    client.get(f"/media/{filename}")
+    hits = media_router._blobs.hits
+    assert client.get(f"/media/{filename}").content == data
+    assert media_router._blobs.hits == hits + 1
+
+
+def test_byte_lru_is_bounded_by_total_size():
+    cache = ByteLRU(max_bytes=10, max_item_bytes=6)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    cache.get("a")
+    cache.set("c", b"cccc")
+    # Вытеснен давно не читанный b
+    assert cache.get("b") is None and cache.get("a") == b"aaaa"
+    assert cache.size == 8
+    cache.set("big", b"x" * 7)
+    assert cache.get("big") is None and cache.size == 8
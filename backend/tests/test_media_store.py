@@ -0,0 +1,143 @@
+import asyncio
+import io
+import os
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.db import Base, async_session_factory, engine
+from app.media_store import get_media_object, media_dir, release_media, store_upload, variant_filename, variant_names
+
+
+def make_png(seed: int, size=(640, 480)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, (seed % 256, 80, 160)).save(out, "PNG")
+    return out.getvalue()
+
+
+async def _create_schema() -> None:
+    media_dir().mkdir(parents=True, exist_ok=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+def test_same_content_is_stored_once_and_released_by_ref_count():
+    async def scenario():
+        await _create_schema()
+        data = make_png(1)
+        try:
+            async with async_session_factory() as session:
+                first = await store_upload(session, io.BytesIO(data), "image/png")
+                second = await store_upload(session, io.BytesIO(data), "image/png")
+                other = await store_upload(session, io.BytesIO(make_png(2)), "image/png")
+                content_hash, other_hash = first.content_hash, other.content_hash
+
+                assert second.content_hash == content_hash
+                assert other_hash != content_hash
+                assert (await get_media_object(session, content_hash)).ref_count == 2
+                files = [media_dir() / content_hash]
+                files += [media_dir() / variant_filename(content_hash, name) for name in variant_names(first)]
+                assert len(files) > 1 and all(path.is_file() for path in files)
+
+                # Первая ссылка снимается, файл остаётся
+                assert not await release_media(session, content_hash)
+                session.expire_all()
+                assert (await get_media_object(session, content_hash)).ref_count == 1
+                assert all(path.is_file() for path in files)
+
+                # Последняя — удаляются запись, оригинал и копии; чужой файл не затронут
+                assert await release_media(session, content_hash)
+                assert await get_media_object(session, content_hash) is None
+                assert not any(path.exists() for path in files)
+                assert (media_dir() / other_hash).is_file()
+                assert not await release_media(session, content_hash)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_a_finished_upload_releases_its_reference():
+    from app.main import app
+
+    data = make_png(3)
+    with TestClient(app) as client:
+        client.post("/auth/register", json={"email": "media@example.com", "password": "pw"})
+        token = client.post("/auth/login", data={"username": "media@example.com", "password": "pw"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # Тот же файл обычной загрузкой и возобновляемой: одна запись с двумя ссылками
+        filename = client.post("/media/upload", files={"file": ("a.png", data, "image/png")}).json()["filename"]
+        upload_id = client.post("/media/uploads", json={"length": len(data), "content_type": "image/png"}, headers=headers).json()["id"]
+        assert client.put(f"/media/uploads/{upload_id}", content=data, headers={**headers, "Upload-Offset": "0"}).status_code == 204
+        assert client.post(f"/media/uploads/{upload_id}/finalize", headers=headers).status_code == 202
+        for _ in range(100):
+            state = client.get(f"/media/uploads/{upload_id}", headers=headers).json()
+            if state["status"] != "finalizing":
+                break
+            client.portal.call(asyncio.sleep, 0.02)
+        assert state["status"] == "done" and state["result"]["filename"] == filename
+
+        async def ref_count():
+            async with async_session_factory() as session:
+                media = await get_media_object(session, filename)
+                return media.ref_count if media is not None else 0
+
+        assert client.portal.call(ref_count) == 2
+        assert client.delete(f"/media/uploads/{upload_id}", headers=headers).status_code == 204
+        assert client.portal.call(ref_count) == 1
+        assert client.get(f"/media/{filename}").status_code == 200
+        assert client.delete(f"/media/uploads/{upload_id}", headers=headers).status_code == 404
+
+
+def open_descriptors(path) -> int:
+    count = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            count += os.readlink(f"/proc/self/fd/{fd}") == str(path)
+        except OSError:
+            pass
+    return count
+
+
+def test_client_disconnect_mid_stream_closes_the_media_file(client, monkeypatch):
+    from starlette.requests import ClientDisconnect
+
+    from app.routers import media as media_router
+
+    # Поток шума почти не сжимается: файл больше одного чанка чтения
+    data = Image.frombytes("RGB", (400, 400), os.urandom(400 * 400 * 3))
+    out = io.BytesIO()
+    data.save(out, "PNG")
+    filename = client.post("/media/upload", files={"file": ("n.png", out.getvalue(), "image/png")}).json()["filename"]
+    path = (media_dir() / filename).resolve()
+    # Мимо кэша расшифрованных файлов — отдача потоком
+    monkeypatch.setattr(media_router._blobs, "max_item_bytes", 0)
+
+    async def disconnect_after_first_chunk():
+        response = await media_router.get_media(filename, variant=None, range_header=None, if_none_match=None)
+        sent = []
+
+        async def send(message):
+            if message["type"] == "http.response.body" and len(sent) > 1:
+                raise OSError("connection reset")
+            sent.append(message)
+
+        async def receive():
+            await asyncio.sleep(3600)
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        try:
+            await response(scope, receive, send)
+        except ClientDisconnect:
+            pass
+        # Закрытие после шага, ещё выполнявшегося в пуле, — его колбэком
+        for _ in range(50):
+            if not open_descriptors(path):
+                break
+            await asyncio.sleep(0.01)
+        return len(sent)
+
+    # Заголовки и первый чанк ушли, второй — уже нет
+    assert client.portal.call(disconnect_after_first_chunk) == 2
+    assert open_descriptors(path) == 0
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.db import async_session_factory
+from app.ids import next_message_id
+from app.message_store import MessageWriter, PendingMessage
+from app.models import Message
+
+
+def direct(sender: int, recipient: int, content: str = "hi", message_id: int = None) -> PendingMessage:
+    return PendingMessage(
+        id=message_id or next_message_id(), sender_id=sender, content=content,
+        created_at=datetime.utcnow(), recipient_id=recipient,
+    )
+
+
+async def stored(ids) -> dict:
+    async with async_session_factory() as session:
+        rows = await session.execute(select(Message.id, Message.content).where(Message.id.in_(list(ids))))
+        return dict(rows.all())
+
+
+def test_writer_groups_messages_into_batches(client, register):
+    alice, bob = register(), register()
+
+    async def scenario():
+        writer = MessageWriter(async_session_factory, batch_size=3, flush_interval=0.05)
+        sizes = []
+        write = writer._write
+
+        async def record(batch):
+            sizes.append(len(batch))
+            await write(batch)
+
+        writer._write = record
+        await writer.start()
+        messages = [direct(alice.id, bob.id, f"m{i}") for i in range(7)]
+        try:
+            for message in messages:
+                await writer.submit(message)
+            await writer.flush()
+        finally:
+            await writer.stop()
+        return sizes, await stored(m.id for m in messages)
+
+    sizes, rows = client.portal.call(scenario)
+    assert sizes == [3, 3, 1]
+    assert sorted(rows.values()) == [f"m{i}" for i in range(7)]
+
+
+def test_submit_waits_while_the_queue_is_full(client, register):
+    alice, bob = register(), register()
+
+    async def scenario():
+        writer = MessageWriter(async_session_factory, batch_size=1, flush_interval=0, max_queue=2)
+        released = asyncio.Event()
+        write = writer._write
+
+        async def slow(batch):
+            await released.wait()
+            await write(batch)
+
+        writer._write = slow
+        await writer.start()
+        try:
+            # Первое забирает writer (и ждёт БД), ещё два заполняют очередь
+            for _ in range(3):
+                await writer.submit(direct(alice.id, bob.id))
+            await asyncio.sleep(0.01)
+            blocked = asyncio.ensure_future(writer.submit(direct(alice.id, bob.id)))
+            await asyncio.sleep(0.05)
+            waited = not blocked.done()
+            released.set()
+            await asyncio.wait_for(blocked, 1)
+            await writer.flush()
+        finally:
+            await writer.stop()
+        return waited, writer.queue_size
+
+    waited, queue_size = client.portal.call(scenario)
+    assert waited
+    assert queue_size == 0
+
+
+def test_bad_rows_do_not_drop_the_rest_of_the_batch(client, register, direct_chat):
+    alice, bob = register(), register()
+    _, existing_id = direct_chat(alice, bob, "original")
+
+    async def scenario():
+        writer = MessageWriter(async_session_factory, batch_size=10, flush_interval=0.05)
+        await writer.start()
+        good = [direct(alice.id, bob.id, "first"), direct(bob.id, alice.id, "second")]
+        duplicate = direct(alice.id, bob.id, "duplicate", message_id=existing_id)
+        ghost = direct(alice.id, 10 ** 9, "nobody")
+        try:
+            for message in (good[0], duplicate, ghost, good[1]):
+                await writer.submit(message)
+            await writer.flush()
+        finally:
+            await writer.stop()
+        return await stored([existing_id, ghost.id, *(m.id for m in good)])
+
+    rows = client.portal.call(scenario)
+    assert sorted(rows.values()) == ["first", "original", "second"]
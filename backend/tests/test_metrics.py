@@ -0,0 +1,31 @@
+import pytest
+
+from app.config import get_settings
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "")
+    monkeypatch.setattr(settings, "ENV", "dev")
+    return settings
+
+
+def test_metrics_are_open_without_token_only_in_dev(client, settings):
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/stats/chat").status_code == 200
+
+    settings.ENV = "prod"
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/stats/chat").status_code == 403
+
+
+def test_metrics_require_the_configured_token(client, settings):
+    settings.ENV = "prod"
+    settings.METRICS_TOKEN = "secret"
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/stats/chat", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200 and "chat_connections" in response.text
+    assert client.get("/stats/chat", headers={"Authorization": "Bearer secret"}).status_code == 200
@@ -0,0 +1,143 @@
+from app.routers.chat import Connection, manager
+
+
+def test_subscribe_of_a_closed_socket_does_not_leave_watchers(client, register, direct_chat):
+    user, contact = register(), register()
+    direct_chat(user, contact)
+    # Сокет, закрывшийся во время подписки: в реестре его уже нет
+    closed = Connection(user.id, websocket=None, max_queue=10)
+
+    client.portal.call(manager.subscribe, closed, [contact.id], [])
+    assert not any(closed in watchers for watchers in manager.presence._watchers.values())
+    assert closed.users == set()
+
+
+def test_remote_typing_events_are_filtered_by_subscription(client, register, direct_chat):
+    import json
+
+    from app.presence import TYPING_KIND
+
+    alice, bob = register(), register()
+    conversation_id, _ = direct_chat(bob, alice)
+    # Порядок ключей не важен: событие typing распознаётся по kind конверта, а не по JSON
+    typing = json.dumps({"conversation_id": conversation_id, "user_ids": [bob.id], "type": "typing"})
+    marker = json.dumps({"type": "marker"})
+
+    with client.websocket_connect(f"/chat/ws?token={alice.token}") as ws:
+        ws.receive_json()
+        client.portal.call(manager._deliver_local, alice.id, typing, TYPING_KIND)
+        client.portal.call(manager._deliver_local, alice.id, marker, "")
+        assert ws.receive_json() == {"type": "marker"}
+
+        ws.send_json({"type": "subscribe", "users": [bob.id], "conversations": [conversation_id]})
+        assert ws.receive_json()["type"] == "presence"
+        client.portal.call(manager._deliver_local, alice.id, typing, TYPING_KIND)
+        assert ws.receive_json()["type"] == "typing"
+
+
+def test_typers_do_not_receive_their_own_typing():
+    import asyncio
+
+    from app.presence import TypingCoalescer
+
+    async def scenario():
+        sent = []
+
+        async def emit(recipients, event):
+            sent.append((set(recipients), event["user_ids"]))
+
+        typing = TypingCoalescer(emit, interval=0, ttl=5)
+        members = frozenset({1, 2, 3})
+        await typing.touch("c", {"type": "typing"}, members, 1)
+        first, sent[:] = list(sent), []
+        await typing.touch("c", {"type": "typing"}, members, 2)
+        return first, sent
+
+    first, second = asyncio.run(scenario())
+    # Единственного печатающего не уведомляем о нём самом
+    assert first == [({2, 3}, [1])]
+    # Двое печатают: каждый видит другого, остальные — обоих
+    assert sorted(second, key=lambda item: item[1]) == [({2}, [1]), ({3}, [1, 2]), ({1}, [2])]
+
+
+def test_presence_sends_a_snapshot_then_only_changes():
+    import asyncio
+
+    from app.presence import PresenceTracker
+
+    class Socket:
+        def __init__(self, name):
+            self.name = name
+            self.users = set()
+
+    async def scenario():
+        online = {1}
+        sent = []
+
+        async def lookup(user_ids):
+            return {user_id for user_id in user_ids if user_id in online}
+
+        tracker = PresenceTracker(lookup, lambda connection, frame: sent.append((connection.name, frame.event)))
+        first, second = Socket("first"), Socket("second")
+        snapshot = await tracker.subscribe(first, [1, 2])
+        await tracker.subscribe(second, [2])
+        await tracker._poll()
+        unchanged = list(sent)
+        # 1 ушёл, 2 пришёл: каждому сокету — одним кадром и только о своих подписках
+        online.clear()
+        online.add(2)
+        await tracker._poll()
+        tracker.unsubscribe(second)
+        return snapshot, unchanged, sent, tracker._watchers
+
+    snapshot, unchanged, sent, watchers = asyncio.run(scenario())
+    assert snapshot == {"type": "presence", "online": [1], "offline": [2]}
+    assert unchanged == []
+    assert sorted(sent, key=lambda item: item[0]) == [
+        ("first", {"type": "presence", "online": [2], "offline": [1]}),
+        ("second", {"type": "presence", "online": [2], "offline": []}),
+    ]
+    assert set(watchers) == {1, 2} and all(len(connections) == 1 for connections in watchers.values())
+
+
+def test_keystrokes_are_coalesced_per_interval_and_expire():
+    import asyncio
+
+    from app.presence import TypingCoalescer
+
+    async def scenario():
+        sent = []
+
+        async def emit(recipients, event):
+            sent.append(event["user_ids"])
+
+        typing = TypingCoalescer(emit, interval=0.05, ttl=0.2)
+        await typing.start()
+        try:
+            for user_id in (1, 1, 2, 1):
+                await typing.touch("c", {"type": "typing"}, frozenset({1, 2, 3}), user_id)
+            immediate = list(sent)
+            await asyncio.sleep(0.5)
+        finally:
+            await typing.stop()
+        return immediate, sent, len(typing)
+
+    immediate, sent, states = asyncio.run(scenario())
+    # Первое нажатие — сразу, остальные в окне — одним событием в конце интервала
+    assert immediate == [[1]]
+    assert [1, 2] in sent[1:] and [2] in sent[1:]
+    # Без нажатий дольше ttl индикатор гаснет пустым списком, состояние удаляется
+    assert sent[-1] == []
+    assert states == 0
+
+
+def test_subscribe_is_limited_to_own_conversations_and_contacts(client, register, direct_chat):
+    alice, bob, stranger = register(), register(), register()
+    conversation_id, _ = direct_chat(alice, bob)
+    other_id, _ = direct_chat(bob, stranger)
+
+    with client.websocket_connect(f"/chat/ws?token={alice.token}") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "subscribe", "users": [bob.id, stranger.id], "conversations": [conversation_id, other_id]})
+        assert ws.receive_json() == {"error": "not a member of the conversation", "conversation_ids": [other_id]}
+        assert ws.receive_json() == {"type": "presence", "online": [], "offline": [bob.id]}
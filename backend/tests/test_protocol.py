@@ -0,0 +1,57 @@
+import msgpack
+import pytest
+
+from app.protocol import CODECS, JSON, Frame
+
+
+def test_frame_encodes_once_per_codec_and_reuses_backplane_json():
+    packer = CODECS["msgpack"]
+    calls = []
+
+    class CountingCodec:
+        name = "counting"
+
+        def encode(self, event):
+            calls.append(event)
+            return "x"
+
+    frame = Frame({"id": 1, "text": "привет"})
+    assert frame.encode(packer) is frame.encode(packer)
+    for _ in range(3):
+        frame.encode(CountingCodec())
+    assert len(calls) == 1
+
+    # Пришедшее через backplane отдаётся JSON-клиентам как есть, msgpack-клиентам — перекодированным
+    text = '{"id":2,"text":"hi"}'
+    relayed = Frame.from_json(text)
+    assert relayed.json is text
+    assert msgpack.unpackb(relayed.encode(packer)) == {"id": 2, "text": "hi"}
+
+
+def test_msgpack_decode_errors_are_value_errors():
+    packer = CODECS["msgpack"]
+    assert packer.decode(packer.encode({1: "int key"})) == {1: "int key"}
+    with pytest.raises(ValueError):
+        packer.decode(b"\xc1")
+    with pytest.raises(ValueError):
+        JSON.decode("{not json")
+
+
+def test_socket_speaks_the_negotiated_format(client, register):
+    user = register()
+
+    with client.websocket_connect(f"/chat/ws?token={user.token}", subprotocols=["mess.unknown.v1", "mess.msgpack.v1"]) as ws:
+        assert ws.accepted_subprotocol == "mess.msgpack.v1"
+        assert msgpack.unpackb(ws.receive_bytes())["type"] == "backlog"
+        ws.send_bytes(msgpack.packb({"text": "echo"}))
+        assert msgpack.unpackb(ws.receive_bytes())["text"] == "echo"
+
+    with client.websocket_connect(f"/chat/ws?token={user.token}&proto=msgpack") as ws:
+        assert ws.accepted_subprotocol is None
+        msgpack.unpackb(ws.receive_bytes())
+
+    # Старые клиенты без выбора формата — JSON в текстовых кадрах
+    with client.websocket_connect(f"/chat/ws?token={user.token}") as ws:
+        ws.receive_json()
+        ws.send_text("plain text")
+        assert ws.receive_json()["text"] == "plain text"
@@ -0,0 +1,76 @@
+import pytest
+
+from app.config import get_settings
+from app.ratelimit import Limit, MemoryBackend, TokenBucket, get_limit
+
+
+def test_limit_parsing():
+    assert Limit.parse("x", "20/minute") == Limit("x", 20 / 60, 20.0)
+    assert Limit.parse("x", "5") == Limit("x", 5.0, 5.0)
+    for spec in ("0/minute", "ten/minute", "5/fortnight"):
+        with pytest.raises(ValueError):
+            Limit.parse("x", spec)
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    limit = Limit("x", rate=2.0, burst=3.0)
+    bucket = TokenBucket(limit.burst, now=100.0)
+    assert [bucket.take(limit, 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(limit, 100.0) == pytest.approx(0.5)
+    # Через полсекунды накопился ровно один токен; отказ его не тратит
+    assert bucket.take(limit, 100.5) == 0.0
+    assert bucket.take(limit, 100.5) == pytest.approx(0.5)
+    # Простой не копит больше burst
+    assert [bucket.take(limit, 1000.0) for _ in range(4)][-1] > 0
+
+
+def test_memory_backend_evicts_the_oldest_key_when_full():
+    limit = Limit("x", rate=1 / 3600, burst=1.0)
+    backend = MemoryBackend(max_keys=2)
+    assert backend.hit_nowait(limit, "a") == 0.0
+    assert backend.hit_nowait(limit, "a") > 0
+    backend.hit_nowait(limit, "b")
+    backend.hit_nowait(limit, "c")
+    assert list(backend._buckets) == ["b", "c"]
+    # Вытесненный ключ начинает с полного ведра
+    assert backend.hit_nowait(limit, "a") == 0.0
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    settings = get_settings()
+
+    def set_limits(**specs):
+        monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+        for name, spec in specs.items():
+            monkeypatch.setattr(settings, f"RATE_LIMIT_{name.upper()}", spec)
+        get_limit.cache_clear()
+
+    yield set_limits
+    get_limit.cache_clear()
+
+
+def test_login_attempts_are_limited_per_account_before_hashing(client, register, limits):
+    victim = register()
+    email = client.get("/auth/me", headers=victim.headers).json()["email"]
+    limits(login_account="2/minute")
+
+    attempts = [client.post("/auth/login", data={"username": email, "password": "wrong"}) for _ in range(3)]
+    assert [response.status_code for response in attempts] == [400, 400, 429]
+    assert int(attempts[-1].headers["Retry-After"]) > 0
+    # Ведро своё у каждого аккаунта
+    other = client.get("/auth/me", headers=register().headers).json()["email"]
+    assert client.post("/auth/login", data={"username": other, "password": "pw"}).status_code == 200
+
+
+def test_chat_messages_over_the_limit_get_an_error_frame(client, register, limits):
+    user = register()
+    limits(ws_messages="2/minute")
+
+    with client.websocket_connect(f"/chat/ws?token={user.token}") as ws:
+        ws.receive_json()
+        for text in ("one", "two", "three"):
+            ws.send_json({"text": text})
+        events = [ws.receive_json() for _ in range(3)]
+    assert [event.get("text") for event in events[:2]] == ["one", "two"]
+    assert events[2]["error"] == "rate limited" and events[2]["retry_after"] > 0
@@ -0,0 +1,92 @@
+import asyncio
+
+from sqlalchemy.dialects import postgresql
+
+from app.db import async_session_factory
+from app.search import MemorySearchIndex, _search_postgres
+
+
+def search(client, user, q, path="/search/messages", **params):
+    return client.get(path, params={"q": q, **params}, headers=user.headers)
+
+
+def test_memory_search_ranks_requires_all_terms_and_pages(client, register, direct_chat):
+    alice, bob = register(), register()
+    direct_chat(alice, bob, "kiwi kiwi kiwi")
+    direct_chat(bob, alice, "kiwi salad with many other words in it")
+    direct_chat(alice, bob, "kiwi salad")
+    direct_chat(alice, bob, "salad only")
+
+    hits = search(client, alice, "kiwi").json()["items"]
+    assert [hit["message"]["content"] for hit in hits][0] == "kiwi kiwi kiwi"
+    assert len(hits) == 3
+    assert [hit["rank"] for hit in hits] == sorted((hit["rank"] for hit in hits), reverse=True)
+    assert [hit["message"]["content"] for hit in search(client, bob, "Salad KIWI").json()["items"]] == [
+        "kiwi salad", "kiwi salad with many other words in it",
+    ]
+
+    paged, cursor = [], None
+    while True:
+        body = search(client, alice, "kiwi", limit=1, **({"cursor": cursor} if cursor else {})).json()
+        paged += [hit["message"]["id"] for hit in body["items"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert paged == [hit["message"]["id"] for hit in hits]
+    assert search(client, alice, "?!").json()["items"] == []
+
+
+def test_search_only_covers_the_callers_conversations(client, register, direct_chat):
+    alice, bob, mallory = register(), register(), register()
+    conversation_id, _ = direct_chat(alice, bob, "papaya secret")
+
+    assert search(client, mallory, "papaya").json()["items"] == []
+    assert search(client, mallory, "papaya", path=f"/conversations/{conversation_id}/search").status_code == 404
+    in_conversation = search(client, bob, "papaya", path=f"/conversations/{conversation_id}/search").json()["items"]
+    assert [hit["message"]["content"] for hit in in_conversation] == ["papaya secret"]
+    assert search(client, bob, "papaya", cursor="garbage").status_code == 400
+
+
+def test_memory_index_loads_stored_messages(client, register, direct_chat):
+    alice, bob = register(), register()
+    _, message_id = direct_chat(alice, bob, "mango stored earlier")
+
+    async def load():
+        index = MemorySearchIndex(async_session_factory)
+        index.LOAD_BATCH_SIZE = 2
+        await index._load()
+        return index
+
+    index = client.portal.call(load)
+    assert index.loaded
+    conversations = set(index._conversations.values())
+    assert [hit for _, hit in index.search(["mango"], conversations, 10)] == [message_id]
+
+
+class CapturingSession:
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return []
+
+
+def compile_postgres(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_postgres_query_uses_the_indexed_expression_and_keyset_cursor():
+    session = CapturingSession()
+    asyncio.run(_search_postgres(session, 7, "kiwi salad", None, 21, (0.5, 123)))
+    asyncio.run(_search_postgres(session, 7, "kiwi", 42, 21, None))
+    everywhere, single = (compile_postgres(statement) for statement in session.statements)
+
+    # Совпадает с выражением GIN-индекса ix_messages_content_search
+    document = "to_tsvector('simple'::regconfig, messages.content)"
+    assert f"{document} @@ websearch_to_tsquery('simple'::regconfig, 'kiwi salad')" in everywhere
+    assert "memberships.user_id = 7" in everywhere
+    assert "messages.id < 123" in everywhere
+    assert "ORDER BY ts_rank_cd" in everywhere and "DESC, messages.id DESC" in everywhere
+    assert "LIMIT 21" in everywhere
+    assert "messages.conversation_id = 42" in single and "memberships" not in single
@@ -0,0 +1,92 @@
+import asyncio
+import io
+import os
+
+from PIL import Image
+
+from app import uploads
+from app.uploads import SessionLock, create_session, remove_session, session_path
+
+
+def noisy_png(size=(300, 300)) -> bytes:
+    # Шум почти не сжимается: файл больше нескольких чанков шифрования
+    out = io.BytesIO()
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(out, "PNG")
+    return out.getvalue()
+
+
+def wait_finalized(client, upload_id, headers) -> dict:
+    for _ in range(200):
+        state = client.get(f"/media/uploads/{upload_id}", headers=headers).json()
+        if state["status"] != "finalizing":
+            return state
+        client.portal.call(asyncio.sleep, 0.02)
+    raise AssertionError("upload is still finalizing")
+
+
+def test_resumable_upload_continues_from_the_accepted_offset(client, register):
+    user = register()
+    data = noisy_png()
+    created = client.post("/media/uploads", json={"length": len(data), "content_type": "image/png"}, headers=user.headers)
+    assert created.status_code == 201
+    upload_id = created.json()["id"]
+    url = f"/media/uploads/{upload_id}"
+
+    # Первая часть — не на границе чанка; обрыв после неё не теряет принятое
+    first = len(data) // 3 + 17
+    assert client.put(url, content=data[:first], headers={**user.headers, "Upload-Offset": "0"}).status_code == 204
+    assert client.head(url, headers=user.headers).headers["Upload-Offset"] == str(first)
+
+    stale = client.put(url, content=data[:10], headers={**user.headers, "Upload-Offset": "0"})
+    assert stale.status_code == 409 and stale.headers["Upload-Offset"] == str(first)
+    assert client.post(f"{url}/finalize", headers=user.headers).status_code == 409
+
+    rest = client.put(url, content=data[first:] + b"x", headers={**user.headers, "Upload-Offset": str(first)})
+    assert rest.status_code == 413
+    offset = int(client.head(url, headers=user.headers).headers["Upload-Offset"])
+    assert client.put(url, content=data[offset:], headers={**user.headers, "Upload-Offset": str(offset)}).status_code == 204
+
+    assert client.post(f"{url}/finalize", headers=user.headers).status_code == 202
+    state = wait_finalized(client, upload_id, user.headers)
+    assert state["status"] == "done", state
+    assert client.get(f"/media/{state['result']['filename']}").content == data
+
+
+def test_sessions_are_private_to_their_owner(client, register):
+    owner, other = register(), register()
+    upload_id = client.post("/media/uploads", json={"length": 10, "content_type": "image/png"}, headers=owner.headers).json()["id"]
+    assert client.get(f"/media/uploads/{upload_id}", headers=other.headers).status_code == 404
+    assert client.delete(f"/media/uploads/{upload_id}", headers=other.headers).status_code == 404
+    assert client.delete(f"/media/uploads/{upload_id}", headers=owner.headers).status_code == 204
+    assert client.get(f"/media/uploads/{upload_id}", headers=owner.headers).status_code == 404
+
+
+def test_lock_taken_on_a_removed_lock_file_is_not_granted(monkeypatch):
+    state = create_session(1, 10, "image/png", None)
+    path = session_path(state.id, "lock")
+    holder = SessionLock(state.id)
+    assert holder.acquire()
+    # Параллельный запрос успел открыть .lock до удаления сессии
+    stale_fd = os.open(path, os.O_RDWR)
+    remove_session(state.id)
+    holder.release()
+
+    current = SessionLock(state.id)
+    assert current.acquire()  # новый .lock после удаления
+
+    real_open = os.open
+    opened = []
+
+    def open_stale_first(*args, **kwargs):
+        opened.append(args[0])
+        return stale_fd if len(opened) == 1 else real_open(*args, **kwargs)
+
+    monkeypatch.setattr(uploads.os, "open", open_stale_first)
+    late = SessionLock(state.id)
+    # Отвязанный inode свободен, но блокировка на нём не считается: второй попыткой — занятый новый .lock
+    assert not late.acquire()
+    assert len(opened) == 2
+    current.release()
+    assert late.acquire()
+    late.release()
+    remove_session(state.id)
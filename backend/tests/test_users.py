@@ -0,0 +1,41 @@
+def test_directory_pages_follow_the_cursor(client, register):
+    viewer = register()
+    created = {register().id for _ in range(5)}
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/users/", params=params, headers=viewer.headers)
+        assert response.status_code == 200
+        page = [user["id"] for user in response.json()]
+        assert len(page) <= 2 and "password_hash" not in response.text
+        seen += page
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert seen == sorted(seen) and len(seen) == len(set(seen))
+    assert created | {viewer.id} <= set(seen)
+
+
+def test_unchanged_page_is_not_modified_until_the_directory_changes(client, register):
+    viewer = register()
+    first = client.get("/users/", params={"limit": 200}, headers=viewer.headers)
+    etag = first.headers["ETag"]
+
+    again = client.get("/users/", params={"limit": 200}, headers={**viewer.headers, "If-None-Match": etag})
+    assert again.status_code == 304
+
+    register()
+    changed = client.get("/users/", params={"limit": 200}, headers={**viewer.headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+
+def test_prefix_search_escapes_like_wildcards(client, register):
+    viewer = register()
+    email = client.get("/auth/me", headers=viewer.headers).json()["email"]
+
+    found = client.get("/users/", params={"q": email.split("@")[0]}, headers=viewer.headers).json()
+    assert viewer.id in [user["id"] for user in found]
+    # % — обычный символ, а не шаблон LIKE
+    assert client.get("/users/", params={"q": "user%"}, headers=viewer.headers).json() == []